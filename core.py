@@ -2,6 +2,8 @@
 import os                           # os function, i.e. checking file status
 from itertools import cycle         # allows easy circular choice list
 import atexit                       # launch a function at exit
+import hashlib                      # hash of the benchmark's last image
+from time import perf_counter       # benchmark's frame times
 
 # External, non built-in modules
 from random import randint
@@ -10,12 +12,14 @@ import glfw                         # lean window system wrapper for OpenGL
 import numpy as np                  # all matrix manipulations & OpenGL args
 import assimpcy
 from utils.primitives import Mesh, init_cos_sin
-from utils.shaders import Shader # 3D resource loader
+from utils.shaders import Shader, FrameUniforms, FRAME_DATA, INSTANCES, INSTANCES_BINDING, shader_source # 3D resource loader
 
 
 # our transform functions
-from utils.transform import identity, rotate, scale, vec, translate
-from utils.camera import Camera
+from utils.transform import identity, rotate, scale, vec, translate, transform_box, UNBOUNDED
+from utils.camera import Camera, Frustum
+from utils.profiler import Profiler
+from utils.gl_state import state
 
 # our objects
 from world.block import Chunk
@@ -29,14 +33,18 @@ from world.tree.tree import make_tree, move_tree
 # ------------  Node is the core drawable for hierarchical scene graphs -------
 class Node:
     """ Scene graph transform and parameter broadcast node """
+    animated = False  # True for nodes changing their own transform each frame (KeyFrameControlNode)
+
     def __init__(self, children=(), transform=identity()):
         self.transform = transform
         self.world_transform = identity()
         self.children = list(iter(children))
+        self.draw_list = None  # flattened graph, built by compile()
 
     def add(self, *drawables):
         """ Add drawables to this node, simply updating children list """
         self.children.extend(drawables)
+        self.draw_list = None  # the graph changed => compile it again
 
     def draw(self, model=identity(), **other_uniforms):
         """ Recursive draw, passing down updated model matrix. """
@@ -44,11 +52,267 @@ class Node:
         for child in self.children:
             child.draw(model=self.world_transform, **other_uniforms)
 
+    def compile(self):
+        """
+        Flat DrawList of the graph below this node, built on first use. Only additions to this node are tracked,
+        set draw_list back to None after modifying a static part of the graph deeper down.
+        """
+        if self.draw_list is None:
+            self.draw_list = DrawList(self)
+        return self.draw_list
+
+    def draw_compiled(self, **other_uniforms):
+        """ Same result as draw(), but through the compiled draw list """
+        self.compile().draw(**other_uniforms)
+
     def key_handler(self, key):
         """ Dispatch keyboard events to children with key handler """
         for child in (c for c in self.children if hasattr(c, 'key_handler')):
             child.key_handler(key)
 
+
+class AnimatedSubtree:
+    """ Part of a DrawList below an animated node, its matrices are recomputed only when it moved """
+    def __init__(self, node, path, parent):
+        self.node = node
+        self.path = path          # transform from the parent subtree's node (or the world) to the node's parent
+        self.parent = parent      # enclosing AnimatedSubtree, None if only static nodes above
+        self.world = None         # world matrix of the animated node
+        self.dirty = True
+        self.nodes = []           # (static node, matrix relative to the animated node)
+        self.entries = []         # (entry index, matrix relative to the animated node)
+
+
+class DrawList:
+    """
+    Scene graph flattened into entries (drawable, world matrix), in the drawing order of Node.draw.
+    Static matrices are computed once when compiling, each frame only the animated nodes are evaluated and
+    the subtrees below the ones whose transform changed (dirty) get their matrices updated.
+    A drawable reused under several placements (shared subtree) is drawn with a single instanced call when
+    its shader supports it, the matrices of its instances being read from one ssbo.
+    Skinned entries get the bones of their own placement (the bone nodes are shared by all of them).
+    With a frustum, the boxes of the children of the root (union of their entries' boxes) are tested first,
+    then the entries of the visible ones: the culled entries are skipped, or left out of the instances.
+    """
+    def __init__(self, root):
+        self.drawables = []  # drawable of each entry
+        self.clusters = []   # first entry of each child of the root holding drawables
+        self.subtrees = []   # parents before their children
+        self.visits = {}     # node -> (path, subtree, matrix) of each of its placements
+        self.paths = {}      # entry -> path of child indices from the root, for the skinned entries
+        matrices = []
+        self.flatten(root, identity(), None, matrices, is_root=True)
+        # bones of each skinned entry, taken in the placement closest to the entry's one
+        self.bones = {index: [self.placement(bone, self.paths[index]) for bone in self.drawables[index].bone_nodes]
+                      for index in self.paths}
+        self.visits = None
+        self.matrices = np.array(matrices, dtype=np.float32).reshape(-1, 4, 4)
+        # a shared animated node appears in several subtrees but is evaluated once per frame,
+        # all the keyframed ones together in one vectorized evaluation
+        self.animated_nodes = list(dict.fromkeys(subtree.node for subtree in self.subtrees))
+        keyed = [node for node in self.animated_nodes if KeyFrameControlNode and isinstance(node, KeyFrameControlNode)]
+        self.keyframe_batch = KeyFrameBatch(keyed, ANIMATION_RATE) if keyed else None
+        self.other_animated = [node for node in self.animated_nodes if node not in keyed]
+        node_index = {node: index for index, node in enumerate(self.animated_nodes)}
+        self.keyed_index = np.array([node_index[node] for node in keyed], dtype=int)
+        self.dirty_entries = 0  # number of matrices recomputed during the last update
+
+        # entries below each subtree (nested ones included), their boxes give the size of the animated nodes
+        below = [[index for index, local in subtree.entries] for subtree in self.subtrees]
+        position = {subtree: index for index, subtree in enumerate(self.subtrees)}
+        for index in reversed(range(len(self.subtrees))):
+            if self.subtrees[index].parent is not None:
+                below[position[self.subtrees[index].parent]].extend(below[index])
+        sized = [index for index in range(len(self.subtrees)) if below[index]]
+        self.lod_entries = np.array([entry for index in sized for entry in below[index]], dtype=int)
+        self.lod_starts = np.cumsum([0] + [len(below[index]) for index in sized[:-1]]).astype(int)
+        self.lod_nodes = np.array([node_index[self.subtrees[index].node] for index in sized], dtype=int)
+
+        # world boxes of the entries, the ones without bounds are never culled
+        bounds = [getattr(drawable, 'bounds', None) for drawable in self.drawables]
+        self.bounded = np.array([box is not None for box in bounds], dtype=bool)
+        self.local_boxes = np.array([UNBOUNDED if box is None else box for box in bounds]).reshape(-1, 2, 3)
+        self.boxes = np.empty_like(self.local_boxes)
+        self.update_boxes(np.arange(len(self.drawables)))
+        self.clusters = np.unique(np.array(self.clusters, dtype=int))
+        self.visible = np.ones(len(self.drawables), dtype=bool)
+        self.batch()
+
+    def flatten(self, node, model, subtree, matrices, is_root=False, path=()):
+        """
+        model: transform from the current animated node (or the world) to the node's parent,
+        path: child indices from the root to the node
+        """
+        if node.animated:
+            subtree = AnimatedSubtree(node, model, subtree)
+            self.subtrees.append(subtree)
+            model = identity()
+        else:
+            model = model @ node.transform
+            if subtree is None:
+                node.world_transform = model
+            else:
+                subtree.nodes.append((node, model))
+        self.visits.setdefault(node, []).append((path, subtree, model))
+
+        for position, child in enumerate(node.children):
+            start = len(self.drawables)
+            if isinstance(child, Node):
+                self.flatten(child, model, subtree, matrices, path=path + (position,))
+            else:
+                if subtree is not None:
+                    subtree.entries.append((len(self.drawables), model))
+                if getattr(child, 'bone_nodes', None):
+                    self.paths[len(self.drawables)] = path + (position,)
+                self.drawables.append(child)
+                matrices.append(model)
+            if is_root and len(self.drawables) > start:  # children without any drawable have no cluster
+                self.clusters.append(start)
+
+    def placement(self, node, path):
+        """ (subtree, matrix) of node's visit sharing the longest path with 'path', (node, None) if never visited """
+        def shared(visit):
+            depth = 0
+            while depth < min(len(visit[0]), len(path)) and visit[0][depth] == path[depth]:
+                depth += 1
+            return depth
+        visits = self.visits.get(node)
+        if not visits:
+            return node, None
+        _, subtree, model = max(visits, key=shared)
+        return subtree, model
+
+    def bone_transforms(self, index):
+        """ world transforms of the bones of skinned entry 'index' """
+        transforms = []
+        for subtree, model in self.bones[index]:
+            if model is None:  # bone outside of the compiled graph
+                transforms.append(subtree.world_transform)
+            else:
+                transforms.append(model if subtree is None else subtree.world @ model)
+        return transforms
+
+    def batch(self):
+        """ groups the entries by drawable: (drawable, entries, first instance), None for single draws """
+        per_drawable = {}
+        for index, drawable in enumerate(self.drawables):
+            per_drawable.setdefault(drawable, []).append(index)
+
+        self.draws = []
+        instances = 0
+        for drawable, indices in per_drawable.items():
+            if len(indices) > 1 and getattr(drawable, 'instanceable', False):
+                self.draws.append((drawable, np.array(indices), instances))
+                instances += len(indices)
+            else:
+                self.draws.extend((drawable, np.array([index]), None) for index in indices)
+
+        self.instances = np.zeros((instances, 4, 4), dtype=np.float32)
+        self.instances_dirty = True
+        self.ssbo = GL.glGenBuffers(1) if instances else None
+        if self.ssbo is not None:
+            state.bind_buffer(GL.GL_SHADER_STORAGE_BUFFER, self.ssbo)
+            GL.glBufferData(GL.GL_SHADER_STORAGE_BUFFER, self.instances.nbytes, None, GL.GL_DYNAMIC_DRAW)
+
+    def update_boxes(self, indices):
+        self.boxes[indices] = transform_box(self.matrices[indices], self.local_boxes[indices])
+        self.boxes[indices[~self.bounded[indices]]] = UNBOUNDED
+
+    def animation_levels(self, scheduler):
+        """
+        AnimationScheduler level of each animated node, the best one among its placements. They are sized
+        with the boxes & visibility of the entries below them from the previous frame.
+        """
+        levels = np.full(len(self.animated_nodes), scheduler.FULL)  # nothing drawn below => can't tell
+        if len(self.lod_entries):
+            boxes = np.empty((len(self.lod_starts), 2, 3))
+            boxes[:, 0] = np.minimum.reduceat(self.boxes[self.lod_entries, 0], self.lod_starts)
+            boxes[:, 1] = np.maximum.reduceat(self.boxes[self.lod_entries, 1], self.lod_starts)
+            visible = np.logical_or.reduceat(self.visible[self.lod_entries], self.lod_starts)
+            levels[self.lod_nodes] = scheduler.FROZEN
+            np.minimum.at(levels, self.lod_nodes, scheduler.levels(boxes, visible))
+        return levels
+
+    def update(self, time=None, scheduler=None):
+        """
+        evaluates the animated nodes at the frame's time & propagates the changes to their subtrees.
+        With a scheduler, only the nodes due this frame are evaluated.
+        """
+        due = np.ones(len(self.animated_nodes), dtype=bool)
+        if scheduler is not None and self.animated_nodes:
+            due = scheduler.due(self.animation_levels(scheduler))
+        changed = {node: bool(node_due) and node.animate(time) for node, node_due in zip(self.animated_nodes, due)
+                   if node in self.other_animated}
+        if self.keyframe_batch is not None:
+            changed.update(zip(self.keyframe_batch.nodes, self.keyframe_batch.animate(time, due[self.keyed_index])))
+        dirty = []
+        for subtree in self.subtrees:
+            parent_dirty = subtree.parent is not None and subtree.parent.dirty
+            subtree.dirty = changed[subtree.node] or parent_dirty or subtree.world is None
+            if not subtree.dirty:
+                continue
+            parent = subtree.path if subtree.parent is None else subtree.parent.world @ subtree.path
+            subtree.world = parent @ subtree.node.transform
+            subtree.node.world_transform = subtree.world
+            for node, local in subtree.nodes:
+                node.world_transform = subtree.world @ local
+            for index, local in subtree.entries:
+                self.matrices[index] = subtree.world @ local
+                dirty.append(index)
+        self.dirty_entries = len(dirty)
+        if dirty:
+            self.update_boxes(np.array(dirty))
+            self.instances_dirty = True
+
+    def cull(self, frustum):
+        """ visibility of the entries, root's children first then their entries """
+        if frustum is None or not len(self.drawables):
+            visible = np.ones(len(self.drawables), dtype=bool)
+        else:
+            clusters = np.empty((len(self.clusters), 2, 3))
+            clusters[:, 0] = np.minimum.reduceat(self.boxes[:, 0], self.clusters)
+            clusters[:, 1] = np.maximum.reduceat(self.boxes[:, 1], self.clusters)
+            cluster_of = np.repeat(np.arange(len(self.clusters)), np.diff(np.append(self.clusters, len(self.drawables))))
+            candidates = np.flatnonzero(frustum.visible(clusters)[cluster_of])
+            visible = np.zeros(len(self.drawables), dtype=bool)
+            visible[candidates] = frustum.visible(self.boxes[candidates])
+            frustum.account(visible.sum(), len(visible))
+        if not np.array_equal(visible, self.visible):
+            self.instances_dirty = True
+        self.visible = visible
+
+    def draw(self, frustum=None, time=None, scheduler=None, **other_uniforms):
+        """ time: animation clock of the frame (Viewer.run), glfw's time if None, scheduler: AnimationScheduler """
+        self.update(time, scheduler)
+        self.cull(frustum)
+        if self.ssbo is not None:
+            state.bind_buffer_base(GL.GL_SHADER_STORAGE_BUFFER, INSTANCES_BINDING, self.ssbo)
+            if self.instances_dirty:  # visible instances packed at the beginning of their draw's range
+                for drawable, indices, first in self.draws:
+                    if first is not None:
+                        shown = indices[self.visible[indices]]
+                        self.instances[first:first + len(shown)] = self.matrices[shown]
+                state.bind_buffer(GL.GL_SHADER_STORAGE_BUFFER, self.ssbo)
+                GL.glBufferSubData(GL.GL_SHADER_STORAGE_BUFFER, 0, self.instances.nbytes, self.instances)
+                self.instances_dirty = False
+
+        for drawable, indices, first in self.draws:
+            count = np.count_nonzero(self.visible[indices])
+            if count == 0:
+                continue
+            if first is None and indices[0] in self.bones:
+                drawable.draw(model=self.matrices[indices[0]], bone_transforms=self.bone_transforms(indices[0]),
+                              **other_uniforms)
+            elif first is None:
+                drawable.draw(model=self.matrices[indices[0]], **other_uniforms)
+            else:
+                drawable.draw(instances=int(count), instance_offset=first, **other_uniforms)
+
+    def __del__(self):
+        if self.ssbo is not None:
+            state.delete_buffers([self.ssbo])
+
+
 class Animal(Node):
     """ Animal based on provided load function """
     def __init__(self, shader, path_obj):
@@ -56,7 +320,7 @@ class Animal(Node):
         self.add(*load(path_obj, shader))  # just load animal from file
 
 # -------------- 3D resource loader -------------------------------------------
-MAX_BONES = 128
+ANIMATION_RATE = None  # Hz, keyframes resampled at this rate for constant time lookups (DrawList), None = exact
 MAX_KOALA = 12
 
 # optionally load texture module
@@ -67,9 +331,11 @@ except ImportError:
 
 # optionally load animation module
 try:
-    from utils.animation import KeyFrameControlNode, Skinned
+    from utils.animation import KeyFrameControlNode, KeyFrameBatch, AnimationScheduler, Skinned, top_bone_weights
+    from utils.camera_path import CameraPath, CameraPlayer, CameraRecorder
 except ImportError:
-    KeyFrameControlNode, Skinned = None, None
+    KeyFrameControlNode, KeyFrameBatch, AnimationScheduler, Skinned, top_bone_weights = None, None, None, None, None
+    CameraPath, CameraPlayer, CameraRecorder = None, None, None
 
 
 def load(file, shader, tex_file=None, **params):
@@ -105,15 +371,17 @@ def load(file, shader, tex_file=None, **params):
 
     # ----- load animations
     def conv(assimp_keys, ticks_per_second):
-        """ Conversion from assimp key struct to our dict representation """
-        return {key.mTime / ticks_per_second: key.mValue for key in assimp_keys}
+        """ Conversion from assimp key struct to our (times, values) arrays representation """
+        times = np.array([key.mTime for key in assimp_keys], dtype=np.float32) / ticks_per_second
+        values = np.array([key.mValue for key in assimp_keys], dtype=np.float32)
+        return times, values
 
     # load first animation in scene file (could be a loop over all animations)
     transform_keyframes = {}
     if scene.HasAnimations:
         anim = scene.mAnimations[0]
         for channel in anim.mChannels:
-            # for each animation bone, store TRS dict with {times: transforms}
+            # for each animation bone, store TRS (times, values) arrays
             transform_keyframes[channel.mNodeName] = (
                 conv(channel.mPositionKeys, anim.mTicksPerSecond),
                 conv(channel.mRotationKeys, anim.mTicksPerSecond),
@@ -167,19 +435,15 @@ def load(file, shader, tex_file=None, **params):
 
         # ---- compute and add optional skinning vertex attributes
         if mesh.HasBones:
-            # skinned mesh: weights given per bone => convert per vertex for GPU
-            # first, populate an array with MAX_BONES entries per vertex
-            vbone = np.array([[(0, 0)] * MAX_BONES] * mesh.mNumVertices,
-                             dtype=[('weight', 'f4'), ('id', 'u4')])
-            for bone_id, bone in enumerate(mesh.mBones[:MAX_BONES]):
-                for entry in bone.mWeights:  # need weight,id pairs for sorting
-                    vbone[entry.mVertexId][bone_id] = (entry.mWeight, bone_id)
+            # skinned mesh: weights given per bone => flat (vertex, bone, weight) influences,
+            # then the 4 highest per vertex for the GPU
+            influences = [bone.mWeights for bone in mesh.mBones]
+            vertex_ids = np.array([entry.mVertexId for entries in influences for entry in entries], dtype=np.int64)
+            weights = np.array([entry.mWeight for entries in influences for entry in entries], dtype=np.float32)
+            bone_ids = np.repeat(np.arange(len(influences)), [len(entries) for entries in influences])
+            bone_ids, bone_weights = top_bone_weights(vertex_ids, bone_ids, weights, mesh.mNumVertices)
 
-            vbone.sort(order='weight')   # sort rows, high weights last
-            vbone = vbone[:, -4:]        # limit bone size, keep highest 4
-
-            attributes.update(bone_ids=vbone['id'],
-                              bone_weights=vbone['weight'])
+            attributes.update(bone_ids=bone_ids, bone_weights=bone_weights)
 
         new_mesh = Mesh(shader, attributes, index, **{**uniforms, **params})
 
@@ -196,45 +460,71 @@ def load(file, shader, tex_file=None, **params):
 
 
 # ------------  Viewer class & window management ------------------------------
+PROFILE_TRACE = "profile_trace.json"  # chrome trace of the last frames, written with 'T'
+CAMERA_PATH = "camera_path.json"      # flythrough recorded with 'R', played with 'V'
+VIEWPOINT_DURATION = 5.0              # s between two preset viewpoints of the default flythrough
+WIND_STEP = 30.0                      # degrees the wind over the ocean turns with 'O'
+
+
 class Viewer(Node):
     """ GLFW viewer window, with classic initialization & graphics loop """
 
-    def __init__(self, instructions, width=1600, height=1000, size=128):
+    def __init__(self, instructions, width=1600, height=1000, size=128, fft_backend="gpu",
+                 fft_size=256, ocean_cascades=None, ocean_baked_frames=0, smoke_particles=32768,
+                 splash_particles=1024, fog=True, headless=False, ocean_gpu_spectrum=False):
         super().__init__()
 
-        # initialize and automatically terminate glfw on exit
-        glfw.init()
-        atexit.register(glfw.terminate)
-
         # camera related attributes
         self.previous_mouse_pos = vec(0.0, 0.0)
         self.first_mouse_move = True
 
-        # version hints: create GL window with >= OpenGL 3.3 and core profile
-        glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
-        glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
-        glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL.GL_TRUE)
-        glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
-        glfw.window_hint(glfw.RESIZABLE, True)
-        self.win = glfw.create_window(width, height, 'Les koalas vont dominer le monde', None, None)
-
-        # make win's OpenGL context current; no OpenGL calls can happen before
-        glfw.make_context_current(self.win)
+        if headless:  # offscreen EGL context, no window nor events (main.py --benchmark)
+            from utils.headless import HeadlessContext
+            self.win = None
+            self.headless = HeadlessContext(width, height)
+        else:
+            self.headless = None
+            # initialize and automatically terminate glfw on exit
+            glfw.init()
+            atexit.register(glfw.terminate)
+
+            # version hints: create GL window with >= OpenGL 3.3 and core profile
+            glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
+            glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
+            glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL.GL_TRUE)
+            glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+            glfw.window_hint(glfw.RESIZABLE, True)
+            self.win = glfw.create_window(width, height, 'Les koalas vont dominer le monde', None, None)
+
+            # make win's OpenGL context current; no OpenGL calls can happen before
+            glfw.make_context_current(self.win)
 
         # initialize trackball
         self.camera = Camera()
+        self.frustum = Frustum()  # objects outside are not drawn, counters in self.frustum.stats
+        # cpu & gpu timings of the frame's stages, printed with 'T'
+        self.profiler = Profiler()
+        # distant & off-screen animations updated less often, counters in self.animation_scheduler.stats
+        self.animation_scheduler = AnimationScheduler() if AnimationScheduler else None
         self.mouse = (0, 0)
         self.mouse_move = False
 
         self.delta_time = 0.0
         self.last_frame = 0.0
 
+        # camera flythroughs, see utils/camera_path.py
+        self.camera_player = None
+        self.camera_recorder = None
+
         # register event handlers
-        glfw.set_key_callback(self.win, self.on_key)
-        glfw.set_cursor_pos_callback(self.win, self.on_mouse_move)
-        glfw.set_mouse_button_callback(self.win, self.on_mouse_click)
-        glfw.set_window_size_callback(self.win, self.on_size)
-        self.win_size = glfw.get_window_size(self.win)
+        if self.win is not None:
+            glfw.set_key_callback(self.win, self.on_key)
+            glfw.set_cursor_pos_callback(self.win, self.on_mouse_move)
+            glfw.set_mouse_button_callback(self.win, self.on_mouse_click)
+            glfw.set_window_size_callback(self.win, self.on_size)
+            self.win_size = glfw.get_window_size(self.win)
+        else:
+            self.win_size = (width, height)
 
 
         # useful message to check OpenGL renderer characteristics
@@ -246,9 +536,9 @@ class Viewer(Node):
         print(instructions)
 
         # initialize GL by setting viewport and default render characteristics
-        GL.glEnable(GL.GL_CULL_FACE)
-        GL.glCullFace(GL.GL_FRONT)
-        GL.glEnable(GL.GL_DEPTH_TEST)  # depth test now enabled (TP2)
+        state.enable(GL.GL_CULL_FACE)
+        state.cull_face(GL.GL_FRONT)
+        state.enable(GL.GL_DEPTH_TEST)  # depth test now enabled (TP2)
 
         GL.glClearColor(0.3, 0.4, 0.6, 0.1)
 
@@ -259,13 +549,17 @@ class Viewer(Node):
         self.skybox = Skybox(50.0)
         self.light_pos = vec(5000.0, 5000.0, -5000.0)
 
+        # camera & light uniforms, shared by all the programs
+        self.frame_uniforms = FrameUniforms()
+
         # terrain/ocean mesh related attributes
         self.chunk_size = size
-        self.chunk = Chunk(size, 4, N=4)
+        self.chunk = Chunk(size, 4, N=4, fft_backend=fft_backend, fft_size=fft_size, ocean_cascades=ocean_cascades,
+                           ocean_baked_frames=ocean_baked_frames, ocean_gpu_spectrum=ocean_gpu_spectrum)
 
         # particle system init
-        self.splash_ps = SplashParticleSystem()
-        self.smoke_ps = SmokeParticleSystem()
+        self.splash_ps = SplashParticleSystem(splash_particles)
+        self.smoke_ps = SmokeParticleSystem(smoke_particles)
 
         # initialization of the angles we will use for the cylinder
         slices = 10
@@ -278,13 +572,13 @@ class Viewer(Node):
                                      (-1300, 300, 600),
                                      (-900, 300, 800),
                                      (-700, 300, 800)]
-        self.turbine = []
+        self.turbines = Node()
         # we move manually each turbine in order to make the scene look good
         for translation in translations_wind_turbine:
             # they face the wind
             move_turbine = Node(transform=translate(translation) @ rotate((0, 1, 0), -40))
             move_turbine.add(turbine)
-            self.turbine.append(move_turbine)
+            self.turbines.add(move_turbine)
 
         # we create one tree 
         # decomment these following lines if you want to draw the tree
@@ -303,8 +597,9 @@ class Viewer(Node):
                        8: quaternion_from_axis_angle((1, 0, 1), 0)}
         scale_keys = {0: 1, 1: 0.95, 2: 1, 4: 1.05, 6: 1} # they also breathe a lot
         keynode = KeyFrameControlNode(translate_keys, rotate_keys, scale_keys, modulo=8)
-        shader_for_animals = Shader(vertex_source="world/animals/shaders/texture.vert",
-                                    fragment_source="world/animals/shaders/texture.frag")
+        shader_for_animals = Shader(vertex_source=shader_source("world/animals/shaders/texture.vert", FRAME_DATA,
+                                                                INSTANCES, INSTANCES_BINDING=INSTANCES_BINDING),
+                                    fragment_source=shader_source("world/animals/shaders/texture.frag", FRAME_DATA))
 
         # we load a Koala and we save it when it is correctly turned
         koala = Animal(shader_for_animals, 'world/animals/koala.obj')
@@ -361,32 +656,25 @@ class Viewer(Node):
 
         # init post-processing & fbo
         self.post_proc = PostProcessing(win_size=self.win_size)
-        self.is_fog = 1 # fog is enabled by default
+        self.is_fog = 1 if fog else 0 # fog is enabled by default
 
 
     def run(self):
         """ Main render loop for this OpenGL window """
         while not glfw.window_should_close(self.win):
-            # binding fbo (for post-processing)
-            self.post_proc.fbo.bind()
-
-            # clear buffers before rendering scene
-            GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
-
             # update viewer's attributes
             self.win_size = glfw.get_window_size(self.win)
             current_frame = glfw.get_time()
             self.delta_time = current_frame - self.last_frame
             self.last_frame = current_frame
 
-            # rendering scene first
-            self.render_scene()
+            # flythrough playback or recording of the camera
+            if self.camera_player is not None and not self.camera_player.update(self.camera, current_frame):
+                self.camera_player = None
+            if self.camera_recorder is not None:
+                self.camera_recorder.record(self.camera, current_frame)
 
-            # unbinding fbo
-            self.post_proc.fbo.unbind()
-
-            # post processing effects (fog...)
-            self.post_process()
+            self.draw_frame(current_frame, self.delta_time)
 
             # flush render commands, and swap draw buffers
             glfw.swap_buffers(self.win)
@@ -394,58 +682,128 @@ class Viewer(Node):
             # Poll for and process events
             glfw.poll_events()
 
-    def render_scene(self):
+    def draw_frame(self, time, dt):
+        """ scene rendered in the post-processing fbo at 'time', then post-processed to the screen """
+        # gpu timings of the frames old enough are collected here
+        self.profiler.begin_frame()
+
+        # binding fbo (for post-processing)
+        self.post_proc.fbo.bind()
 
-        self.chunk.update(self.last_frame)
-        view_matrix = self.camera.view_matrix()
-        projection_matrix = self.camera.projection_matrix(self.win_size)
+        # clear buffers before rendering scene
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+
+        # rendering scene first, everything animated at the time of the frame
+        self.render_scene(self.camera.frame_context(self.win_size, time, dt))
+
+        # unbinding fbo
+        self.post_proc.fbo.unbind()
+
+        # post processing effects (fog...)
+        with self.profiler.scope('post_process'):
+            self.post_process()
+
+    def benchmark(self, frames=300, dt=1/60, warmup=10, path=None):
+        """
+        Fixed workload: 'frames' frames (after 'warmup' ones) dt seconds apart, the camera following the
+        CameraPath frame-locked, by default a flythrough of its preset viewpoints. glFinish after each frame
+        so its time includes the whole gpu (or llvmpipe) work.
+        Returns the frame times & the stages' percentiles (ms), the counters (gl state, uniforms, culling,
+        animations) per measured frame and the hash of the last image.
+        """
+        if path is None:
+            path = CameraPath.from_viewpoints(self.camera.camera_positions, max(frames - 1, 1) * dt)
+        player = CameraPlayer(path, step=dt)
+
+        frame_times = []
+        for frame in range(warmup + frames):
+            if frame == warmup:  # stats of the measured frames only
+                self.profiler = Profiler(history=frames)
+                state.reset_stats()
+                Shader.reset_stats()
+                self.frustum.reset_stats()
+                if self.animation_scheduler is not None:
+                    self.animation_scheduler.reset_stats()
+            if frame < warmup:
+                path.apply(self.camera, 0.0)
+            else:
+                player.update(self.camera)
+
+            start = perf_counter()
+            self.draw_frame(frame * dt, dt)
+            GL.glFinish()
+            if frame >= warmup:
+                frame_times.append((perf_counter() - start) * 1000.0)
+        self.profiler.flush()
+        per_frame = lambda stats: {name: count / frames for name, count in stats.items()}
+        gl_state = per_frame(state.reset_stats())
+        uniforms = per_frame(Shader.reset_stats())
+        culling = per_frame(self.frustum.reset_stats())
+        animations = per_frame(self.animation_scheduler.reset_stats()) if self.animation_scheduler is not None else None
+
+        pixels = GL.glReadPixels(0, 0, *self.win_size, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE)
+        frame_times = np.array(frame_times)
+        percentiles = np.percentile(frame_times, Profiler.PERCENTILES)
+        return dict(renderer=GL.glGetString(GL.GL_RENDERER).decode(), frames=frames, warmup=warmup, dt=dt,
+                    size=list(self.win_size), fps=float(1000.0 / frame_times.mean()),
+                    frame_ms=dict(mean=float(frame_times.mean()), max=float(frame_times.max()),
+                                  **{f'p{p}': float(v) for p, v in zip(Profiler.PERCENTILES, percentiles)}),
+                    stages=self.profiler.stats(), gl_state_per_frame=gl_state, uniforms_per_frame=uniforms,
+                    culling_per_frame=culling,
+                    animations_per_frame=animations,
+                    framebuffer_sha256=hashlib.sha256(bytes(pixels)).hexdigest())
+
+    def render_scene(self, frame):
+        """ frame: FrameContext of the camera, with the time of the frame """
+        time = frame.time
+        with self.profiler.scope('chunk.update'):  # ocean fft
+            self.chunk.update(time)
+        self.frame_uniforms.update(frame, self.light_pos)
+        self.frustum.update(frame)
+        if self.animation_scheduler is not None:
+            self.animation_scheduler.update(frame.camera_position, frame.projection)
 
         # opaque objects
 
-        for turbine in self.turbine:
-            turbine.draw(view=view_matrix,
-                         projection=projection_matrix,
-                         w_camera_position=self.camera.camera_pos, light_pos=self.light_pos)
+        with self.profiler.scope('turbines'):
+            self.turbines.draw_compiled(frustum=self.frustum, time=time, scheduler=self.animation_scheduler)
         
         # decomment these following lines if you want to draw the tree
-        # self.tree.draw(view=view_matrix,
-        #                projection=projection_matrix,
-        #                w_camera_position=self.camera.camera_pos)
+        # self.tree.draw()
 
-        self.chunk.draw(view=view_matrix,
-                        projection=projection_matrix,
-                        w_camera_position=self.camera.camera_pos,
-                        skybox=self.skybox.cubemap_text, light_pos=self.light_pos)
+        # the camera position is also needed on the cpu side (ocean lod)
+        with self.profiler.scope('chunk.draw'):
+            self.chunk.draw(frame.camera_position, skybox=self.skybox.cubemap_text, frustum=self.frustum)
 
         # animals have a different cull face than all the other objects (artist's choice)
         # so we change that parameter before changing it again after drawing all animals
-        GL.glCullFace(GL.GL_BACK)
-        self.draw(view=view_matrix,
-                  projection=projection_matrix,
-                  w_camera_position=self.camera.camera_pos, light_pos=self.light_pos)
-        GL.glCullFace(GL.GL_FRONT)
+        state.cull_face(GL.GL_BACK)
+        with self.profiler.scope('animals'):
+            self.draw_compiled(frustum=self.frustum, time=time, scheduler=self.animation_scheduler)
+        state.cull_face(GL.GL_FRONT)
 
         # skybox (optimization)
         # we want the skybox to be drawn behind every other object in the scene
-        GL.glDepthFunc(GL.GL_LEQUAL)
-        GL.glDisable(GL.GL_CULL_FACE)
-        self.skybox.draw(view=view_matrix, proj=projection_matrix)
-        GL.glEnable(GL.GL_CULL_FACE)
-        GL.glDepthFunc(GL.GL_LESS)
+        state.depth_func(GL.GL_LEQUAL)
+        state.disable(GL.GL_CULL_FACE)
+        with self.profiler.scope('skybox'):
+            self.skybox.draw()
+        state.enable(GL.GL_CULL_FACE)
+        state.depth_func(GL.GL_LESS)
 
         # semi-transparent objects -> particles
-        GL.glBlendFunc(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
-        GL.glDepthMask(GL.GL_FALSE)
-        self.smoke_ps.draw(dt=self.delta_time, camera=self.camera)
-        self.splash_ps.draw(dt=self.delta_time, camera=self.camera)
-        GL.glDepthMask(GL.GL_TRUE)
-        GL.glDisable(GL.GL_BLEND)
+        state.blend_func(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA)
+        state.depth_mask(GL.GL_FALSE)
+        with self.profiler.scope('smoke'):
+            self.smoke_ps.draw(dt=frame.dt)
+        with self.profiler.scope('splashes'):
+            self.splash_ps.draw(dt=frame.dt)
+        state.depth_mask(GL.GL_TRUE)
+        state.disable(GL.GL_BLEND)
 
     def post_process(self):
         # we don't want our quad to pass the depth test
-        self.post_proc.draw(win_size=self.win_size, view=self.camera.view_matrix(),
-                            proj=self.camera.projection_matrix(self.win_size), is_fog=self.is_fog,
-                            w_camera_position=self.camera.camera_pos)
+        self.post_proc.draw(win_size=self.win_size, is_fog=self.is_fog)
 
 
 
@@ -461,6 +819,42 @@ class Viewer(Node):
             if key == glfw.KEY_F: # enables/disables fog
                 self.is_fog = not self.is_fog
 
+            if key == glfw.KEY_T:  # timings of the last frames per stage, and their trace for chrome://tracing
+                print(self.profiler.report())
+                print("gl state changes since the last 'T': %(calls)d made, %(skipped)d skipped" % state.reset_stats())
+                print("uniform uploads since the last 'T': %(uploads)d made, %(skipped)d skipped" % Shader.reset_stats())
+                print("culling since the last 'T': %(tested)d boxes tested, %(culled)d objects culled, %(drawn)d drawn"
+                      % self.frustum.reset_stats())
+                if self.animation_scheduler is not None:
+                    print("animated nodes since the last 'T': %(updated)d updated, %(skipped)d skipped "
+                          "(%(reduced)d reduced, %(frozen)d frozen)" % self.animation_scheduler.reset_stats())
+                self.profiler.export_trace(PROFILE_TRACE)
+                print("trace written to", PROFILE_TRACE)
+
+            if key == glfw.KEY_R and action == glfw.PRESS:  # records the camera's moves until 'R' again
+                if self.camera_recorder is None:
+                    self.camera_recorder = CameraRecorder()
+                    print("recording the camera path...")
+                else:
+                    self.camera_recorder.path().save(CAMERA_PATH)
+                    self.camera_recorder = None
+                    print("camera path written to", CAMERA_PATH)
+
+            if key == glfw.KEY_V and action == glfw.PRESS:  # plays the recorded path, else visits the viewpoints
+                if self.camera_player is None:
+                    path = (CameraPath.load(CAMERA_PATH) if os.path.exists(CAMERA_PATH) else CameraPath.from_viewpoints(
+                        self.camera.camera_positions, VIEWPOINT_DURATION * (len(self.camera.camera_positions) - 1)))
+                    self.camera_player = CameraPlayer(path)
+                else:
+                    self.camera_player = None
+
+            # turns the wind, new ocean spectrum (a baked loop keeps the wind it was baked with)
+            if key == glfw.KEY_O and action == glfw.PRESS and not self.chunk.ocean_mesh.baked_frames:
+                ocean = self.chunk.ocean_mesh
+                x, z = ocean.ocean_grid.wind_direction
+                direction = rotate((0, 1, 0), WIND_STEP) @ vec(x, 0.0, z, 0.0)
+                ocean.set_wind(wind_direction=direction[[0, 2]])
+
             if key == glfw.KEY_K:  # a koala appears randomly by pressing a button
                 if self.number_koala < MAX_KOALA:
                     # random position
@@ -484,6 +878,7 @@ class Viewer(Node):
     def add(self, *drawables):
         """ Add drawables to this node, simply updating children list """
         self.children.extend(drawables)
+        self.draw_list = None
 
 
 
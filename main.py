@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
+import argparse
+import json
+import os
+import random
 
+import numpy as np
 
-from core import Viewer
 
-def main():
+def main(argv=None):
 
     # instructions
     instructions = """\n\n\n####################### UTILISATION DU CLAVIER #######################
@@ -33,13 +37,78 @@ def main():
         - vue de l'île de derrière
         - vue près du mouton qui cherche à dominer le monde
     - F : active/désactive le fog
+    - R : démarre/arrête l'enregistrement du trajet de la caméra (écrit dans camera_path.json)
+    - V : rejoue le trajet enregistré (ou survole les points de vue si aucun trajet n'existe)
+    - O : fait tourner le vent sur l'océan de 30°
     - Echap : quitte la scène
 ######################################################################\n\n"""
 
     CHUNK_SIZE = 256 #nb of vertices per chunk side
-    
-    viewer = Viewer(instructions, size=CHUNK_SIZE)
-    
+    FFT_BACKEND = "gpu" # "cpu" to run the ocean FFT with numpy instead of compute shaders
+    FFT_SIZE = 256 # ocean FFT resolution: 128, 256, 512 or 1024
+    OCEAN_CASCADES = None # (patch length, amplitude) pairs, e.g. [(256, 50.0), (73, 25.0)], None = one patch
+    OCEAN_BAKED_FRAMES = 0 # > 0 => the ocean loops & is precomputed at startup with this number of frames (e.g. 64)
+    OCEAN_GPU_SPECTRUM = False # True => the ocean spectrum is built by a compute shader, turning the wind ('O') is instant
+    SMOKE_PARTICLES = 32768 # multiples of 16
+    SPLASH_PARTICLES = 1024
+
+    # --benchmark: fixed workload rendered offscreen (EGL, Mesa llvmpipe on machines without gpu), timings in a json
+    # e.g. python main.py --benchmark --frames 100 --chunk-size 128 --no-fog --output chunk128.json
+    parser = argparse.ArgumentParser(description="Les koalas vont dominer le monde")
+    parser.add_argument('--benchmark', action='store_true', help="render a fixed camera path offscreen, no window")
+    parser.add_argument('--frames', type=int, default=300, help="measured frames of the benchmark")
+    parser.add_argument('--warmup', type=int, default=10, help="frames rendered before measuring")
+    parser.add_argument('--dt', type=float, default=1/60, help="fixed time step of the benchmark (s)")
+    parser.add_argument('--output', default="benchmark.json", help="benchmark results")
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=1000)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--fft-backend', choices=("gpu", "cpu"), default=FFT_BACKEND)
+    parser.add_argument('--fft-size', type=int, default=FFT_SIZE)
+    parser.add_argument('--ocean-baked-frames', type=int, default=OCEAN_BAKED_FRAMES)
+    parser.add_argument('--ocean-gpu-spectrum', action='store_true', default=OCEAN_GPU_SPECTRUM)
+    parser.add_argument('--smoke-particles', type=int, default=SMOKE_PARTICLES)
+    parser.add_argument('--splash-particles', type=int, default=SPLASH_PARTICLES)
+    parser.add_argument('--no-fog', action='store_true')
+    parser.add_argument('--camera-path', help="json flythrough (see 'R'), played at start or by the benchmark")
+    parser.add_argument('--frame-locked', action='store_true', help="camera path advanced by dt every frame")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        # PyOpenGL picks its platform at its first import, surfaceless = no display needed (Mesa)
+        os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+        os.environ.setdefault('EGL_PLATFORM', 'surfaceless')
+        # same particles every run, so the same images
+        random.seed(0)
+        np.random.seed(0)
+        instructions = ""
+    from core import Viewer
+    from utils.camera_path import CameraPath, CameraPlayer
+    path = CameraPath.load(args.camera_path) if args.camera_path else None
+
+    viewer = Viewer(instructions, width=args.width, height=args.height, size=args.chunk_size,
+                    fft_backend=args.fft_backend, fft_size=args.fft_size, ocean_cascades=OCEAN_CASCADES,
+                    ocean_baked_frames=args.ocean_baked_frames, smoke_particles=args.smoke_particles,
+                    splash_particles=args.splash_particles, fog=not args.no_fog, headless=args.benchmark,
+                    ocean_gpu_spectrum=args.ocean_gpu_spectrum)
+
+    if args.benchmark:
+        results = viewer.benchmark(args.frames, args.dt, args.warmup, path)
+        results['config'] = dict(chunk_size=args.chunk_size, fft_backend=args.fft_backend, fft_size=args.fft_size,
+                                 ocean_cascades=OCEAN_CASCADES, ocean_baked_frames=args.ocean_baked_frames,
+                                 ocean_gpu_spectrum=args.ocean_gpu_spectrum,
+                                 smoke_particles=args.smoke_particles, splash_particles=args.splash_particles,
+                                 fog=not args.no_fog, camera_path=args.camera_path)
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"{results['fps']:.1f} fps, frame time p50 {results['frame_ms']['p50']:.2f} ms, "
+              f"p99 {results['frame_ms']['p99']:.2f} ms -> {args.output}")
+        print(viewer.profiler.report())
+        return
+
+    if path is not None:
+        viewer.camera_player = CameraPlayer(path, step=args.dt if args.frame_locked else None)
+
     # start rendering loop
     viewer.run()
 
@@ -0,0 +1,127 @@
+"""
+Batched keyframe evaluation (utils/animation.py) against the per-node TransformKeyFrames.value, and top_bone_weights
+against the per-vertex sort core.load used before: runs without a gpu.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip("assimpcy")  # imported by core, itself imported by utils.animation
+
+from utils.animation import (KeyFrameBatch, KeyFrameControlNode, TransformKeyFrames, TransformTracks,  # noqa: E402
+                             top_bone_weights)
+from utils.transform import quaternion_from_axis_angle  # noqa: E402
+
+
+def random_keys(rng, count, make_value):
+    """ {time: value} of count keys at random times in [0.5, 4] """
+    return {float(time): make_value() for time in np.sort(rng.uniform(0.5, 4.0, count))}
+
+
+def random_channels(seed=0, channels=6):
+    """ tracks with different key counts (a single key for some), scalar scales on one channel out of two """
+    rng = np.random.default_rng(seed)
+    tracks = []
+    for channel in range(channels):
+        rotation = lambda: quaternion_from_axis_angle(rng.normal(size=3), rng.uniform(-180, 180))
+        scaling = (lambda: rng.uniform(0.5, 2.0)) if channel % 2 else (lambda: rng.uniform(0.5, 2.0, 3))
+        tracks.append((random_keys(rng, 1 + channel % 4, lambda: rng.normal(size=3)),
+                       random_keys(rng, 1 + (channel + 1) % 4, rotation),
+                       random_keys(rng, 1 + (channel + 2) % 4, scaling)))
+    return tracks
+
+
+# before the first keys, at and between keys, after the last ones
+TIMES = [0.0, 0.5, 1.0, 1.7, 2.25, 3.0, 3.9, 4.0, 6.0]
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_tracks_match_transform_keyframes(seed):
+    keyframes = [TransformKeyFrames(*track) for track in random_channels(seed)]
+    tracks = TransformTracks(keyframes)
+    for time in TIMES:
+        expected = [keys.value(time) for keys in keyframes]
+        np.testing.assert_allclose(tracks.value(time), expected, atol=1e-5)
+
+
+def test_tracks_evaluate_a_time_per_channel():
+    keyframes = [TransformKeyFrames(*track) for track in random_channels(1)]
+    tracks = TransformTracks(keyframes)
+    times = np.array(TIMES[:len(keyframes)], dtype=np.float32)
+    channels = np.arange(len(keyframes))[::-1]
+    expected = [keyframes[channel].value(time) for channel, time in zip(channels, times)]
+    np.testing.assert_allclose(tracks.value(times, channels), expected, atol=1e-5)
+    out = np.empty((len(channels), 4, 4), dtype=np.float32)
+    assert tracks.value(times, channels, out=out) is out
+    np.testing.assert_allclose(out, expected, atol=1e-5)
+
+
+def test_resampled_tracks_are_exact_on_samples_and_close_between():
+    keyframes = [TransformKeyFrames(*track) for track in random_channels(2)]
+    rate = 120
+    tracks = TransformTracks(keyframes, rate=rate)
+    for time in [0.0, 1.0, 2.5, 4.0, 6.0, -1.0]:  # samples, clamped at both ends
+        expected = [keys.value(max(time, 0.0)) for keys in keyframes]
+        np.testing.assert_allclose(tracks.value(time), expected, atol=1e-5)
+    for time in np.array(TIMES) + 0.5 / rate:  # between samples: lerp of the samples, nlerp of the rotations
+        expected = [keys.value(time) for keys in keyframes]
+        np.testing.assert_allclose(tracks.value(time), expected, atol=1e-3)
+
+
+@pytest.mark.parametrize("rate", [None, 240])
+def test_batch_matches_nodes_with_modulo(rate):
+    modulos = [None, 2.0, 3.5, None, 1.25, 4.0]
+    nodes = [KeyFrameControlNode(*track, modulo=modulo) for track, modulo in zip(random_channels(3), modulos)]
+    batch = KeyFrameBatch([KeyFrameControlNode(*track, modulo=modulo)
+                           for track, modulo in zip(random_channels(3), modulos)], rate=rate)
+    for time in [0.0, 1.3, 2.6, 5.0, 9.75]:
+        batch.animate(time)
+        for node, batched in zip(nodes, batch.nodes):
+            node.animate(time)
+            np.testing.assert_allclose(batched.transform, node.transform, atol=1e-5 if rate is None else 1e-3)
+
+
+def test_batch_only_evaluates_due_nodes():
+    tracks = random_channels(4, channels=3)
+    batch = KeyFrameBatch([KeyFrameControlNode(*track) for track in tracks])
+    batch.animate(1.0)
+    before = [node.transform.copy() for node in batch.nodes]
+    changed = batch.animate(3.0, due=np.array([False, True, False]))
+    assert not changed[0] and not changed[2]
+    np.testing.assert_allclose(batch.nodes[0].transform, before[0])
+    np.testing.assert_allclose(batch.nodes[1].transform, TransformKeyFrames(*tracks[1]).value(3.0), atol=1e-5)
+
+
+def sorted_bone_weights(bones, vertex_count):
+    """ the former core.load: a row of (weight, id) per vertex and bone, sorted, the 4 highest kept (highest first) """
+    vbone = np.array([[(0, 0)] * len(bones)] * vertex_count, dtype=[('weight', 'f4'), ('id', 'u4')])
+    for bone_id, bone in enumerate(bones):
+        for vertex_id, weight in bone:
+            vbone[vertex_id][bone_id] = (weight, bone_id)
+    vbone.sort(order='weight')
+    vbone = vbone[:, -4:][:, ::-1]
+    return vbone['id'], vbone['weight']
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_top_bone_weights_match_sorted_rows(seed):
+    rng = np.random.default_rng(seed)
+    vertex_count, bone_count = 50, 9
+    influences = rng.permutation(np.arange(vertex_count) % (bone_count + 1))  # none, fewer or more than 4 bones per vertex
+    bones = [[] for _ in range(bone_count)]
+    for vertex_id, count in enumerate(influences):
+        for bone_id in rng.choice(bone_count, count, replace=False):
+            bones[bone_id].append((vertex_id, rng.uniform(0.01, 1.0)))
+
+    # flat influences in the order core.load gathers them: bone by bone
+    vertex_ids = [vertex_id for bone in bones for vertex_id, _ in bone]
+    bone_ids = [bone_id for bone_id, bone in enumerate(bones) for _ in bone]
+    weights = [weight for bone in bones for _, weight in bone]
+    ids, top_weights = top_bone_weights(vertex_ids, bone_ids, weights, vertex_count)
+
+    expected_ids, expected_weights = sorted_bone_weights(bones, vertex_count)
+    np.testing.assert_array_equal(top_weights, expected_weights)
+    np.testing.assert_array_equal(ids, expected_ids)  # unused slots: null weight on bone 0 in both
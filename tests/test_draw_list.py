@@ -0,0 +1,79 @@
+"""
+DrawList (core.py) against the recursive Node.draw, with recording drawables: runs without a gpu.
+"""
+import os
+import sys
+from unittest import mock
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip("assimpcy")  # imported by core
+
+from core import Node  # noqa: E402
+from utils import animation  # noqa: E402
+from utils.animation import KeyFrameControlNode, Skinned  # noqa: E402
+from utils.camera import Frustum  # noqa: E402
+from utils.transform import frustum_planes, identity, perspective, quaternion, translate, vec  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def no_gl(monkeypatch):
+    """ Skinned uploads its palette to a buffer texture, these GL calls go to a mock """
+    monkeypatch.setattr(animation, 'GL', mock.MagicMock())
+
+
+class BonePositions:
+    """ mesh of a Skinned, records the position of its first bone at each draw """
+    def __init__(self):
+        self.skinned = None
+        self.drawn = []
+
+    def draw(self, **uniforms):
+        self.drawn.append(self.skinned.palette[0][:3, 3].copy())
+
+
+def shared_skinned_scene(animated):
+    """ one skinned model (bone at x=1) placed 3 times, at x = 0, 10, 20 """
+    mesh = BonePositions()
+    if animated:
+        bone = KeyFrameControlNode({0: vec(1, 0, 0), 1: vec(1, 0, 0)}, {0: quaternion(), 1: quaternion()}, {0: 1, 1: 1})
+    else:
+        bone = Node(transform=translate(1, 0, 0))
+    mesh.skinned = Skinned(mesh, [bone], [identity()])
+    model = Node(children=[bone, Node(children=[mesh.skinned])])
+    root = Node(children=[Node(children=[model], transform=translate(x, 0, 0)) for x in (0, 10, 20)])
+    return root, mesh
+
+
+@pytest.mark.parametrize("animated", [False, True])
+def test_shared_skinned_subtree_uses_each_placement_bones(animated):
+    root, mesh = shared_skinned_scene(animated)
+    root.draw()
+    recursive = np.array(mesh.drawn)
+    mesh.drawn.clear()
+    root.draw_compiled()
+    np.testing.assert_allclose(recursive[:, 0], [1, 11, 21])
+    np.testing.assert_allclose(np.array(mesh.drawn), recursive)
+
+
+class Box:
+    """ drawable with bounds, counts its draws """
+    bounds = np.array([(-1.0, -1.0, -1.0), (1.0, 1.0, 1.0)])
+
+    def __init__(self):
+        self.draws = 0
+
+    def draw(self, **uniforms):
+        self.draws += 1
+
+
+def test_root_children_without_drawables_are_culled_safely():
+    box = Box()
+    root = Node(children=[Node(), Node(children=[box], transform=translate(0, 0, -10)), Node()])
+    frustum = Frustum()
+    frustum.planes = frustum_planes(perspective(60, 1.0, 0.1, 100.0))
+    root.draw_compiled(frustum=frustum)
+    assert box.draws == 1
+    assert frustum.stats['drawn'] == 1
@@ -0,0 +1,101 @@
+"""
+Batched transforms (utils/transform.py) against the functions they vectorize, row by row.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.transform import (lookat, lookat_batch, normalized_batch, quaternion_from_axis_angle,  # noqa: E402
+                             quaternion_matrix, quaternion_matrix_batch, quaternion_slerp, quaternion_slerp_batch,
+                             rotate, rotate_batch, scale, scale_batch, translate, translate_batch, trs_batch)
+
+COUNT = 16
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def random_quaternions(rng, count=COUNT):
+    """ unit quaternions, some of them on the other side of the sphere of their neighbour """
+    quaternions = [quaternion_from_axis_angle(axis, angle)
+                   for axis, angle in zip(rng.normal(size=(count, 3)), rng.uniform(-180, 180, count))]
+    return np.array(quaternions) * rng.choice((-1, 1), (count, 1))
+
+
+def stale(count=COUNT):
+    """ preallocated output with garbage, every coefficient must be written """
+    return np.full((count, 4, 4), np.nan, dtype=np.float32)
+
+
+def test_translate_and_scale_batch(rng):
+    translations, scales, factors = rng.normal(size=(COUNT, 3)), rng.uniform(0.1, 3, (COUNT, 3)), rng.uniform(0.1, 3, COUNT)
+    np.testing.assert_allclose(translate_batch(translations), [translate(t) for t in translations], rtol=1e-6)
+    np.testing.assert_allclose(scale_batch(scales), [scale(s) for s in scales], rtol=1e-6)
+    np.testing.assert_allclose(scale_batch(factors), [scale(f) for f in factors], rtol=1e-6)
+
+
+def test_rotate_batch(rng):
+    axes, angles = rng.normal(size=(COUNT, 3)), rng.uniform(-360, 360, COUNT)
+    expected = [rotate(axis, angle) for axis, angle in zip(axes, angles)]
+    np.testing.assert_allclose(rotate_batch(axes, angles), expected, atol=1e-6)
+    np.testing.assert_allclose(rotate_batch(axes, radians=np.radians(angles)), expected, atol=1e-6)
+    np.testing.assert_allclose(rotate_batch((0, 1, 0), angles), [rotate((0, 1, 0), angle) for angle in angles], atol=1e-6)
+
+
+def test_lookat_batch(rng):
+    eyes, targets = rng.uniform(-100, 100, (COUNT, 3)), rng.uniform(-100, 100, (COUNT, 3))
+    up = (0, 1, 0)
+    expected = [lookat(eye, target, up) for eye, target in zip(eyes, targets)]
+    np.testing.assert_allclose(lookat_batch(eyes, targets, up), expected, rtol=1e-5, atol=1e-4)
+
+
+def test_quaternion_batch(rng):
+    q0, q1, fractions = random_quaternions(rng), random_quaternions(rng), rng.uniform(0, 1, COUNT)
+    np.testing.assert_allclose(quaternion_matrix_batch(q0), [quaternion_matrix(q) for q in q0], atol=1e-6)
+    expected = [quaternion_slerp(a, b, f) for a, b, f in zip(q0, q1, fractions)]
+    np.testing.assert_allclose(quaternion_slerp_batch(q0, q1, fractions), expected, atol=1e-6)
+    np.testing.assert_allclose(quaternion_slerp_batch(q0, q0, fractions), q0, atol=1e-6)  # no rotation in between
+
+
+def test_trs_batch(rng):
+    translations, quaternions, scales = rng.normal(size=(COUNT, 3)), random_quaternions(rng), rng.uniform(0.1, 3, (COUNT, 3))
+    expected = [translate(t) @ quaternion_matrix(q) @ scale(s) for t, q, s in zip(translations, quaternions, scales)]
+    np.testing.assert_allclose(trs_batch(translations, quaternions, scales), expected, atol=1e-6)
+
+
+def test_normalized_batch_keeps_null_rows():
+    vectors = np.array([(3.0, 4.0, 0.0), (0.0, 0.0, 0.0)])
+    np.testing.assert_allclose(normalized_batch(vectors), [(0.6, 0.8, 0.0), (0.0, 0.0, 0.0)])
+
+
+def test_out_is_overwritten_and_returned(rng):
+    translations, scales, axes, angles = (rng.normal(size=(COUNT, 3)), rng.uniform(0.1, 3, (COUNT, 3)),
+                                          rng.normal(size=(COUNT, 3)), rng.uniform(-360, 360, COUNT))
+    quaternions, eyes = random_quaternions(rng), rng.uniform(-100, 100, (COUNT, 3))
+    calls = [lambda out: translate_batch(translations, out=out),
+             lambda out: scale_batch(scales, out=out),
+             lambda out: rotate_batch(axes, angles, out=out),
+             lambda out: lookat_batch(eyes, (0, 0, 0), (0, 1, 0), out=out),
+             lambda out: quaternion_matrix_batch(quaternions, out=out),
+             lambda out: trs_batch(translations, quaternions, scales, out=out)]
+    for call in calls:
+        out = stale()
+        assert call(out) is out
+        np.testing.assert_array_equal(out, call(None))
+
+
+def test_slerp_out_can_alias_its_inputs(rng):
+    q0, q1, fractions = random_quaternions(rng), random_quaternions(rng), rng.uniform(0, 1, COUNT)
+    expected = quaternion_slerp_batch(q0, q1, fractions)
+    assert quaternion_slerp_batch(q0, q1, fractions, out=q0) is q0
+    np.testing.assert_allclose(q0, expected)
+    q0, q1 = random_quaternions(rng), random_quaternions(rng)
+    expected = quaternion_slerp_batch(q0, q1, fractions)
+    quaternion_slerp_batch(q0, q1, fractions, out=q1)
+    np.testing.assert_allclose(q1, expected)
@@ -1,43 +1,82 @@
-# Python built-in modules
-from bisect import bisect_left      # search sorted keyframe lists
-
 # External, non built-in modules
 import OpenGL.GL as GL              # standard Python OpenGL wrapper
 import glfw                         # lean window system wrapper for OpenGL
 import numpy as np                  # all matrix manipulations & OpenGL args
 
 from core import Node
+from utils.gl_state import state
 from utils.transform import (lerp, quaternion_slerp, quaternion_matrix, translate,
-                       scale, identity)
+                       scale, identity, quaternion_slerp_batch, trs_batch)
 
 
 # -------------- Keyframing Utilities TP6 ------------------------------------
 class KeyFrames:
-    """ Stores keyframe pairs for any value type with interpolation_function"""
+    """
+    Stores keyframe pairs for any value type with interpolation_function, as contiguous float32 arrays:
+    times (keys,) and values (keys,) or (keys, dims). Built from {time: value}, (time, value) pairs or
+    directly from a (times, values) tuple of arrays (see core.load).
+    """
     def __init__(self, time_value_pairs, interpolation_function=lerp):
         if isinstance(time_value_pairs, dict):  # convert to list of pairs
             time_value_pairs = time_value_pairs.items()
-        keyframes = sorted(((key[0], key[1]) for key in time_value_pairs))
-        self.times, self.values = zip(*keyframes)  # pairs list -> 2 lists
+        if isinstance(time_value_pairs, tuple) and len(time_value_pairs) == 2 \
+                and isinstance(time_value_pairs[0], np.ndarray) and time_value_pairs[0].ndim == 1:
+            times, values = time_value_pairs
+            order = np.argsort(times, kind='stable')
+            times, values = np.asarray(times)[order], np.asarray(values)[order]
+        else:
+            keyframes = sorted(((key[0], key[1]) for key in time_value_pairs), key=lambda key: key[0])
+            times, values = zip(*keyframes)  # pairs list -> 2 lists
+        self.times = np.array(times, dtype=np.float32)
+        self.values = np.array(values, dtype=np.float32)
         self.interpolate = interpolation_function
 
     def value(self, time):
         """ Computes interpolated value from keyframes, for a given time """
 
         # 1. ensure time is within bounds else return boundary keyframe
-        if (time < self.times[0]):
+        if (time <= self.times[0]):
             return self.values[0]
 
-        if (time > self.times[-1]):
+        if (time >= self.times[-1]):
             return self.values[-1]
 
-        # 2. search for closest index entry in self.times, using bisect_left
-        closest_index = bisect_left(self.times, time)
+        # 2. search for the first key after time: times[index-1] <= time < times[index]
+        index = np.searchsorted(self.times, time, side='right')
 
         # 3. using the retrieved index, interpolate between the two neighboring
         # values in self.values, using the stored self.interpolate function
-        f = (time - self.times[closest_index-1])/(self.times[closest_index] - self.times[closest_index-1])
-        return self.interpolate(self.values[closest_index-1], self.values[closest_index], f)
+        f = (time - self.times[index-1])/(self.times[index] - self.times[index-1])
+        return self.interpolate(self.values[index-1], self.values[index], f)
+
+
+class SplineKeyFrames(KeyFrames):
+    """
+    KeyFrames interpolated by a Catmull-Rom spline: C1 through every key, the tangent at a key being the
+    slope between its two neighbors (one-sided at both ends), keys can be unevenly spaced in time.
+    """
+    def __init__(self, time_value_pairs):
+        super().__init__(time_value_pairs)
+        values, times = self.values.astype(np.float64), self.times.astype(np.float64)
+        shape = (-1,) + (1,) * (values.ndim - 1)  # times broadcast over the values' dims
+        self.tangents = np.zeros_like(values)
+        if len(times) > 1:
+            self.tangents[1:-1] = (values[2:] - values[:-2]) / (times[2:] - times[:-2]).reshape(shape)
+            self.tangents[0] = (values[1] - values[0]) / (times[1] - times[0])
+            self.tangents[-1] = (values[-1] - values[-2]) / (times[-1] - times[-2])
+
+    def value(self, time):
+        """ cubic hermite interpolation of the two keys around time """
+        if time <= self.times[0]:
+            return self.values[0]
+        if time >= self.times[-1]:
+            return self.values[-1]
+        index = np.searchsorted(self.times, time, side='right')
+        span = float(self.times[index] - self.times[index-1])
+        f = (time - self.times[index-1]) / span
+        f2, f3 = f*f, f*f*f
+        return ((2*f3 - 3*f2 + 1) * self.values[index-1] + (f3 - 2*f2 + f) * span * self.tangents[index-1]
+                + (-2*f3 + 3*f2) * self.values[index] + (f3 - f2) * span * self.tangents[index]).astype(np.float32)
 
 
 class TransformKeyFrames:
@@ -47,43 +86,265 @@ class TransformKeyFrames:
         self.translation_set = KeyFrames(translate_keys)
         self.rotation_set = KeyFrames(rotate_keys, quaternion_slerp)
         self.scaling_set = KeyFrames(scale_keys)
+        # last evaluation: a track shared by several placements is computed once per frame time
+        self.cached_time = None
+        self.cached_value = None
 
     def value(self, time):
         """ Compute each component's interpolation and compose TRS matrix """
+        if time == self.cached_time:
+            return self.cached_value
         trans_interp = translate(self.translation_set.value(time))
         rot_interp = quaternion_matrix(self.rotation_set.value(time))
         scale_interp = scale(self.scaling_set.value(time))
-        return trans_interp@rot_interp@scale_interp
+        self.cached_time, self.cached_value = time, trans_interp@rot_interp@scale_interp
+        return self.cached_value
+
+
+class PackedKeys:
+    """
+    Keys of several KeyFrames (channels) padded into times (channels, keys) & values (channels, keys, dims),
+    so that all the channels are interpolated in one vectorized call. Scalar values are repeated on the dims.
+    """
+    def __init__(self, keyframes, dims):
+        lengths = np.array([len(keys.times) for keys in keyframes])
+        self.last = lengths - 1
+        self.times = np.full((len(keyframes), lengths.max()), np.inf, dtype=np.float32)
+        self.values = np.empty((len(keyframes), lengths.max(), dims), dtype=np.float32)
+        for channel, (keys, length) in enumerate(zip(keyframes, lengths)):
+            self.times[channel, :length] = keys.times
+            self.values[channel, :length] = np.broadcast_to(keys.values.reshape(length, -1), (length, dims))
+            self.values[channel, length:] = self.values[channel, length - 1]
+
+    def value(self, times, channels, interpolate=lerp):
+        """ values of the given channels (n,) at the given times (n,), same boundaries as KeyFrames.value """
+        count = (self.times[channels] <= times[:, None]).sum(axis=1)  # keys at or before each time
+        after = np.minimum(count, self.last[channels])
+        before = np.maximum(count - 1, 0)
+        t0, t1 = self.times[channels, before], self.times[channels, after]
+        span = np.where(after > before, t1 - t0, 1)
+        fraction = np.where(after > before, (times - t0) / span, 0).astype(np.float32)
+        return interpolate(self.values[channels, before], self.values[channels, after], fraction[:, None])
+
+
+class TransformTracks:
+    """
+    TransformKeyFrames of many channels (every node of a loaded animation, many animated nodes...) evaluated
+    together: value(times) gives all the TRS matrices in a few numpy calls.
+    With a rate (Hz), the tracks are resampled once at that rate and a lookup is a constant time
+    interpolation between two samples instead of a search among the keys.
+    """
+    def __init__(self, keyframes, rate=None):
+        self.translations = PackedKeys([keys.translation_set for keys in keyframes], 3)
+        self.rotations = PackedKeys([keys.rotation_set for keys in keyframes], 4)
+        self.scales = PackedKeys([keys.scaling_set for keys in keyframes], 3)
+        self.channels = np.arange(len(keyframes))
+        self.rate = rate
+        if rate:
+            end = max(packed.times[np.isfinite(packed.times)].max()
+                      for packed in (self.translations, self.rotations, self.scales))
+            frames = int(np.ceil(end * rate)) + 1
+            channels = np.repeat(self.channels, frames)
+            times = np.tile(np.arange(frames, dtype=np.float32) / rate, len(keyframes))
+            self.samples = [values.reshape(len(keyframes), frames, -1) for values in self.components(times, channels)]
+
+    def components(self, times, channels):
+        """ interpolated translations, rotations & scales of the channels at the times """
+        return (self.translations.value(times, channels),
+                self.rotations.value(times, channels, quaternion_slerp_batch),
+                self.scales.value(times, channels))
+
+    def value(self, times, channels=None, out=None):
+        """
+        (channels, 4, 4) matrices, times is one time per channel or a single one, all channels if None.
+        out: preallocated float32 array the matrices are written to
+        """
+        channels = self.channels if channels is None else channels
+        times = np.broadcast_to(np.asarray(times, dtype=np.float32), channels.shape)
+        if not self.rate:
+            return trs_batch(*self.components(times, channels), out=out)
+
+        frames = self.samples[0].shape[1]
+        position = np.clip(times * self.rate, 0, frames - 1)
+        before = position.astype(int)
+        after = np.minimum(before + 1, frames - 1)
+        fraction = (position - before)[:, None]
+        translations, rotations, scales = ((samples[channels, before], samples[channels, after])
+                                           for samples in self.samples)
+        q0, q1 = rotations
+        q1 = np.where((q0 * q1).sum(axis=1, keepdims=True) < 0, -q1, q1)  # shorter path, then normalized lerp
+        return trs_batch(lerp(*translations, fraction), lerp(q0, q1, fraction), lerp(*scales, fraction), out=out)
 
 
 class KeyFrameControlNode(Node):
     """ Place node with transform keys above a controlled subtree """
+    animated = True
+
     def __init__(self, trans_keys, rot_keys, scale_keys, transform=identity(), modulo=None):
         super().__init__(transform=transform)
         self.keyframes = TransformKeyFrames(trans_keys, rot_keys, scale_keys)
         self.modulo = modulo
 
-    def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
-        """ When redraw requested, interpolate our node transform from keys """
+    def animate(self, time=None):
+        """ Interpolates our node transform from keys at the frame's time, returns True if it changed """
+        time = glfw.get_time() if time is None else time
         # we can repeat an animation
         if(self.modulo != None):
-            self.transform = self.keyframes.value(glfw.get_time()%self.modulo)
+            transform = self.keyframes.value(time%self.modulo)
+        else:
+            transform = self.keyframes.value(time)
+        changed = transform is not self.transform and not np.array_equal(transform, self.transform)
+        self.transform = transform
+        return changed
+
+    def draw(self, primitives=GL.GL_TRIANGLES, time=None, **uniforms):
+        """ When redraw requested, interpolate our node transform from keys """
+        self.animate(time)
+        super().draw(primitives=primitives, time=time, **uniforms)
+
+
+class KeyFrameBatch:
+    """
+    KeyFrameControlNodes animated together (e.g. all the ones of a DrawList): their tracks are evaluated in one
+    vectorized TransformTracks call per frame instead of one KeyFrameControlNode.animate per node.
+    """
+    def __init__(self, nodes, rate=None):
+        self.nodes = list(nodes)
+        self.tracks = TransformTracks([node.keyframes for node in self.nodes], rate)
+        self.modulos = np.array([node.modulo if node.modulo is not None else 0 for node in self.nodes], dtype=np.float64)
+        self.matrices = None
+        self.evaluated = np.empty((len(self.nodes), 4, 4), dtype=np.float32)  # reused each frame
+
+    def animate(self, time=None, due=None):
+        """
+        updates the nodes' transforms at the frame's time, returns the mask of the ones that changed.
+        due: mask of the nodes to evaluate (AnimationScheduler), the others keep their last pose. All of them
+        are evaluated the first time.
+        """
+        time = glfw.get_time() if time is None else time
+        times = np.where(self.modulos > 0, np.mod(time, np.where(self.modulos > 0, self.modulos, 1)), time)
+        changed = np.zeros(len(self.nodes), dtype=bool)
+        if self.matrices is None:
+            self.matrices = self.tracks.value(times)
+            changed[:] = True
         else:
-            self.transform = self.keyframes.value(glfw.get_time())
-        super().draw(primitives=primitives, **uniforms)
+            nodes = self.tracks.channels if due is None else np.flatnonzero(due)
+            matrices = self.tracks.value(times[nodes], nodes, out=self.evaluated[:len(nodes)])
+            changed[nodes] = (matrices != self.matrices[nodes]).any(axis=(1, 2))
+            self.matrices[nodes] = matrices
+        for node in np.flatnonzero(changed):
+            self.nodes[node].transform = self.matrices[node]
+        return changed
+
+
+class AnimationScheduler:
+    """
+    Level of detail of the animations: the animated nodes filling a good part of the screen are updated every
+    frame, the small ones every 'reduced_every' frames and the off-screen or tiny ones are frozen in their
+    last pose. Sizes are the projected radius of the bounding boxes relative to half the viewport's height.
+    stats counts the node updates done & skipped (reduced + frozen) since the last reset_stats.
+    """
+    FULL, REDUCED, FROZEN = 0, 1, 2
+
+    def __init__(self, full_size=0.05, frozen_size=0.002, reduced_every=4):
+        self.full_size = full_size
+        self.frozen_size = frozen_size
+        self.reduced_every = reduced_every
+        self.camera_position = np.zeros(3)
+        self.focal = 1.0
+        self.frame = 0
+        self.stats = dict(updated=0, skipped=0, reduced=0, frozen=0)
+
+    def update(self, camera_position, projection):
+        """ once per frame, before the draw lists """
+        self.camera_position = np.asarray(camera_position, dtype=np.float64)
+        self.focal = projection[1][1]  # 1/tan(fovy/2)
+        self.frame += 1
+
+    def reset_stats(self):
+        """ returns the node updates done & skipped since the last call """
+        stats = dict(self.stats)
+        self.stats.update(updated=0, skipped=0, reduced=0, frozen=0)
+        return stats
+
+    def levels(self, boxes, visible):
+        """ level of the world boxes (n, 2, 3), FROZEN for the ones not visible """
+        center = boxes.mean(axis=1)
+        radius = np.linalg.norm(boxes[:, 1] - boxes[:, 0], axis=1) / 2
+        distance = np.linalg.norm(center - self.camera_position, axis=1) - radius
+        with np.errstate(divide='ignore', over='ignore'):  # camera inside the box => infinite size
+            size = np.where(distance > 0, radius * self.focal / np.maximum(distance, 1e-6), np.inf)
+        levels = np.where(size >= self.full_size, self.FULL, self.REDUCED)
+        levels[(size < self.frozen_size) | ~visible] = self.FROZEN
+        return levels
+
+    def due(self, levels):
+        """ mask of the nodes to update this frame given their levels, the reduced ones are staggered """
+        phase = np.arange(len(levels)) % self.reduced_every
+        reduced = levels == self.REDUCED
+        due = (levels == self.FULL) | (reduced & ((self.frame + phase) % self.reduced_every == 0))
+        self.stats['updated'] += int(due.sum())
+        self.stats['skipped'] += int(len(due) - due.sum())
+        self.stats['reduced'] += int((reduced & ~due).sum())
+        self.stats['frozen'] += int((levels == self.FROZEN).sum())
+        return due
 
 
 # -------------- Linear Blend Skinning : TP7 ---------------------------------
+BONES_PER_VERTEX = 4
+PALETTE_UNIT = 4  # texture unit of the bone palette, after the ones of Textured, as in texture.vert
+
+
+def top_bone_weights(vertex_ids, bone_ids, weights, vertex_count, count=BONES_PER_VERTEX):
+    """
+    Ids & weights (vertex_count, count) of the 'count' most influential bones of each vertex, from the flat
+    (vertex, bone, weight) influences of a skinned mesh. Unused slots have a null weight on bone 0.
+    """
+    vertex_ids, bone_ids, weights = np.asarray(vertex_ids), np.asarray(bone_ids), np.asarray(weights, np.float32)
+    order = np.lexsort((-weights, vertex_ids))   # by vertex, highest weights first
+    vertex_ids, bone_ids, weights = vertex_ids[order], bone_ids[order], weights[order]
+    rank = np.arange(len(vertex_ids)) - np.searchsorted(vertex_ids, vertex_ids)  # position in the vertex's run
+    keep = rank < count
+
+    top_ids = np.zeros((vertex_count, count), dtype=np.uint32)
+    top_weights = np.zeros((vertex_count, count), dtype=np.float32)
+    top_ids[vertex_ids[keep], rank[keep]] = bone_ids[keep]
+    top_weights[vertex_ids[keep], rank[keep]] = weights[keep]
+    return top_ids, top_weights
+
+
 class Skinned:
-    """ Skinned mesh decorator, passes bone world transforms to shader """
+    """
+    Skinned mesh decorator, passes bone world transforms to shader.
+    The palette (world transform @ offset of every bone) is computed in one batched product and uploaded to a
+    buffer texture (4 RGBA32F texels per matrix), so the number of bones isn't bound by the uniforms' limits.
+    """
     def __init__(self, mesh, bone_nodes, bone_offsets):
         self.mesh = mesh
 
         # store skinning data
         self.bone_nodes = bone_nodes
         self.bone_offsets = np.array(bone_offsets, np.float32)
+        self.palette = np.empty_like(self.bone_offsets)
+
+        self.buffer = GL.glGenBuffers(1)
+        state.bind_buffer(GL.GL_TEXTURE_BUFFER, self.buffer)
+        GL.glBufferData(GL.GL_TEXTURE_BUFFER, self.palette.nbytes, None, GL.GL_DYNAMIC_DRAW)
+        self.texture = GL.glGenTextures(1)
+        state.edit_texture(GL.GL_TEXTURE_BUFFER, self.texture)
+        GL.glTexBuffer(GL.GL_TEXTURE_BUFFER, GL.GL_RGBA32F, self.buffer)
+
+    def draw(self, bone_transforms=None, **uniforms):
+        """ bone_transforms: world transforms of the bones for this placement (DrawList), else the nodes' ones """
+        if bone_transforms is None:
+            bone_transforms = [node.world_transform for node in self.bone_nodes]
+        world_transforms = np.array(bone_transforms, np.float32)
+        np.matmul(world_transforms, self.bone_offsets, out=self.palette)
+        state.bind_buffer(GL.GL_TEXTURE_BUFFER, self.buffer)
+        GL.glBufferSubData(GL.GL_TEXTURE_BUFFER, 0, self.palette.nbytes, self.palette)
+        state.bind_texture(PALETTE_UNIT, GL.GL_TEXTURE_BUFFER, self.texture)
+        self.mesh.draw(skinned=1, **uniforms)
 
-    def draw(self, **uniforms):
-        world_transforms = [node.world_transform for node in self.bone_nodes]
-        uniforms['bone_matrix'] = world_transforms @ self.bone_offsets
-        self.mesh.draw(**uniforms)
+    def __del__(self):
+        state.delete_textures([self.texture])
+        state.delete_buffers([self.buffer])
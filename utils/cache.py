@@ -0,0 +1,78 @@
+"""
+Small on-disk cache for arrays that are expensive to build at startup
+(procedural meshes, ocean spectra, baked animations...). Entries are .npz
+(or memory-mapped .npy) files keyed by a name and the parameters used to
+build them.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+CACHE_DIR = "cache"
+CACHE_VERSION = 1   # bump to invalidate every entry when a generator changes
+
+
+def cache_path(name, **params):
+    """ path of the cache entry for 'name' built with 'params' """
+    key = repr((CACHE_VERSION, name, sorted(params.items())))
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"{name}_{digest}.npz")
+
+
+def array_key(array):
+    """ short digest of an array's content, to use an array as a parameter of a cache entry """
+    return hashlib.sha1(np.ascontiguousarray(array).tobytes()).hexdigest()[:16]
+
+
+def cached_arrays(name, build, **params):
+    """
+    Returns the dict of arrays built by build(**params), loading it from disk
+    when it has already been computed with the same parameters.
+    """
+    path = cache_path(name, **params)
+    if os.path.exists(path):
+        try:
+            with np.load(path) as entry:
+                return {key: entry[key] for key in entry.files}
+        except (OSError, ValueError):
+            pass  # corrupted entry => rebuild it
+
+    arrays = build(**params)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)  # atomic, no half written entry
+    except OSError:
+        pass  # read-only location => simply don't cache
+    return arrays
+
+
+def cached_memmap(name, shape, fill, dtype=np.float32, **params):
+    """
+    Read-only memory-mapped array of the given shape, filled once by fill(array)
+    and then reused by the next launches. Useful for data too big to be loaded at once.
+    """
+    path = cache_path(name, **params)[:-len(".npz")] + ".npy"
+    if os.path.exists(path):
+        try:
+            array = np.lib.format.open_memmap(path, mode='r')
+            if array.shape == tuple(shape) and array.dtype == dtype:
+                return array
+        except (OSError, ValueError):
+            pass  # corrupted entry => rebuild it
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = path + ".tmp.npy"
+        array = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=tuple(shape))
+        fill(array)
+        array.flush()
+        del array
+        os.replace(tmp_path, path)
+        return np.lib.format.open_memmap(path, mode='r')
+    except OSError:
+        array = np.empty(shape, dtype=dtype)  # read-only location => in memory only
+        fill(array)
+        return array
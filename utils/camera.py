@@ -1,5 +1,5 @@
 import glfw
-from utils.transform import vec, translate, normalized, np, perspective
+from utils.transform import vec, translate, normalized, np, perspective, frustum_planes, boxes_in_frustum
 
 class Camera:
     """
@@ -31,9 +31,12 @@ class Camera:
         self.sensitivity = 0.1
         self.update_vectors()
 
-        # camera matrices
+        # camera matrices, recomputed only when what they depend on changed
         self.view = None
         self.proj = None
+        self.view_key = None
+        self.proj_key = None
+        self.context = None
 
 
 
@@ -54,15 +57,31 @@ class Camera:
 
 
     def view_matrix(self):
-        rotation = np.identity(4)
-        rotation[:3, :3] = np.vstack([self.rgt, self.up, -self.fwd])
-        self.view = rotation @ translate(-self.camera_pos)
+        key = (tuple(self.camera_pos), tuple(self.rgt), tuple(self.up), tuple(self.fwd))
+        if key != self.view_key:  # moved or turned since the last call
+            rotation = np.identity(4)
+            rotation[:3, :3] = np.vstack([self.rgt, self.up, -self.fwd])
+            self.view = rotation @ translate(-self.camera_pos)
+            self.view_key = key
         return self.view
 
     def projection_matrix(self, winsize):
-        self.proj = perspective(90, winsize[0] / winsize[1], 0.1, 15000.0)
+        if tuple(winsize) != self.proj_key:
+            self.proj = perspective(90, winsize[0] / winsize[1], 0.1, 15000.0)
+            self.proj_key = tuple(winsize)
         return self.proj
 
+    def frame_context(self, winsize, time=0.0, dt=0.0):
+        """ FrameContext of the frame, its matrices are only recomputed if the camera or the window changed """
+        view, proj = self.view_matrix(), self.projection_matrix(winsize)
+        context = self.context
+        if context is None or context.view is not view or context.projection is not proj:
+            context = FrameContext(view, proj, np.copy(self.camera_pos), self.up, self.rgt)
+        context.time, context.dt = time, dt
+        context.changed = context is not self.context
+        self.context = context
+        return context
+
     def handle_keys(self, key, action, delta_time):
 
         speed = self.speed * delta_time
@@ -128,3 +147,54 @@ class Camera:
             self.pitch = -boundary
         self.update_vectors()
 
+
+class FrameContext:
+    """
+    Everything the frame's draws need to know about the camera, computed once per frame by Camera.frame_context:
+    view, projection & view-projection matrices, their inverses, the frustum planes, the frame's time & dt.
+    changed is False when the matrices are the same as the previous frame's.
+    """
+    def __init__(self, view, projection, camera_position, camera_up, camera_right):
+        self.view = view
+        self.projection = projection
+        self.view_projection = projection @ view
+        self.inverse_view = np.linalg.inv(view)
+        self.inverse_projection = np.linalg.inv(projection)
+        self.inverse_view_projection = self.inverse_view @ self.inverse_projection
+        self.frustum_planes = frustum_planes(self.view_projection)
+        self.camera_position = camera_position
+        self.camera_up = camera_up
+        self.camera_right = camera_right
+        self.time = 0.0
+        self.dt = 0.0
+        self.changed = True
+
+
+class Frustum:
+    """
+    View frustum of the camera, extracted once per frame, to skip the objects whose bounding box is outside.
+    stats counts the boxes tested and the objects culled & drawn since the last reset_stats.
+    """
+    def __init__(self):
+        self.planes = None
+        self.stats = dict(tested=0, culled=0, drawn=0)
+
+    def update(self, frame):
+        """ planes of the FrameContext """
+        self.planes = frame.frustum_planes
+
+    def reset_stats(self):
+        """ returns the boxes tested & the objects culled and drawn since the last call """
+        stats = dict(self.stats)
+        self.stats.update(tested=0, culled=0, drawn=0)
+        return stats
+
+    def visible(self, boxes):
+        """ mask of the world boxes (n, 2, 3) intersecting the frustum """
+        self.stats['tested'] += len(boxes)
+        return boxes_in_frustum(self.planes, boxes)
+
+    def account(self, drawn, total):
+        """ drawn objects out of total after the tests """
+        self.stats['drawn'] += int(drawn)
+        self.stats['culled'] += int(total - drawn)
@@ -0,0 +1,97 @@
+"""
+Camera flythroughs: keyframed position, pitch & yaw splines (utils/animation keyframes), saved as json,
+recorded from the interactive camera ('R') and played back ('V', main.py --benchmark), so that every
+performance run sees exactly the same views.
+"""
+import json
+
+import numpy as np
+
+from utils.animation import SplineKeyFrames
+from utils.transform import vec
+
+
+class CameraPath:
+    """
+    keys: (time, position, pitch, yaw) tuples. The yaw is unwrapped, the camera always turns the short way
+    between two keys. Json file: {"keys": [{"time": t, "position": [x, y, z], "pitch": p, "yaw": y}, ...]}
+    """
+    def __init__(self, keys):
+        keys = sorted(keys, key=lambda key: key[0])
+        assert keys, "a camera path needs at least one key"
+        times = np.array([key[0] for key in keys], dtype=np.float32)
+        values = np.array([(*key[1], key[2], key[3]) for key in keys], dtype=np.float64)
+        values[:, 4] = np.rad2deg(np.unwrap(np.deg2rad(values[:, 4])))
+        self.keyframes = SplineKeyFrames((times, values))
+
+    @property
+    def duration(self):
+        return float(self.keyframes.times[-1] - self.keyframes.times[0])
+
+    @staticmethod
+    def from_viewpoints(viewpoints, duration):
+        """ evenly timed path through (position, pitch, yaw) viewpoints, e.g. Camera.camera_positions """
+        step = duration / max(len(viewpoints) - 1, 1)
+        return CameraPath([(i * step, position, pitch, yaw) for i, (position, pitch, yaw) in enumerate(viewpoints)])
+
+    @staticmethod
+    def load(path):
+        with open(path) as file:
+            keys = json.load(file)["keys"]
+        return CameraPath([(key["time"], key["position"], key["pitch"], key["yaw"]) for key in keys])
+
+    def save(self, path):
+        keys = [dict(time=float(time), position=[float(v) for v in values[:3]], pitch=float(values[3]),
+                     yaw=float(values[4])) for time, values in zip(self.keyframes.times, self.keyframes.values)]
+        with open(path, 'w') as file:  # one key per line
+            file.write('{"keys": [\n' + ',\n'.join(json.dumps(key) for key in keys) + '\n]}\n')
+
+    def apply(self, camera, time):
+        """ moves the camera at its pose of the path at 'time' (s from the first key) """
+        values = self.keyframes.value(self.keyframes.times[0] + time)
+        camera.camera_pos = vec(values[:3])
+        camera.pitch, camera.yaw = float(values[3]), float(values[4])
+        camera.update_vectors()
+
+
+class CameraPlayer:
+    """
+    Plays a path back from the first update. step=None: at the frames' time (real time playback),
+    else frame-locked: each frame advances the path by 'step' seconds, whatever its duration.
+    """
+    def __init__(self, path, step=None, loop=False):
+        self.path = path
+        self.step = step
+        self.loop = loop
+        self.start = None
+        self.frame = 0
+
+    def update(self, camera, time=0.0):
+        """ places the camera for this frame, False once the path is over (the camera stays at its end) """
+        if self.start is None:
+            self.start = time
+        elapsed = self.frame * self.step if self.step is not None else time - self.start
+        self.frame += 1
+        duration = self.path.duration
+        if self.loop and duration > 0.0:
+            elapsed %= duration
+        self.path.apply(camera, elapsed)
+        return elapsed <= duration
+
+
+class CameraRecorder:
+    """ samples the interactive camera every 'interval' seconds, path() makes them a CameraPath """
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.keys = []
+        self.start = None
+
+    def record(self, camera, time):
+        if self.start is None:
+            self.start = time
+        time -= self.start
+        if not self.keys or time - self.keys[-1][0] >= self.interval:
+            self.keys.append((time, np.copy(camera.camera_pos), camera.pitch, camera.yaw))
+
+    def path(self):
+        return CameraPath(self.keys)
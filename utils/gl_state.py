@@ -0,0 +1,139 @@
+"""
+Thin cache of the OpenGL state the scene changes while drawing: program, vertex array, buffers (generic & indexed
+bindings), texture units, image units, capabilities, depth/cull/blend settings & framebuffer. Every module binds
+through the shared 'state', which skips the calls that wouldn't change anything and counts them (same idea as
+Shader.set_uniform for the uniforms). After any raw GL call changing one of these, call state.invalidate().
+"""
+import OpenGL.GL as GL
+
+
+class GLState:
+    """ the last value given to OpenGL for each binding / setting, absent = unknown => always set """
+
+    def __init__(self):
+        self.stats = dict(calls=0, skipped=0)
+        self.invalidate()
+
+    def invalidate(self):
+        """ forgets everything (new context, raw GL calls), the next calls all reach OpenGL """
+        self.bindings = {}          # 'program', 'vertex_array', 'active_unit', 'framebuffer' -> object
+        self.buffers = {}           # target -> buffer, generic bindings
+        self.indexed_buffers = {}   # (target, index) -> buffer, glBindBufferBase
+        self.textures = {}          # (unit, target) -> texture
+        self.images = {}            # unit -> glBindImageTexture arguments
+        self.capabilities = {}      # capability -> enabled
+        self.settings = {}          # 'depth_func', 'depth_mask', 'cull_face', 'blend_func' -> arguments
+
+    def changed(self, cache, key, value):
+        """ stores value in cache[key], False (& counted as skipped) if it was already there """
+        if cache.get(key, self) == value:
+            self.stats['skipped'] += 1
+            return False
+        cache[key] = value
+        self.stats['calls'] += 1
+        return True
+
+    def reset_stats(self):
+        """ returns the calls made & skipped since the last call """
+        stats = dict(self.stats)
+        self.stats.update(calls=0, skipped=0)
+        return stats
+
+    # ---- program & vertex arrays
+    def use_program(self, program):
+        if self.changed(self.bindings, 'program', program):
+            GL.glUseProgram(program)
+
+    def bind_vertex_array(self, vertex_array):
+        if self.changed(self.bindings, 'vertex_array', vertex_array):
+            GL.glBindVertexArray(vertex_array)
+            self.buffers.pop(GL.GL_ELEMENT_ARRAY_BUFFER, None)  # part of the vertex array's state
+
+    # ---- buffers
+    def bind_buffer(self, target, buffer):
+        if self.changed(self.buffers, target, buffer):
+            GL.glBindBuffer(target, buffer)
+
+    def bind_buffer_base(self, target, index, buffer):
+        """ indexed binding (ssbo, ubo), which also sets the generic binding of target """
+        if self.changed(self.indexed_buffers, (target, index), buffer):
+            GL.glBindBufferBase(target, index, buffer)
+            self.buffers[target] = buffer
+
+    # ---- textures
+    def active_texture(self, unit):
+        if self.changed(self.bindings, 'active_unit', unit):
+            GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
+
+    def bind_texture(self, unit, target, texture):
+        """ texture sampled from 'unit', the active unit only changes when a bind is needed """
+        if self.textures.get((unit, target), self) == texture:
+            self.stats['skipped'] += 1
+            return
+        self.active_texture(unit)
+        self.textures[(unit, target)] = texture
+        self.stats['calls'] += 1
+        GL.glBindTexture(target, texture)
+
+    def edit_texture(self, target, texture):
+        """ texture bound on the active unit 0, for the glTex* calls creating or updating it """
+        self.active_texture(0)
+        self.bind_texture(0, target, texture)
+
+    def bind_image_texture(self, unit, texture, level, layered, layer, access, internal_format):
+        if self.changed(self.images, unit, (texture, level, layered, layer, access, internal_format)):
+            GL.glBindImageTexture(unit, texture, level, layered, layer, access, internal_format)
+
+    # ---- fixed function toggles & settings
+    def enable(self, capability):
+        if self.changed(self.capabilities, capability, True):
+            GL.glEnable(capability)
+
+    def disable(self, capability):
+        if self.changed(self.capabilities, capability, False):
+            GL.glDisable(capability)
+
+    def depth_func(self, func):
+        if self.changed(self.settings, 'depth_func', func):
+            GL.glDepthFunc(func)
+
+    def depth_mask(self, flag):
+        if self.changed(self.settings, 'depth_mask', bool(flag)):
+            GL.glDepthMask(flag)
+
+    def cull_face(self, mode):
+        if self.changed(self.settings, 'cull_face', mode):
+            GL.glCullFace(mode)
+
+    def blend_func(self, source, destination):
+        if self.changed(self.settings, 'blend_func', (source, destination)):
+            GL.glBlendFunc(source, destination)
+
+    def bind_framebuffer(self, framebuffer):
+        """ GL_FRAMEBUFFER, i.e. both the draw & read framebuffers """
+        if self.changed(self.bindings, 'framebuffer', framebuffer):
+            GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, framebuffer)
+
+    # ---- deletions: OpenGL unbinds deleted objects, their names can then be reused
+    def delete_buffers(self, buffers):
+        buffers = [int(buffer) for buffer in buffers]
+        for cache in (self.buffers, self.indexed_buffers):
+            for key in [key for key, buffer in cache.items() if buffer in buffers]:
+                del cache[key]
+        GL.glDeleteBuffers(len(buffers), buffers)
+
+    def delete_textures(self, textures):
+        textures = [int(texture) for texture in textures]
+        for key in [key for key, texture in self.textures.items() if texture in textures]:
+            del self.textures[key]
+        for key in [key for key, arguments in self.images.items() if arguments[0] in textures]:
+            del self.images[key]
+        GL.glDeleteTextures(len(textures), textures)
+
+    def delete_vertex_array(self, vertex_array):
+        if self.bindings.get('vertex_array') == vertex_array:
+            del self.bindings['vertex_array']
+        GL.glDeleteVertexArrays(1, [vertex_array])
+
+
+state = GLState()  # one OpenGL context
@@ -0,0 +1,384 @@
+"""
+Recording stand-in for OpenGL.GL (and glfw), to run the scene on machines without a gpu (CI, batch hosts)
+and measure what a frame submits from python, deterministically.
+
+    from utils.gl_stub import install
+    recorder = install(frames=10)   # before importing any module of the scene
+    from main import main; main([]) # runs 10 frames
+    print(recorder.report())
+
+Every gl call is counted with its arguments, handles are made up and the introspection (active uniforms,
+attributes, blocks) is answered from the glsl sources given to glShaderSource, every declared uniform
+being active. Nothing is drawn.
+Run 'python -m utils.gl_stub [frames]' for the report of the whole viewer.
+"""
+from collections import Counter
+import re
+import sys
+import types
+import zlib
+from time import perf_counter_ns
+
+import numpy as np
+
+# constants whose value matters to the code using them, the other ones get a unique made up value
+KNOWN_CONSTANTS = dict(GL_FALSE=0, GL_TRUE=1, GL_NO_ERROR=0, GL_NONE=0, GL_ZERO=0, GL_ONE=1,
+                       GL_TEXTURE0=0x84C0, GL_TEXTURE_CUBE_MAP_POSITIVE_X=0x8515, GL_INVALID_INDEX=0xFFFFFFFF)
+
+# glsl type => name of its GL_ type constant
+GLSL_TYPES = dict(float='FLOAT', int='INT', uint='UNSIGNED_INT', bool='BOOL')
+for n in '234':
+    GLSL_TYPES.update({'vec' + n: 'FLOAT_VEC' + n, 'ivec' + n: 'INT_VEC' + n, 'uvec' + n: 'UNSIGNED_INT_VEC' + n,
+                       'bvec' + n: 'BOOL_VEC' + n, 'mat' + n: 'FLOAT_MAT' + n})
+for kind in ('sampler', 'image'):
+    for dim, suffix in (('1D', '1D'), ('2D', '2D'), ('3D', '3D'), ('Cube', 'CUBE'), ('2DArray', '2D_ARRAY'), ('Buffer', 'BUFFER')):
+        for prefix, type_prefix in (('', ''), ('i', 'INT_'), ('u', 'UNSIGNED_INT_')):
+            GLSL_TYPES[prefix + kind + dim] = type_prefix + kind.upper() + '_' + suffix
+
+COMMENTS = re.compile(r'//[^\n]*|/\*.*?\*/', re.S)
+BLOCK = re.compile(r'\b(uniform|buffer)\s+(\w+)\s*\{[^}]*\}[^;]*;')
+UNIFORM = re.compile(r'\buniform\s+(?:(?:lowp|mediump|highp)\s+)?(\w+)\s+([^;]+);')
+INPUT = re.compile(r'(?:layout\s*\(\s*location\s*=\s*(\d+)\s*\)\s*)?\bin\s+\w+\s+(\w+)\s*;')
+DEFINE = re.compile(r'#define\s+(\w+)\s+(\S+)')
+
+
+class Constant(int):
+    """ GL enum printing its name, like PyOpenGL's """
+    def __new__(cls, name, value):
+        constant = super().__new__(cls, value)
+        constant.name = name
+        return constant
+
+    def __repr__(self):
+        return self.name
+    __str__ = __repr__
+
+
+class Program:
+    """ what the introspection of a linked program answers, parsed from its shaders' sources """
+    def __init__(self, sources):
+        self.uniforms = []      # (name, size, GL_ type name), in declaration order
+        self.blocks, self.buffers, self.attributes = [], [], {}
+        for stage, source in sources:
+            defines = dict(DEFINE.findall(source))
+            source = COMMENTS.sub('', source)
+            for kind, name in BLOCK.findall(source):
+                blocks = self.blocks if kind == 'uniform' else self.buffers
+                if name not in blocks:  # same block declared in several stages
+                    blocks.append(name)
+            for glsl_type, names in UNIFORM.findall(BLOCK.sub('', source)):
+                for declaration in names.split(','):
+                    name, _, size = declaration.split('=')[0].strip().partition('[')
+                    size = size.rstrip(']').strip()
+                    size = int(defines.get(size, size)) if size else 1
+                    if glsl_type in GLSL_TYPES and name not in (u[0] for u in self.uniforms):
+                        self.uniforms.append((name, size, GLSL_TYPES[glsl_type]))
+            if stage == 'GL_VERTEX_SHADER':
+                for location, name in INPUT.findall(source):
+                    self.attributes[name] = int(location) if location else len(self.attributes)
+
+
+class GLRecorder:
+    """
+    The fake OpenGL.GL module (self.module) & what it records. end_frame() closes the frame's report:
+    calls per function, draw calls & dispatches, program and texture binding changes, bytes uploaded.
+    """
+    def __init__(self, record_calls=False):
+        self.module = types.ModuleType('OpenGL.GL')
+        self.module.__getattr__ = self.attribute
+        self.log = [] if record_calls else None   # (function, args) of the current frame
+        self.frames = []                            # reports of the finished frames
+        self.handles = 0
+        self.shaders, self.programs, self.textures, self.queries = {}, {}, {}, {}
+        self.setup = None                           # report of the calls before the first frame
+        self.unit, self.bindings, self.program = 0, {}, 0
+        self.reset()
+
+    def reset(self):
+        self.calls = Counter()
+        self.uploaded = Counter()
+        self.program_changes = self.texture_changes = 0
+
+    def attribute(self, name):
+        """ module __getattr__: constants & recording functions, created on first use """
+        if name.startswith('GL_'):
+            value = KNOWN_CONSTANTS.get(name, 0x10000 + zlib.crc32(name.encode()) % 0x7FFF0000)
+            attribute = Constant(name, value)
+        elif name.startswith('gl'):
+            attribute = self.function(name)
+        else:
+            raise AttributeError(name)
+        setattr(self.module, name, attribute)
+        return attribute
+
+    def function(self, name):
+        handler = getattr(self, '_' + name, None)
+
+        def call(*args):
+            self.calls[name] += 1
+            if self.log is not None:
+                self.log.append((name, args))
+            return handler(*args) if handler else None
+        call.__name__ = name
+        return call
+
+    def constant(self, name):
+        return getattr(self.module, name)
+
+    def end_frame(self):
+        """ report of the calls since the last frame """
+        draws = sum(count for name, count in self.calls.items() if name.startswith('glDraw'))
+        dispatches = sum(count for name, count in self.calls.items() if name.startswith('glDispatch'))
+        report = dict(calls=sum(self.calls.values()), draw_calls=draws, dispatches=dispatches,
+                      program_changes=self.program_changes, texture_changes=self.texture_changes,
+                      bytes_uploaded=sum(self.uploaded.values()), uploads=dict(self.uploaded),
+                      functions=dict(self.calls.most_common()))
+        self.frames.append(report)
+        self.reset()
+        if self.log is not None:
+            self.log = []
+        return report
+
+    def end_setup(self):
+        """ the calls so far were the scene's creation, not a frame """
+        self.setup = self.end_frame()
+        self.frames.pop()
+
+    def report(self, first=0):
+        """ one line per recorded frame, then the calls of the last one """
+        lines = [f"{'frame':>5}{'calls':>8}{'draws':>7}{'dispatch':>9}{'programs':>9}{'textures':>9}{'uploaded':>12}"]
+        for index, frame in enumerate(self.frames[first:], first):
+            lines.append(f"{index:>5}{frame['calls']:>8}{frame['draw_calls']:>7}{frame['dispatches']:>9}"
+                         f"{frame['program_changes']:>9}{frame['texture_changes']:>9}{frame['bytes_uploaded']:>12}")
+        if self.frames:
+            lines.append('calls of the last frame: ' + ', '.join(f'{name} {count}'
+                                                                  for name, count in self.frames[-1]['functions'].items()))
+        return '\n'.join(lines)
+
+    # ---- handles
+    def new_handle(self):
+        self.handles += 1
+        return self.handles
+
+    def handles_array(self, count):
+        handles = np.array([self.new_handle() for _ in range(count)], dtype=np.uint32)
+        return handles[0] if count == 1 else handles
+
+    def _glGenBuffers(self, count):
+        return self.handles_array(count)
+    _glGenTextures = _glGenVertexArrays = _glGenFramebuffers = _glGenRenderbuffers = _glGenQueries = _glGenBuffers
+
+    def _glCreateShader(self, stage):
+        handle = self.new_handle()
+        self.shaders[handle] = [str(stage), '']
+        return handle
+
+    def _glShaderSource(self, shader, source):
+        self.shaders[shader][1] = source if isinstance(source, str) else ''.join(source)
+
+    def _glCreateProgram(self):
+        handle = self.new_handle()
+        self.programs[handle] = []
+        return handle
+
+    def _glAttachShader(self, program, shader):
+        self.programs[program].append(tuple(self.shaders[shader]))
+
+    def _glLinkProgram(self, program):
+        self.programs[program] = Program(self.programs[program])
+
+    # ---- introspection
+    def _glGetShaderiv(self, shader, pname):
+        return 1
+
+    def _glGetProgramiv(self, program, pname):
+        if pname == self.constant('GL_ACTIVE_UNIFORMS'):
+            return len(self.programs[program].uniforms)
+        return 1
+
+    def _glGetShaderInfoLog(self, shader):
+        return b''
+    _glGetProgramInfoLog = _glGetShaderInfoLog
+
+    def _glGetActiveUniform(self, program, index):
+        name, size, type_ = self.programs[program].uniforms[index]
+        return (name + '[0]' if size > 1 else name).encode(), size, self.constant('GL_' + type_)
+
+    def _glGetUniformLocation(self, program, name):
+        names = [uniform[0] for uniform in self.programs[program].uniforms]
+        return names.index(name) if name in names else -1
+
+    def _glGetAttribLocation(self, program, name):
+        return self.programs[program].attributes.get(name, -1)
+
+    def _glGetUniformBlockIndex(self, program, name):
+        blocks = self.programs[program].blocks
+        return blocks.index(name) if name in blocks else self.constant('GL_INVALID_INDEX')
+
+    def _glGetProgramResourceIndex(self, program, interface, name):
+        buffers = self.programs[program].buffers
+        return buffers.index(name) if name in buffers else self.constant('GL_INVALID_INDEX')
+
+    def _glGetError(self):
+        return 0
+
+    def _glCheckFramebufferStatus(self, target):
+        return self.constant('GL_FRAMEBUFFER_COMPLETE')
+
+    def _glGetString(self, name):
+        return b'4.5 (recording stub)' if name == self.constant('GL_VERSION') else b'stub'
+
+    # ---- queries, answered at once with the cpu clock
+    def _glQueryCounter(self, query, target):
+        self.queries[query] = perf_counter_ns()
+
+    def _glGetQueryObjectiv(self, query, pname, result):
+        result[0] = 1
+
+    def _glGetQueryObjecti64v(self, query, pname, result):
+        result[0] = self.queries.get(query, 0)
+
+    def _glGetInteger64v(self, pname, result):
+        result[0] = perf_counter_ns()
+
+    # ---- bindings
+    def _glUseProgram(self, program):
+        if program != self.program:
+            self.program_changes += 1
+            self.program = program
+
+    def _glActiveTexture(self, unit):
+        self.unit = unit - self.constant('GL_TEXTURE0')
+
+    def _glBindTexture(self, target, texture):
+        if self.bindings.get((self.unit, target)) != texture:
+            self.texture_changes += 1
+            self.bindings[(self.unit, target)] = texture
+
+    def bound_texture(self, target):
+        faces = self.constant('GL_TEXTURE_CUBE_MAP_POSITIVE_X')
+        if faces <= target < faces + 6:
+            target = self.constant('GL_TEXTURE_CUBE_MAP')
+        return self.bindings.get((self.unit, target))
+
+    # ---- uploads
+    def upload(self, function, data, size=None):
+        if data is None:
+            return
+        self.uploaded[function] += int(size) if size is not None else (len(data) if isinstance(data, bytes)
+                                                                       else np.asarray(data).nbytes)
+
+    def _glBufferData(self, target, size_or_data, data=None, usage=None):
+        if usage is None:   # glBufferData(target, data, usage)
+            self.upload('glBufferData', size_or_data)
+        else:
+            self.upload('glBufferData', data, size_or_data)
+
+    def _glBufferSubData(self, target, offset, size, data):
+        self.upload('glBufferSubData', data, size)
+
+    def _glTexImage2D(self, target, level, internal_format, width, height, border, format, type_, data):
+        if level == 0:
+            self.textures[self.bound_texture(target)] = (width, height, 1)
+        self.upload('glTexImage2D', data)
+
+    def _glTexImage3D(self, target, level, internal_format, width, height, depth, border, format, type_, data):
+        if level == 0:
+            self.textures[self.bound_texture(target)] = (width, height, depth)
+        self.upload('glTexImage3D', data)
+
+    def _glTexStorage2D(self, target, levels, internal_format, width, height):
+        self.textures[self.bound_texture(target)] = (width, height, 1)
+
+    def _glTexStorage3D(self, target, levels, internal_format, width, height, depth):
+        self.textures[self.bound_texture(target)] = (width, height, depth)
+
+    def _glTexSubImage2D(self, *args):
+        self.upload('glTexSubImage2D', args[-1])
+
+    def _glTexSubImage3D(self, *args):
+        self.upload('glTexSubImage3D', args[-1])
+
+    def _glGetTexImage(self, target, level, format, type_):
+        """ zeros, of the size of the bound texture """
+        channels = {'GL_RED': 1, 'GL_RG': 2, 'GL_RGB': 3, 'GL_RGBA': 4}.get(str(format), 1)
+        size = 1 if type_ == self.constant('GL_UNSIGNED_BYTE') else 4
+        width, height, depth = self.textures.get(self.bound_texture(target), (0, 0, 0))
+        return bytes(width * height * depth * channels * size)
+
+
+class GLFWStub:
+    """
+    Fake glfw module (self.module): a window closing itself after 'frames' frames and a clock advancing by
+    1/fps at each swap_buffers, which also ends the recorder's frame.
+    """
+    def __init__(self, recorder, frames=10, fps=60.0):
+        self.recorder = recorder
+        self.frames = frames
+        self.fps = fps
+        self.frame = 0
+        self.size = (0, 0)
+        self.should_close = False
+        self.module = types.ModuleType('glfw')
+        self.module.__getattr__ = self.attribute
+        self.module.PRESS, self.module.RELEASE, self.module.REPEAT = 1, 0, 2
+        for name in ('init', 'create_window', 'get_time', 'swap_buffers', 'window_should_close',
+                     'set_window_should_close', 'get_window_size', 'get_framebuffer_size'):
+            setattr(self.module, name, getattr(self, name))
+
+    def attribute(self, name):
+        """ module __getattr__: the constants & the functions that don't matter (hints, callbacks...) """
+        if name.isupper():
+            return Constant(name, 0x10000 + zlib.crc32(name.encode()) % 0x7FFF0000)
+        return lambda *args, **kwargs: None
+
+    def init(self):
+        return True
+
+    def create_window(self, width, height, *args):
+        self.size = (width, height)
+        return object()
+
+    def get_time(self):
+        return self.frame / self.fps
+
+    def swap_buffers(self, window):
+        self.frame += 1
+        self.recorder.end_frame()
+
+    def window_should_close(self, window):
+        if self.recorder.setup is None:  # first call of the render loop
+            self.recorder.end_setup()
+        return self.should_close or self.frame >= self.frames
+
+    def set_window_should_close(self, window, value):
+        self.should_close = bool(value)
+
+    def get_window_size(self, window):
+        return self.size
+    get_framebuffer_size = get_window_size
+
+
+def install(frames=10, record_calls=False):
+    """
+    Replaces OpenGL.GL & glfw by the recording stubs in sys.modules, returns the GLRecorder.
+    To call before any module of the scene is imported.
+    """
+    recorder = GLRecorder(record_calls)
+    try:
+        import OpenGL            # the package only, OpenGL.GL isn't loaded
+        import OpenGL.version    # pylint: disable=unused-import
+    except ImportError:          # no PyOpenGL at all
+        OpenGL = sys.modules['OpenGL'] = types.ModuleType('OpenGL')
+        OpenGL.version = sys.modules['OpenGL.version'] = types.ModuleType('OpenGL.version')
+    OpenGL.GL = sys.modules['OpenGL.GL'] = recorder.module
+    sys.modules['glfw'] = GLFWStub(recorder, frames).module
+    return recorder
+
+
+if __name__ == '__main__':
+    frame_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    gl_recorder = install(frame_count)
+    import main
+    main.main([])  # default scene, the stub's own arguments aren't the scene's
+    print(gl_recorder.report())
@@ -0,0 +1,42 @@
+"""
+Offscreen OpenGL context without any window nor display, through EGL (pbuffer surface).
+With Mesa, EGL_PLATFORM=surfaceless gives llvmpipe on machines without a gpu, so the scene can be
+benchmarked anywhere (see main.py --benchmark). PyOpenGL must be loaded with PYOPENGL_PLATFORM=egl,
+i.e. the variable has to be set before the first 'import OpenGL.GL'.
+"""
+import ctypes
+
+from OpenGL import EGL
+
+
+class HeadlessContext:
+    """ OpenGL >= 4.3 core context (compute shaders) drawing in a width x height pbuffer """
+
+    def __init__(self, width, height, major=4, minor=5):
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        version = (EGL.EGLint(), EGL.EGLint())
+        if not EGL.eglInitialize(self.display, ctypes.pointer(version[0]), ctypes.pointer(version[1])):
+            raise RuntimeError("EGL initialization failed (try EGL_PLATFORM=surfaceless with Mesa)")
+
+        attributes = [EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT, EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                      EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8, EGL.EGL_BLUE_SIZE, 8, EGL.EGL_ALPHA_SIZE, 8,
+                      EGL.EGL_DEPTH_SIZE, 24, EGL.EGL_NONE]
+        config, count = EGL.EGLConfig(), EGL.EGLint()
+        if not EGL.eglChooseConfig(self.display, (EGL.EGLint * len(attributes))(*attributes),
+                                   ctypes.pointer(config), 1, ctypes.pointer(count)) or not count.value:
+            raise RuntimeError("no EGL config with an RGBA8 pbuffer and an OpenGL renderer")
+
+        size = [EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT, height, EGL.EGL_NONE]
+        self.surface = EGL.eglCreatePbufferSurface(self.display, config, (EGL.EGLint * len(size))(*size))
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        context = [EGL.EGL_CONTEXT_MAJOR_VERSION, major, EGL.EGL_CONTEXT_MINOR_VERSION, minor,
+                   EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT, EGL.EGL_NONE]
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT,
+                                            (EGL.EGLint * len(context))(*context))
+        if not self.context:
+            raise RuntimeError(f"no OpenGL {major}.{minor} core context available through EGL")
+        EGL.eglMakeCurrent(self.display, self.surface, self.surface, self.context)
+        self.size = (width, height)
+
+    def swap_buffers(self):
+        EGL.eglSwapBuffers(self.display, self.surface)
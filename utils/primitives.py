@@ -11,17 +11,61 @@ import numpy as np                  # all matrix manipulations & OpenGL args
 import glfw
 import ctypes
 
+from utils.cache import cached_arrays
+from utils.gl_state import state
+from utils.transform import bounding_box
+
 # function that caculates all sines and cosines of the unit circle depending on a number of slices required
 def init_cos_sin(slices):
-    theta_incr = 2*np.pi/slices
-    cosines = []
-    sines = []
-    for i in range(slices):
-        theta = i*theta_incr
-        cosines.append(np.cos(theta))
-        sines.append(np.sin(theta))
-    return cosines, sines
-
+    theta = np.arange(slices) * (2*np.pi/slices)
+    return np.cos(theta), np.sin(theta)
+
+
+def grid_arrays(size, size_factor):
+    """ vertices, uv, normals & indices of a size x size grid, built with numpy """
+    # vertex (x, y) is stored at index x*size + y
+    x, y = np.meshgrid(np.arange(size, dtype=np.float32), np.arange(size, dtype=np.float32), indexing='ij')
+    x, y = x.ravel(), y.ravel()
+    vertices = np.zeros((size*size, 3), dtype=np.float32)
+    vertices[:, 0] = x*size_factor # stretching the mesh -> less computation for the same surface's size
+    vertices[:, 2] = y*size_factor
+    normals = np.zeros_like(vertices)
+    normals[:, 1] = 1.0
+    uv = np.stack((x, y), axis=1) / (size-1)
+
+    # two counterclockwise triangles per unit square, starting at its bottom left corner
+    corner = (np.arange(size-1)[:, None]*size + np.arange(size-1)[None, :]).ravel()
+    offsets = np.array([0, size, 1, 1, size, size+1], dtype=np.uint32)
+    indices = (corner[:, None] + offsets[None, :]).astype(np.uint32).ravel()
+    return dict(vertices=vertices, uv=uv.astype(np.float32), normals=normals, indices=indices)
+
+
+def cylinder_arrays(slices, height, radius_facet_up, radius_facet_down, cosines, sines):
+    """ positions, normals & indices of a cylinder with its two caps, built with numpy """
+    cosines, sines = np.asarray(cosines)[:slices], np.asarray(sines)[:slices]
+    radiuses = np.array([radius_facet_up, radius_facet_down])
+    heights = np.array([height/2, -height/2])
+
+    # one ring of 2*slices vertices (top & bottom interleaved), used by the lateral faces then by the caps
+    ring = np.stack((np.outer(cosines, radiuses), np.tile(heights, (slices, 1)), np.outer(sines, radiuses)), axis=-1).reshape(-1, 3)
+    centers = np.array([(0, height/2, 0), (0, -height/2, 0)])
+    position = np.concatenate((ring, ring, centers))
+
+    lateral_normals = np.repeat(np.stack((cosines, np.zeros(slices), sines), axis=1), 2, axis=0)
+    cap_normals = np.tile([(0, 1/2, 0), (0, -1/2, 0)], (slices+1, 1))
+    normal = np.concatenate((lateral_normals, cap_normals))
+
+    # lateral faces
+    counter = 2*np.arange(slices)
+    nxt = (counter+2) % (2*slices)
+    lateral = np.stack((np.stack((nxt, counter, counter+1), axis=1),
+                        np.stack(((counter+3) % (2*slices), nxt, counter+1), axis=1)), axis=1)
+    # top & bottom faces, fanning around the two centers
+    top_center, bottom_center = 4*slices, 4*slices+1
+    caps = np.stack((np.stack((2*slices + nxt, np.full(slices, top_center), 2*slices + counter), axis=1),
+                     np.stack((2*slices + nxt + 1, 2*slices + counter + 1, np.full(slices, bottom_center)), axis=1)), axis=1)
+    index = np.concatenate((lateral.reshape(-1, 3), caps.reshape(-1, 3)))
+    return dict(position=position.astype(np.float32), normal=normal.astype(np.float32), index=index.astype(np.uint32))
 
 
 class VertexArray:
@@ -33,7 +77,7 @@ class VertexArray:
         self.shader = shader
         # create vertex array object, bind it
         self.glid = GL.glGenVertexArrays(1)
-        GL.glBindVertexArray(self.glid)
+        state.bind_vertex_array(self.glid)
         self.buffers = {}  # we will store buffers in a named dict
         nb_primitives, size = 0, 0
 
@@ -50,7 +94,7 @@ class VertexArray:
                     nb_primitives=data.shape[0]
                     size = 1 
                 GL.glEnableVertexAttribArray(loc)
-                GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[name])
+                state.bind_buffer(GL.GL_ARRAY_BUFFER, self.buffers[name])
                 GL.glBufferData(GL.GL_ARRAY_BUFFER, data, usage)
                 GL.glVertexAttribPointer(loc, size, GL.GL_FLOAT, False, 0, None)
 
@@ -60,30 +104,33 @@ class VertexArray:
         if index is not None:
             self.buffers['index'] = GL.glGenBuffers(1)
             self.index_buffer = np.array(index, np.int32, copy=False)  # good format
-            GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.buffers['index'])
+            state.bind_buffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.buffers['index'])
             GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, self.index_buffer, usage)
             self.draw_command = GL.glDrawElements
             self.arguments = (self.index_buffer.size, GL.GL_UNSIGNED_INT, None)
 
-    def execute(self, primitive, attributes=None, draw_command=None):
-        """ draw a vertex array, either as direct array or indexed array """
+    def execute(self, primitive, attributes=None, draw_command=None, instances=0):
+        """ draw a vertex array, either as direct array or indexed array, optionally several instances at once """
         # optionally update the data attribute VBOs, useful for e.g. particles
         attributes = attributes or {}
         for name, data in attributes.items():
             if name in self.buffers:
-                GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[name])
+                state.bind_buffer(GL.GL_ARRAY_BUFFER, self.buffers[name])
                 GL.glBufferSubData(GL.GL_ARRAY_BUFFER, 0, data)
 
-        GL.glBindVertexArray(self.glid)
+        state.bind_vertex_array(self.glid)
 
-        if not draw_command:
+        if instances:
+            draw_instanced = GL.glDrawElementsInstanced if 'index' in self.buffers else GL.glDrawArraysInstanced
+            draw_instanced(primitive, *self.arguments, instances)
+        elif not draw_command:
             self.draw_command(primitive, *self.arguments)
         else:
             draw_command(primitive, *self.arguments)
 
     def __del__(self):  # object dies => kill GL array and buffers from GPU
-        GL.glDeleteVertexArrays(1, [self.glid])
-        GL.glDeleteBuffers(len(self.buffers), list(self.buffers.values()))
+        state.delete_vertex_array(self.glid)
+        state.delete_buffers(self.buffers.values())
 
 
 # ------------  Mesh is the core drawable -------------------------------------
@@ -94,11 +141,19 @@ class Mesh:
         self.shader = shader
         self.uniforms = uniforms
         self.vertex_array = VertexArray(shader, attributes, index, usage)
-
-    def draw(self, primitives=GL.GL_TRIANGLES, attributes=None, draw_command=None, **uniforms):
-        GL.glUseProgram(self.shader.glid)
+        # the shader can read per-instance model matrices (see DrawList in core.py)
+        self.instanceable = 'instanced' in shader.uniforms
+        # box of the initial positions for the frustum culling, None => never culled
+        position = attributes.get('position')
+        self.bounds = bounding_box(position) if position is not None and np.shape(position)[-1] == 3 else None
+
+    def draw(self, primitives=GL.GL_TRIANGLES, attributes=None, draw_command=None, instances=0, **uniforms):
+        state.use_program(self.shader.glid)
+        if self.instanceable:
+            uniforms['instanced'] = int(instances > 0)
+        uniforms.setdefault('skinned', 0)  # only enabled by Skinned, for the shaders supporting it
         self.shader.set_uniforms({**self.uniforms, **uniforms})
-        self.vertex_array.execute(primitives, attributes, draw_command=draw_command)
+        self.vertex_array.execute(primitives, attributes, draw_command=draw_command, instances=instances)
 
 
 class Axis(Mesh):
@@ -133,57 +188,15 @@ class Cylinder(Mesh):
     """ Class for drawing a cylinder object """
     def __init__(self, shader, slices, height, radius_facet_up, radius_facet_down, cosines, sines):
         self.shader = shader
-        radiuses = [radius_facet_up, radius_facet_down]
+        arrays = cylinder_arrays(slices, height, radius_facet_up, radius_facet_down, cosines, sines)
 
-        position = []
-        normal = []
-        index = []
-        
-        #lateral faces
-        for i in range(slices):
-            counter = 2*i
-            index.append(((counter+2)%(2*slices), counter, counter+1))
-            index.append(((counter+3)%(2*slices), (counter+2)%(2*slices), counter+1))
-
-            for j in range(2):
-                h = height/2 - height * j
-                position.append((cosines[i] * radiuses[j], h, sines[i] * radiuses[j]))
-                normal.append((cosines[i], 0, sines[i]))
-        
-        #add again all points
-
-        for i in range(slices-1):
-            counter = 2*i
-            for j in range(2):
-                h = height/2 - height * j
-                a = 1/2
-                position.append((cosines[i] * radiuses[j], h, sines[i] * radiuses[j]))
-            index.append(((counter+2+2*slices)%(4*slices), 4*slices, counter+2*slices))
-            index.append(((counter+3+2*slices)%(4*slices), counter+1+2*slices, 4*slices+1))
-            normal.append((0, 1/2, 0))
-            normal.append((0, -1/2, 0))
-        # we add the last two vertices manually
-        index.append(((2*slices), 4*slices, 4*slices-2))
-        index.append(((2*slices+1), 4*slices-1, 4*slices+1))
-        normal.append((0, 1/2, 0))
-        normal.append((0, -1/2, 0))
-        position.append((cosines[slices-1] * radiuses[0], height/2, sines[slices-1] * radiuses[0]))
-        position.append((cosines[slices-1] * radiuses[1], -height/2, sines[slices-1] * radiuses[1]))
-
-        #add bottom and top points
-        for j in range(2):
-            h = height/2 - height * j
-            a = 1/2 - 1*j
-            position.append((0, h, 0))
-            normal.append((0, a, 0))
-
-        self.position = np.array((position), 'f')
-        self.normal = np.array(normal, 'f')
+        self.position = arrays['position']
+        self.normal = arrays['normal']
         self.color = self.position
 
-        self.index = np.array(index, np.uint32)
+        self.index = arrays['index']
 
-        attributes = dict(position=position, normal=self.normal)
+        attributes = dict(position=self.position, normal=self.normal)
         super().__init__(shader, attributes=attributes, index=self.index)
 
 
@@ -196,17 +209,9 @@ class Cylinder(Mesh):
 class Cube(Mesh):
     def __init__(self, shader, r):
          # front face regarding the camera but back face regarding world
-        positions = [
-            (-r, r, -r), 
-            (-r, -r, -r),
-            (r, -r, -r),
-            (r, r, -r),
-            (-r, r, r),
-            (-r, -r, r),
-            (r, -r, r),
-            (r, r, r)
-        ]
-        indices=[0, 1, 2, 0, 2, 3, 4, 6, 5, 4, 7, 6, 7, 2, 6, 7, 3, 2, 0, 5, 1, 0, 4, 5, 4, 0, 3, 4, 3, 7, 5, 2, 1, 5, 6, 2]
+        positions = r * np.array([(-1, 1, -1), (-1, -1, -1), (1, -1, -1), (1, 1, -1),
+                                  (-1, 1, 1), (-1, -1, 1), (1, -1, 1), (1, 1, 1)], dtype=np.float32)
+        indices = np.array([0, 1, 2, 0, 2, 3, 4, 6, 5, 4, 7, 6, 7, 2, 6, 7, 3, 2, 0, 5, 1, 0, 4, 5, 4, 0, 3, 4, 3, 7, 5, 2, 1, 5, 6, 2], dtype=np.uint32)
 
         super().__init__(shader, attributes=dict(position=positions), index=indices)
     
@@ -227,36 +232,9 @@ class Quad(Mesh):
 class Grid(Mesh):
     def __init__(self, shader, size, size_factor): #size = grid's length & width = square grid
         self.size = size
-        vertices = []
-        uv = []
-        normals = []
-
-        # initializing mesh vertices, normals && uv coordinates for texturing
-        for x in range(0, size):
-            for y in range (0, size):
-                x = float(x)
-                y = float(y)
-                vertices.append((x*size_factor, 0.0, y*size_factor)) # stretching the mesh -> less computation for the same surface's size
-                normals.append((0.0, 1.0, 0.0))
-                uv.append((x/(size-1), y/(size-1)))
-
-
-        # initializing mesh indices for EBO 
-        indices = []
-
-        for x in range(0, size-1):
-            for y in range (0,size-1): # for each unit square in the mesh grid
-                
-                # first triangle : bottom left -> bottom right -> top left (counterclockwise)
-                indices.append(x * size + y)
-                indices.append((x+1)*size + y)
-                indices.append(x*size + y + 1)
-
-                # second triangle : top left -> bottom right -> top right (counterclockwise)
-                indices.append(x * size + y + 1)
-                indices.append((x+1)*size + y)
-                indices.append((x+1)*size + y + 1)
-        super().__init__(shader, attributes=dict(position=vertices, uv=uv, normal=normals), index=indices)
+        # building a big grid is slow => the arrays are cached on disk for the next launches
+        arrays = cached_arrays("grid", grid_arrays, size=size, size_factor=size_factor)
+        super().__init__(shader, attributes=dict(position=arrays['vertices'], uv=arrays['uv'], normal=arrays['normals']), index=arrays['indices'])
     
     def draw(self, primitives=GL.GL_TRIANGLES, draw_command=None, **uniforms):
         
@@ -0,0 +1,154 @@
+"""
+Frame profiler: named scopes around the stages of a frame, measuring their cpu time and, with timestamp
+queries, their gpu time. The queries are read back a few frames later, only once their results are
+available, so the profiler never makes the cpu wait for the gpu.
+"""
+from collections import deque
+from contextlib import contextmanager
+import json
+from time import perf_counter
+
+import numpy as np
+import OpenGL.GL as GL
+
+
+class Profiler:
+    """
+    begin_frame() once per frame, then 'with profiler.scope("name"):' around each stage (scopes can nest).
+    stats() gives the rolling percentiles of the last 'history' frames and export_trace(path) writes the
+    same frames as a Chrome trace (chrome://tracing, ui.perfetto.dev).
+    Timestamp queries (glQueryCounter) rather than GL_TIME_ELAPSED ones, as those can't be nested.
+    """
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, gpu=True, latency=3, history=300, enabled=True):
+        self.enabled = enabled
+        self.gpu = gpu
+        self.latency = latency          # frames waited before polling the queries of a frame
+        self.history = history
+        self.origin = perf_counter()
+        self.frame = -1
+        self.scopes = []                # (name, cpu start, cpu end, start query, end query) of the current frame
+        self.pending = deque()          # (frame, scopes, trace events) waiting for their gpu results
+        self.free_queries = []          # query ring, reused once read back
+        self.cpu_times = {}             # name -> last 'history' durations (ms)
+        self.gpu_times = {}
+        self.trace = deque(maxlen=history)  # chrome trace events of each frame
+        self.gpu_offset = None          # cpu clock - gpu clock (s)
+        self.result = np.zeros(1, dtype=np.int64)
+
+    def query(self):
+        """ timestamp query of the gpu at this point of the command stream """
+        if not self.free_queries:
+            self.free_queries.extend(int(query) for query in GL.glGenQueries(16))
+        query = self.free_queries.pop()
+        GL.glQueryCounter(query, GL.GL_TIMESTAMP)
+        return query
+
+    def gpu_time(self, query):
+        """ timestamp of a query in seconds, on the cpu clock """
+        GL.glGetQueryObjecti64v(query, GL.GL_QUERY_RESULT, self.result)
+        return self.result[0] * 1e-9 + self.gpu_offset
+
+    @contextmanager
+    def scope(self, name):
+        """ measures the enclosed stage """
+        if not self.enabled:
+            yield
+            return
+        start_query = self.query() if self.gpu else None
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            end = perf_counter()
+            end_query = self.query() if self.gpu else None
+            self.scopes.append((name, start, end, start_query, end_query))
+
+    def begin_frame(self):
+        """ closes the last frame's scopes & collects the gpu results that arrived """
+        if not self.enabled:
+            return
+        if self.gpu and self.gpu_offset is None:  # both clocks read at the same time, once
+            GL.glGetInteger64v(GL.GL_TIMESTAMP, self.result)
+            self.gpu_offset = perf_counter() - self.result[0] * 1e-9
+        if self.frame >= 0:
+            events = []
+            for name, start, end, start_query, end_query in self.scopes:
+                self.record(self.cpu_times, name, end - start)
+                events.append(self.event(name, 'cpu', start, end))
+            self.trace.append(events)
+            if self.gpu and self.scopes:
+                self.pending.append((self.frame, self.scopes, events))
+        self.scopes = []
+        self.frame += 1
+        self.collect()
+
+    def collect(self, wait=False):
+        """
+        reads the queries of the old enough frames, stops at the first one not available yet.
+        wait: reads every pending frame, waiting for the gpu if needed
+        """
+        available = np.zeros(1, dtype=np.int32)
+        latency = 0 if wait else self.latency
+        while self.pending and self.pending[0][0] <= self.frame - latency:
+            frame, scopes, events = self.pending[0]
+            GL.glGetQueryObjectiv(scopes[-1][4], GL.GL_QUERY_RESULT_AVAILABLE, available)
+            if not available[0] and not wait:
+                break
+            self.pending.popleft()
+            for name, _, _, start_query, end_query in scopes:
+                start, end = self.gpu_time(start_query), self.gpu_time(end_query)
+                self.record(self.gpu_times, name, end - start)
+                events.append(self.event(name, 'gpu', start, end))
+                self.free_queries.extend((start_query, end_query))
+
+    def flush(self):
+        """ closes the current frame & reads all its gpu results (end of a benchmark) """
+        if self.enabled:
+            self.begin_frame()
+            self.collect(wait=True)
+
+    def record(self, times, name, duration):
+        times.setdefault(name, deque(maxlen=self.history)).append(duration * 1000.0)
+
+    def event(self, name, category, start, end):
+        """ complete event of the chrome trace format, times in microseconds """
+        return dict(name=name, cat=category, ph='X', pid=0, tid=0 if category == 'cpu' else 1,
+                    ts=(start - self.origin) * 1e6, dur=(end - start) * 1e6)
+
+    def stats(self):
+        """ {name: {'cpu': {mean, p50, p95, p99}, 'gpu': {...}}} in ms over the last frames """
+        stats = {}
+        for kind, times in (('cpu', self.cpu_times), ('gpu', self.gpu_times)):
+            for name, durations in times.items():
+                durations = np.array(durations)
+                values = dict(mean=float(durations.mean()), count=len(durations))
+                values.update((f'p{p}', float(v)) for p, v in zip(self.PERCENTILES,
+                                                                   np.percentile(durations, self.PERCENTILES)))
+                stats.setdefault(name, {})[kind] = values
+        return stats
+
+    def report(self):
+        """ table of the stats in ms, one line per scope """
+        columns = [(kind, p) for kind in ('cpu', 'gpu') for p in self.PERCENTILES]
+        lines = [f"{'scope (ms)':<16}" + ''.join(f"{kind + ' p' + str(p):>10}" for kind, p in columns)]
+        for name, kinds in self.stats().items():
+            values = (kinds[kind][f'p{p}'] if kind in kinds else None for kind, p in columns)
+            lines.append(f"{name:<16}" + ''.join(f"{'-':>10}" if v is None else f"{v:>10.3f}" for v in values))
+        return '\n'.join(lines)
+
+    def export_trace(self, path):
+        """ writes the recorded frames as a chrome trace json file """
+        events = [dict(name='thread_name', ph='M', pid=0, tid=tid, args=dict(name=name))
+                  for tid, name in ((0, 'cpu'), (1, 'gpu'))]
+        for frame_events in self.trace:
+            events.extend(frame_events)
+        with open(path, 'w') as file:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), file)
+
+    def __del__(self):
+        queries = self.free_queries + [query for _, scopes, _ in self.pending
+                                       for scope in scopes for query in scope[3:]]
+        if self.gpu and queries:
+            GL.glDeleteQueries(len(queries), queries)
@@ -1,9 +1,40 @@
 import os
 import OpenGL.GL as GL
+import numpy as np
+
+from utils.gl_state import state
 
 # ------------ low level OpenGL object wrappers ----------------------------
+def shader_source(path, *snippets, **defines):
+    """
+    source of a shader file with '#define name value' lines, then the snippets (glsl declarations shared by
+    several shaders, e.g. FRAME_DATA), added after its #version line
+    """
+    version, _, body = open(path, 'r').read().partition('\n')
+    lines = ['#define %s %s' % (name, value) for name, value in defines.items()]
+    return '\n'.join([version] + lines + list(snippets) + [body])
+
+
+FRAME_BLOCK = "FrameData"
+FRAME_BLOCK_BINDING = 0
+INSTANCES_BINDING = 10  # ssbo of the instances' model matrices (DrawList in core.py), see INSTANCES
+
+
+def _snapshot(value):
+    """ comparable copy of a uniform value (scalar, sequence or numpy array) """
+    if isinstance(value, (int, float, np.number)):
+        return value
+    value = np.asarray(value)
+    return value.dtype.str, value.shape, value.tobytes()
+
+
 class Shader:
-    """ Helper class to create and automatically destroy shader program """
+    """
+    Helper class to create and automatically destroy shader program.
+    Uniforms are set through set_uniform(s): the locations come from the introspection done at creation & the last
+    uploaded values are kept, so that setting a uniform to the value it already has doesn't call OpenGL.
+    """
+    stats = dict(uploads=0, skipped=0)  # over all the programs, see reset_stats
     @staticmethod
     def _compile_shader(src, shader_type):
         src = open(src, 'r').read() if os.path.exists(src) else src
@@ -73,12 +104,17 @@ class Shader:
 
         # get location, size & type for uniform variables using GL introspection
         self.uniforms = {}
+        self.values = {}  # snapshot of the last value uploaded for each uniform
+        self.uploads = 0
+        self.skipped_uploads = 0
         self.debug = debug
         get_name = {int(k): str(k).split()[0] for k in self.GL_SETTERS.keys()}
         for var in range(GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_UNIFORMS)):
             name, size, type_ = GL.glGetActiveUniform(self.glid, var)
             name = name.decode().split('[')[0]   # remove array characterization
             args = [GL.glGetUniformLocation(self.glid, name), size]
+            if args[0] == -1:  # member of a uniform block, set through its buffer
+                continue
             # add transpose=True as argument for matrix types
             if type_ in {GL.GL_FLOAT_MAT2, GL.GL_FLOAT_MAT3, GL.GL_FLOAT_MAT4}:
                 args.append(True)
@@ -87,11 +123,43 @@ class Shader:
                 print(f'uniform {get_name[type_]} {name}: {call}{tuple(args)}')
             self.uniforms[name] = (self.GL_SETTERS[type_], args)
 
+        # camera & light come from the per-frame uniform buffer (see FrameUniforms)
+        block = GL.glGetUniformBlockIndex(self.glid, FRAME_BLOCK)
+        if block != GL.GL_INVALID_INDEX:
+            GL.glUniformBlockBinding(self.glid, block, FRAME_BLOCK_BINDING)
+
+    def set_uniform(self, name, value):
+        """ set a uniform variable if it is known to the shader (program must be bound) & its value changed """
+        uniform = self.uniforms.get(name)
+        if uniform is None:
+            return
+        snapshot = _snapshot(value)
+        if name in self.values and self.values[name] == snapshot:
+            self.skipped_uploads += 1
+            Shader.stats['skipped'] += 1
+            return
+        set_uniform, args = uniform
+        set_uniform(*args, value)
+        self.values[name] = snapshot
+        self.uploads += 1
+        Shader.stats['uploads'] += 1
+
     def set_uniforms(self, uniforms):
         """ set only uniform variables that are known to shader """
-        for name in uniforms.keys() & self.uniforms.keys():
-            set_uniform, args = self.uniforms[name]
-            set_uniform(*args, uniforms[name])
+        for name, value in uniforms.items():
+            self.set_uniform(name, value)
+
+    def location(self, name):
+        """ location of a uniform, -1 if unknown """
+        uniform = self.uniforms.get(name)
+        return uniform[1][0] if uniform else -1
+
+    @staticmethod
+    def reset_stats():
+        """ returns the uniforms uploads & skipped uploads of all the programs since the last call """
+        stats = dict(Shader.stats)
+        Shader.stats.update(uploads=0, skipped=0)
+        return stats
 
     def __del__(self):
         GL.glDeleteProgram(self.glid)  # object dies => destroy GL object
@@ -107,41 +175,100 @@ class Shader:
         GL.GL_INT_VEC3:   GL.glUniform3iv, GL.GL_INT_VEC4:     GL.glUniform4iv,
         GL.GL_SAMPLER_1D: GL.glUniform1iv, GL.GL_SAMPLER_2D:   GL.glUniform1iv,
         GL.GL_SAMPLER_3D: GL.glUniform1iv, GL.GL_SAMPLER_CUBE: GL.glUniform1iv,
+        GL.GL_SAMPLER_2D_ARRAY: GL.glUniform1iv, GL.GL_SAMPLER_BUFFER: GL.glUniform1iv,
         GL.GL_FLOAT_MAT2: GL.glUniformMatrix2fv,
         GL.GL_FLOAT_MAT3: GL.glUniformMatrix3fv,
         GL.GL_FLOAT_MAT4: GL.glUniformMatrix4fv,
-        GL.GL_IMAGE_2D: GL.glBindImageTexture,
+        GL.GL_IMAGE_2D: GL.glBindImageTexture, GL.GL_IMAGE_2D_ARRAY: GL.glBindImageTexture,
     }
 
+    # typed shortcuts, same cached path as set_uniforms
     def set_int(self, name, value):
-        loc = GL.glGetUniformLocation(self.glid, name)
-        if loc !=-1:
-            GL.glUniform1i(loc, value)
+        self.set_uniform(name, int(value))
 
     def set_float(self, name, value):
-        loc = GL.glGetUniformLocation(self.glid, name)
-        if loc !=-1:
-            GL.glUniform1f(loc, value)
+        self.set_uniform(name, float(value))
 
     def set_mat4(self, name, value):
-        loc = GL.glGetUniformLocation(self.glid, name)
-        if loc !=-1:
-            GL.glUniformMatrix4fv(loc, 1, GL.GL_TRUE, value)
+        self.set_uniform(name, value)
 
+    # image units are global state (not stored in the program), bound on the unit = location of the uniform
     def set_image2d_read(self, name, image):
-        loc = GL.glGetUniformLocation(self.glid, name)
+        loc = self.location(name)
         if loc !=-1:
-            GL.glBindImageTexture(loc, image.glid, 0, GL.GL_FALSE, 0, GL.GL_READ_ONLY, image.preset.internal_format)
+            state.bind_image_texture(loc, image.glid, 0, GL.GL_FALSE, 0, GL.GL_READ_ONLY, image.preset.internal_format)
     
     def set_image2d_read_write(self, name, image):
-        loc = GL.glGetUniformLocation(self.glid, name)
+        loc = self.location(name)
         if loc !=-1:
-            GL.glBindImageTexture(loc, image.glid, 0, GL.GL_FALSE, 0, GL.GL_READ_WRITE, image.preset.internal_format)
+            state.bind_image_texture(loc, image.glid, 0, GL.GL_FALSE, 0, GL.GL_READ_WRITE, image.preset.internal_format)
 
     def set_image2d_write(self, name, image):
-        loc = GL.glGetUniformLocation(self.glid, name)
+        loc = self.location(name)
+        if loc !=-1:
+            state.bind_image_texture(loc, image.glid, 0, GL.GL_FALSE, 0, GL.GL_WRITE_ONLY, image.preset.internal_format)
+
+    def set_image2d_array_write(self, name, image):
+        """ binds all the layers of a texture array """
+        loc = self.location(name)
         if loc !=-1:
-            GL.glBindImageTexture(loc, image.glid, 0, GL.GL_FALSE, 0, GL.GL_WRITE_ONLY, image.preset.internal_format)
+            state.bind_image_texture(loc, image.glid, 0, GL.GL_TRUE, 0, GL.GL_WRITE_ONLY, image.preset.internal_format)
 
     def bind(self):
-        GL.glUseProgram(self.glid)
\ No newline at end of file
+        state.use_program(self.glid)
+
+
+# declaration of the FrameUniforms buffer, added to the shaders reading it by shader_source(path, FRAME_DATA)
+FRAME_DATA = """// per-frame data shared by all the programs, filled once per frame (FrameUniforms in utils/shaders.py)
+layout(std140) uniform %s {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+    vec3 light_pos;
+    vec3 camera_up;
+    vec3 camera_right;
+    mat4 inverse_view_projection;
+};""" % FRAME_BLOCK
+
+
+# model matrix of the meshes DrawList can instance, added to their vertex shaders by
+# shader_source(path, INSTANCES, INSTANCES_BINDING=INSTANCES_BINDING): they place their vertices with instance_model()
+INSTANCES = """uniform mat4 model;
+// per-instance model matrices of the instanced draws (DrawList in core.py), row-major as for the ocean tiles
+layout(std430, binding = INSTANCES_BINDING) readonly buffer Instances {
+    mat4 instance_matrix[];
+};
+uniform int instanced;       // 0 => one mesh placed by the model uniform
+uniform int instance_offset; // matrix of the first instance of the draw
+
+mat4 instance_model() {
+    return instanced != 0 ? transpose(instance_matrix[instance_offset + gl_InstanceID]) : model;
+}"""
+
+
+class FrameUniforms:
+    """
+    Camera & light data of the frame in a std140 uniform buffer, bound once to FRAME_BLOCK_BINDING:
+    every program declaring the FrameData block reads them from there, instead of receiving them at each draw.
+    """
+    def __init__(self):
+        # view (mat4), projection (mat4), w_camera_position, light_pos, camera_up, camera_right (vec3 padded to vec4),
+        # inverse_view_projection (mat4)
+        self.data = np.zeros(16 + 16 + 4*4 + 16, dtype=np.float32)
+        self.glid = GL.glGenBuffers(1)
+        state.bind_buffer(GL.GL_UNIFORM_BUFFER, self.glid)
+        GL.glBufferData(GL.GL_UNIFORM_BUFFER, self.data.nbytes, self.data, GL.GL_DYNAMIC_DRAW)
+        state.bind_buffer_base(GL.GL_UNIFORM_BUFFER, FRAME_BLOCK_BINDING, self.glid)
+
+    def update(self, frame, light_pos):
+        """ uploads the data of the FrameContext 'frame', only if it changed since the last frame """
+        data = np.zeros_like(self.data)
+        data[0:16] = np.asarray(frame.view, dtype=np.float32).T.ravel()  # std140 matrices are column major
+        data[16:32] = np.asarray(frame.projection, dtype=np.float32).T.ravel()
+        for i, vector in enumerate((frame.camera_position, light_pos, frame.camera_up, frame.camera_right)):
+            data[32 + 4*i:35 + 4*i] = vector
+        data[48:64] = np.asarray(frame.inverse_view_projection, dtype=np.float32).T.ravel()
+        if not np.array_equal(data, self.data):
+            self.data = data
+            state.bind_buffer(GL.GL_UNIFORM_BUFFER, self.glid)
+            GL.glBufferSubData(GL.GL_UNIFORM_BUFFER, 0, self.data.nbytes, self.data)
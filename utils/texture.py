@@ -2,6 +2,8 @@ import OpenGL.GL as GL              # standard Python OpenGL wrapper
 from PIL import Image               # load texture maps
 import OpenGL.version as glversion
 
+from utils.gl_state import state
+
 
 class TexturePreset:
     def __init__(self, wrap_s, wrap_t, mag_filter, min_filter, internal_format, format):
@@ -18,15 +20,15 @@ class Texture:
     """ Helper class to create and automatically destroy textures """
 
     def __del__(self):  # delete GL texture from GPU when object dies
-        GL.glDeleteTextures(self.glid)
+        state.delete_textures([self.glid])
 
-    def __init__(self, dimensions=(0.0, 0.0), wrap_s=GL.GL_REPEAT, wrap_t=GL.GL_REPEAT, mag_filter=GL.GL_NEAREST, min_filter=GL.GL_NEAREST, internal_format=GL.GL_RGBA32F, format=GL.GL_RGBA, data=None, is_vec=False, path_img=None, cubemap_faces=None, is_fbo=False):
+    def __init__(self, dimensions=(0.0, 0.0), wrap_s=GL.GL_REPEAT, wrap_t=GL.GL_REPEAT, mag_filter=GL.GL_NEAREST, min_filter=GL.GL_NEAREST, internal_format=GL.GL_RGBA32F, format=GL.GL_RGBA, data=None, is_vec=False, path_img=None, cubemap_faces=None, is_fbo=False, depth=None, layered=False):
 
         self.glid = GL.glGenTextures(1)
 
         if cubemap_faces:
             self.type = GL.GL_TEXTURE_CUBE_MAP
-            GL.glBindTexture(self.type, self.glid)
+            state.edit_texture(self.type, self.glid)
             # texture parameters are the same for each face
             GL.glTexParameteri(
                 self.type, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
@@ -46,7 +48,7 @@ class Texture:
                 face_img = Image.open(face_path).convert('RGBA')
                 GL.glTexImage2D(GL.GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, 0, GL.GL_RGBA, face_img.width,
                                 face_img.height, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, face_img.tobytes())
-            GL.glBindTexture(GL.GL_TEXTURE_CUBE_MAP, 0)
+            state.edit_texture(GL.GL_TEXTURE_CUBE_MAP, 0)
             return
 
         self.type = GL.GL_TEXTURE_2D
@@ -54,10 +56,29 @@ class Texture:
             dimensions[1]))  # dimensions = width, height
         self.preset = TexturePreset(wrap_s=wrap_s, wrap_t=wrap_t, mag_filter=mag_filter,
                                     min_filter=min_filter, internal_format=internal_format, format=format)
+
+        if depth:
+            # 3D texture (e.g. a stack of frames), repeating along the 3rd dimension too,
+            # or with layered=True an array of 'depth' 2D textures (e.g. one per tile)
+            self.type = GL.GL_TEXTURE_2D_ARRAY if layered else GL.GL_TEXTURE_3D
+            self.depth = int(depth)
+            state.edit_texture(self.type, self.glid)
+            GL.glTexParameteri(self.type, GL.GL_TEXTURE_WRAP_S, wrap_s)
+            GL.glTexParameteri(self.type, GL.GL_TEXTURE_WRAP_T, wrap_t)
+            if not layered:
+                GL.glTexParameteri(self.type, GL.GL_TEXTURE_WRAP_R, GL.GL_REPEAT)
+            GL.glTexParameteri(self.type, GL.GL_TEXTURE_MIN_FILTER, min_filter)
+            GL.glTexParameteri(self.type, GL.GL_TEXTURE_MAG_FILTER, mag_filter)
+            GL.glTexStorage3D(self.type, 1, internal_format, self.dimensions[0], self.dimensions[1], self.depth)
+            if data is not None:
+                GL.glTexSubImage3D(self.type, 0, 0, 0, 0, self.dimensions[0], self.dimensions[1], self.depth,
+                                   format, GL.GL_FLOAT, data)
+            state.edit_texture(self.type, 0)
+            return
         if path_img:
             # imports image as a numpy array in exactly right format
             tex = Image.open(path_img).convert('RGBA')
-            GL.glBindTexture(self.type, self.glid)
+            state.edit_texture(self.type, self.glid)
             GL.glTexParameteri(self.type, GL.GL_TEXTURE_WRAP_S, wrap_s)
             GL.glTexParameteri(self.type, GL.GL_TEXTURE_WRAP_T, wrap_t)
             GL.glTexParameteri(self.type, GL.GL_TEXTURE_MIN_FILTER, min_filter)
@@ -70,7 +91,7 @@ class Texture:
             #       f' mag={str(mag_filter).split()[0]})')
         else:
             # binding the texture
-            GL.glBindTexture(GL.GL_TEXTURE_2D, self.glid)
+            state.edit_texture(GL.GL_TEXTURE_2D, self.glid)
             GL.glTexParameteri(
                 GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, self.preset.wrap_t)
             GL.glTexParameteri(
@@ -88,11 +109,11 @@ class Texture:
             else:
                 GL.glTexStorage2D(
                     GL.GL_TEXTURE_2D, 1, self.preset.internal_format, dimensions[0], dimensions[1])
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        state.edit_texture(GL.GL_TEXTURE_2D, 0)
 
     def update_dimensions(self, new_dimensions):
         self.dimensions = new_dimensions
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.glid)
+        state.edit_texture(GL.GL_TEXTURE_2D, self.glid)
         GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, self.preset.internal_format,
                                 self.dimensions[0], self.dimensions[1], 0, self.preset.format, GL.GL_FLOAT, None)
 
@@ -103,10 +124,11 @@ class Textured:
     def __init__(self, drawable, **textures):
         self.drawable = drawable
         self.textures = textures
+        self.instanceable = getattr(drawable, 'instanceable', False)
+        self.bounds = getattr(drawable, 'bounds', None)
 
     def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
         for index, (name, texture) in enumerate(self.textures.items()):
-            GL.glActiveTexture(GL.GL_TEXTURE0 + index)
-            GL.glBindTexture(texture.type, texture.glid)
+            state.bind_texture(index, texture.type, texture.glid)
             uniforms[name] = index
         self.drawable.draw(primitives=primitives, **uniforms)
@@ -18,12 +18,12 @@ def vec(*iterable):
     return np.asarray(iterable if len(iterable) > 1 else iterable[0], 'f')
 
 def length_sq(vector):
-    return sum(vector*vector)
+    return np.dot(vector, vector)
 
 
 def normalized(vector):
     """ normalized version of any vector, with zero division check """
-    norm = math.sqrt(sum(vector*vector))
+    norm = math.sqrt(np.dot(vector, vector))
     return vector / norm if norm > 0. else vector
 
 
@@ -85,7 +85,7 @@ def scale(x, y=None, z=None):
     """scale matrix, with uniform (x alone) or per-dimension (x,y,z) factors"""
     x, y, z = (x, y, z) if isinstance(x, Number) else (x[0], x[1], x[2])
     y, z = (x, x) if y is None or z is None else (y, z)  # uniform scaling
-    return np.diag((x, y, z, 1))
+    return np.diag(np.array((x, y, z, 1), 'f'))
 
 
 def sincos(degrees=0.0, radians=None):
@@ -112,9 +112,9 @@ def lookat(eye, target, up):
     up = normalized(vec(up)[:3])
     right = np.cross(view, up)
     up = np.cross(right, view)
-    rotation = np.identity(4)
+    rotation = np.identity(4)  # float64 product, the camera is far from the origin
     rotation[:3, :3] = np.vstack([right, up, -view])
-    return rotation @ translate(-eye)
+    return (rotation @ translate(-eye)).astype('f')
 
 
 # quaternion functions -------------------------------------------------------
@@ -174,6 +174,131 @@ def quaternion_slerp(q0, q1, fraction):
     q2 = normalized(q1 - q0*dot)              # {q0, q2} now orthonormal basis
 
     return q0*math.cos(theta) + q2*math.sin(theta)
-        
 
 
+# batched versions, on (n, ...) arrays ---------------------------------------
+# same results as the functions above for each row, without python loops. The matrices are float32 (n, 4, 4),
+# written in 'out' when a preallocated float32 array of that shape is given (no allocation of the result).
+def _matrices(count, out=None):
+    """ float32 (count, 4, 4) identity matrices, reusing out if given """
+    out = np.empty((count, 4, 4), dtype=np.float32) if out is None else out
+    out[:] = np.identity(4, 'f')
+    return out
+
+
+def normalized_batch(vectors):
+    """ rows of vectors (n, d) normalized, null ones unchanged """
+    norm = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norm > 0, norm, 1)
+
+
+def translate_batch(translations, out=None):
+    """ translate matrices of the rows of translations (n, 3) """
+    translations = np.reshape(translations, (-1, 3))
+    out = _matrices(len(translations), out)
+    out[:, :3, 3] = translations
+    return out
+
+
+def scale_batch(scales, out=None):
+    """ scale matrices of uniform (n,) or per-dimension (n, 3) factors """
+    scales = np.asarray(scales)
+    scales = np.broadcast_to(scales[:, None] if scales.ndim == 1 else scales, (len(scales), 3))
+    out = _matrices(len(scales), out)
+    out[:, (0, 1, 2), (0, 1, 2)] = scales
+    return out
+
+
+def rotate_batch(axes=(1., 0., 0.), angles=0.0, radians=None, out=None):
+    """ rotation matrices around the axes (n, 3) or a single axis by 'angles' (n,) degrees or 'radians' (n,) """
+    angles = np.radians(angles) if radians is None else radians
+    axes, angles = np.broadcast_arrays(np.reshape(axes, (-1, 3)), np.reshape(angles, (-1, 1)))
+    x, y, z = normalized_batch(axes).T
+    s, c = np.sin(angles[:, 0]), np.cos(angles[:, 0])
+    nc = 1 - c
+    out = _matrices(len(angles), out)
+    out[:, 0, 0], out[:, 0, 1], out[:, 0, 2] = x*x*nc + c, x*y*nc - z*s, x*z*nc + y*s
+    out[:, 1, 0], out[:, 1, 1], out[:, 1, 2] = y*x*nc + z*s, y*y*nc + c, y*z*nc - x*s
+    out[:, 2, 0], out[:, 2, 1], out[:, 2, 2] = x*z*nc - y*s, y*z*nc + x*s, z*z*nc + c
+    return out
+
+
+def lookat_batch(eyes, targets, ups, out=None):
+    """ view matrices of lookat for rows of eyes, targets & ups (n, 3), single vectors are broadcast """
+    eyes, targets, ups = np.broadcast_arrays(*(np.reshape(v, (-1, 3)) for v in (eyes, targets, ups)))
+    view = normalized_batch(targets - eyes)
+    up = normalized_batch(ups)
+    right = np.cross(view, up)
+    up = np.cross(right, view)
+    out = _matrices(len(eyes), out)
+    out[:, 0, :3], out[:, 1, :3], out[:, 2, :3] = right, up, -view
+    out[:, :3, 3] = -np.einsum('nij,nj->ni', out[:, :3, :3], eyes)
+    return out
+
+
+def quaternion_slerp_batch(q0, q1, fraction, out=None):
+    """ quaternion_slerp of the rows of q0 & q1 (n, 4) by the fractions (n,), in out (n, 4) if given """
+    q0 = normalized_batch(q0)
+    q1 = normalized_batch(q1)
+    dot = (q0 * q1).sum(axis=-1, keepdims=True)
+    q1, dot = np.where(dot > 0, q1, -q1), np.abs(dot)   # shorter path
+
+    theta = np.arccos(np.clip(dot, -1, 1)) * np.reshape(fraction, (-1, 1))
+    q2 = normalized_batch(q1 - q0*dot)
+    return np.add(q0*np.cos(theta), q2*np.sin(theta), out=out)
+
+
+def quaternion_matrix_batch(q, out=None):
+    """ (n, 4, 4) rotation matrices of the quaternions (n, 4) """
+    q = normalized_batch(q)
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    matrices = _matrices(len(q), out)
+    matrices[:, 0, 0], matrices[:, 0, 1], matrices[:, 0, 2] = 1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y)
+    matrices[:, 1, 0], matrices[:, 1, 1], matrices[:, 1, 2] = 2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x)
+    matrices[:, 2, 0], matrices[:, 2, 1], matrices[:, 2, 2] = 2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y)
+    return matrices
+
+
+def trs_batch(translations, quaternions, scales, out=None):
+    """ translate @ quaternion_matrix @ scale for rows of translations (n, 3), quaternions (n, 4) & scales (n, 3) """
+    matrices = quaternion_matrix_batch(quaternions, out)
+    matrices[:, :3, :3] *= scales[:, None, :]
+    matrices[:, :3, 3] = translations
+    return matrices
+
+
+# Bounding boxes & view frustum culling --------------------------------------
+UNBOUNDED = np.array(((-1e30,)*3, (1e30,)*3))  # box of objects that are never culled
+
+
+def bounding_box(points):
+    """ axis aligned box of 3D points, as a (2, 3) array (min corner, max corner) """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    return np.array((points.min(axis=0), points.max(axis=0)))
+
+
+def transform_box(matrix, box):
+    """ axis aligned boxes containing the boxes (..., 2, 3) transformed by the 4x4 matrices (..., 4, 4) """
+    box, matrix = np.asarray(box, dtype=np.float64), np.asarray(matrix, dtype=np.float64)
+    center, half = (box[..., 1, :] + box[..., 0, :]) / 2, (box[..., 1, :] - box[..., 0, :]) / 2
+    rotation = matrix[..., :3, :3]
+    center = np.einsum('...ij,...j->...i', rotation, center) + matrix[..., :3, 3]
+    half = np.einsum('...ij,...j->...i', np.abs(rotation), half)
+    return np.stack((center - half, center + half), axis=-2)
+
+
+def frustum_planes(matrix):
+    """ the 6 planes (a, b, c, d) of the frustum of a projection @ view matrix, normals pointing inside """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    planes = np.array((matrix[3] + matrix[0], matrix[3] - matrix[0],    # left, right
+                       matrix[3] + matrix[1], matrix[3] - matrix[1],    # bottom, top
+                       matrix[3] + matrix[2], matrix[3] - matrix[2]))   # near, far
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+
+def boxes_in_frustum(planes, boxes):
+    """ mask of the boxes (n, 2, 3) that are not entirely behind one of the planes (conservative) """
+    normals = planes[:, :3]
+    # for each box & plane, the corner the farthest along the plane's normal
+    corners = np.where(normals > 0, boxes[:, None, 1, :], boxes[:, None, 0, :])
+    return ((corners * normals).sum(axis=-1) + planes[:, 3] >= 0).all(axis=1)
@@ -8,8 +8,6 @@ in VS_OUTPUT {
 uniform sampler2D diffuse_map;
 out vec4 out_color;
 
-uniform vec3 w_camera_position;
-
 
 
 void main() {
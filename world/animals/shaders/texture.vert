@@ -1,20 +1,33 @@
-#version 330 core
+#version 430 core
 
-uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
 in vec2 tex_coord;
 in vec3 position;
 
+// linear blend skinning (Skinned in utils/animation.py): 4 bones per vertex, palette in a buffer texture
+in vec4 bone_ids;
+in vec4 bone_weights;
+layout(binding = 4) uniform samplerBuffer bone_palette; // 4 texels (the rows) per bone matrix
+uniform int skinned;                // 0 => rigid mesh
+
 out vec2 frag_tex_coords;
 
 out VS_OUTPUT {
     vec3 position;
 } OUT;
 
+mat4 bone_matrix(float bone) {
+    int row = 4 * int(bone);
+    return transpose(mat4(texelFetch(bone_palette, row), texelFetch(bone_palette, row + 1),
+                          texelFetch(bone_palette, row + 2), texelFetch(bone_palette, row + 3)));
+}
 
 void main() {
-    OUT.position = (model * vec4(position, 1)).xyz;
-    gl_Position = projection * view * model * vec4(position, 1);
+    mat4 M = instance_model();
+    if (skinned != 0) { // the palette already holds world transforms
+        M = bone_weights.x * bone_matrix(bone_ids.x) + bone_weights.y * bone_matrix(bone_ids.y)
+          + bone_weights.z * bone_matrix(bone_ids.z) + bone_weights.w * bone_matrix(bone_ids.w);
+    }
+    OUT.position = (M * vec4(position, 1)).xyz;
+    gl_Position = projection * view * M * vec4(position, 1);
     frag_tex_coords = tex_coord;
 }
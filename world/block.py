@@ -8,7 +8,8 @@ class Chunk:
     """
     Chunk class. Each chunk contains a terrain grid and an ocean grid.
     """
-    def __init__(self, size, size_factor, N):
+    def __init__(self, size, size_factor, N, fft_backend="gpu", fft_size=256, ocean_cascades=None, ocean_baked_frames=0,
+                 ocean_gpu_spectrum=False):
         twoN = 2*N
         number_grids = twoN * twoN
         self.model_matrices_terrain = np.zeros((number_grids, 4, 4), dtype=np.float32)
@@ -22,11 +23,14 @@ class Chunk:
 
 
         self.terrain_mesh = Terrain(size=size, size_factor=size_factor, model_matrices=self.model_matrices_terrain, N=N)
-        self.ocean_mesh = Ocean(size, size_factor=size_factor+4,model_matrices=self.model_matrices_ocean, number_grids=number_grids)
+        self.ocean_mesh = Ocean(size, size_factor=size_factor+4,model_matrices=self.model_matrices_ocean, number_grids=number_grids,
+                                fft_backend=fft_backend, fft_size=fft_size, cascades=ocean_cascades,
+                                baked_frames=ocean_baked_frames, gpu_spectrum=ocean_gpu_spectrum)
+        self.ocean_mesh.hide_covered_tiles(self.terrain_mesh)
 
     def update(self, t):
         self.ocean_mesh.update(t)
     
-    def draw(self, primitives=GL.GL_TRIANGLES, skybox=None, **uniforms):
-        self.ocean_mesh.draw(primitives=primitives, skybox=skybox,**uniforms)
-        self.terrain_mesh.draw(primitives=primitives, skybox=skybox, **uniforms)
+    def draw(self, camera_position, primitives=GL.GL_TRIANGLES, skybox=None, frustum=None, **uniforms):
+        self.ocean_mesh.draw(camera_position, primitives=primitives, skybox=skybox,**uniforms)
+        self.terrain_mesh.draw(primitives=primitives, skybox=skybox, frustum=frustum, **uniforms)
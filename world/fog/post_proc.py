@@ -1,17 +1,18 @@
 import OpenGL.GL as GL
 from utils.primitives import Quad
-from utils.shaders import Shader
+from utils.shaders import Shader, FRAME_DATA, shader_source
 from utils.texture import Texture
+from utils.gl_state import state
 
 class FBO:
     def __init__(self):
         self.glid = GL.glGenFramebuffers(1)
     
     def bind(self):
-        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.glid)
+        state.bind_framebuffer(self.glid)
 
     def unbind(self):
-        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+        state.bind_framebuffer(0)
     
 
 
@@ -21,7 +22,8 @@ class PostProcessing:
     to display fog to the screen so...
     """
     def __init__(self, win_size):
-        self.shader = Shader(vertex_source="world/fog/shaders/fog.vert", fragment_source="world/fog/shaders/fog.frag")
+        self.shader = Shader(vertex_source="world/fog/shaders/fog.vert",
+                             fragment_source=shader_source("world/fog/shaders/fog.frag", FRAME_DATA))
         self.quad = Quad(self.shader)
         self.fbo = FBO()
 
@@ -45,17 +47,15 @@ class PostProcessing:
             self.color_text.update_dimensions(win_size)
             self.depth_text.update_dimensions(win_size)
 
-        GL.glDisable(GL.GL_DEPTH_TEST)
+        state.disable(GL.GL_DEPTH_TEST)
 
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(self.color_text.type, self.color_text.glid)
-        GL.glActiveTexture(GL.GL_TEXTURE1)
-        GL.glBindTexture(self.depth_text.type, self.depth_text.glid)
+        state.bind_texture(0, self.color_text.type, self.color_text.glid)
+        state.bind_texture(1, self.depth_text.type, self.depth_text.glid)
         
         self.shader.bind()
         self.shader.set_int("color_text", 0)
         self.shader.set_int("depth_text", 1)
         self.quad.draw(**uniforms)
 
-        GL.glEnable(GL.GL_DEPTH_TEST)
+        state.enable(GL.GL_DEPTH_TEST)
 
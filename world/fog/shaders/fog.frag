@@ -5,9 +5,6 @@ in VS_OUTPUT {
 
 uniform sampler2D color_text;
 uniform sampler2D depth_text;
-uniform vec3 w_camera_position;
-uniform mat4 view;
-uniform mat4 proj;
 uniform int is_fog;
 
 
@@ -22,12 +19,9 @@ float linearize_depth(float depth) {
 vec3 depth_to_worldpos(float depth) {
     float z = depth * 2.0 - 1.0; // back to NDC as depth is btw 0.0 and 1.0
     vec4 clip_space_pos = vec4(IN.uv*2.0 -1.0, z, 1.0);
-    vec4 view_space_pos = inverse(proj) * clip_space_pos;
+    vec4 world_pos = inverse_view_projection * clip_space_pos; // inverted once per frame on the cpu
 
-    view_space_pos /= view_space_pos.w; // perspective division
-
-    vec4 world_pos = inverse(view) * view_space_pos;
-    return world_pos.xyz;
+    return world_pos.xyz / world_pos.w; // perspective division
 }
 
 float fog_from_height(vec3 pos, float linear_depth) {
@@ -1,53 +1,291 @@
-from utils.shaders import Shader
+from utils.shaders import Shader, FRAME_DATA, shader_source
 from utils.texture import Texture
+from utils.gl_state import state
+from utils.cache import cached_arrays, array_key
 from world.ocean.ocean_fft import FFT
+from world.ocean.ocean_fft_cpu import NumpyFFT, SEA_LEVEL
 from world.ocean.ocean_grid import OceanGrid
 from utils.primitives import Grid
 import OpenGL.GL as GL
 import numpy as np
+from math import pi, log2, sqrt
+
+MAX_CASCADES = 3  # same as ocean.vert
+LOD_LEVELS = 4
+SUBDIVISIONS = 8
+BLOCK = 8  # samples per side of the terrain blocks reduced at once by classify_tiles
+OCEAN_OFFSET = 100.0  # added to the height by blend_height in ocean.vert
+
+# classes of the sub-tiles regarding the terrain
+WATER, SHORE, LAND = 0, 1, 2
+
+
+def sparse_table(values, reduce):
+    """ table[jz, jx, z, x] = reduce of values[z:z + 2**jz, x:x + 2**jx] (clipped to the array), for any window in O(1) """
+    levels_z, levels_x = (int(n).bit_length() for n in values.shape)
+    table = np.empty((levels_z, levels_x) + values.shape, dtype=values.dtype)
+    table[0, 0] = values
+    for jz in range(levels_z):
+        if jz:
+            half = 1 << (jz - 1)
+            table[jz, 0] = table[jz - 1, 0]
+            reduce(table[jz, 0, :-half], table[jz - 1, 0, half:], out=table[jz, 0, :-half])
+        for jx in range(1, levels_x):
+            half = 1 << (jx - 1)
+            table[jz, jx] = table[jz, jx - 1]
+            reduce(table[jz, jx, :, :-half], table[jz, jx - 1, :, half:], out=table[jz, jx, :, :-half])
+    return table
+
+
+def classify_tiles(corners, tile_size, heights, origin, cell, land_height, water_height, margin=0.0, block=BLOCK):
+    """
+    Class of each tile (x, z corners, tile_size wide) regarding a terrain height field (heights[z, x] at origin + cell * (x, z)):
+    LAND if the terrain is above land_height on the whole tile grown by margin, WATER if it never reaches water_height.
+    The heights are reduced to their min & max per block x block samples, each tile then reads all the blocks its window
+    touches: a few samples more than the window, which can only turn LAND or WATER tiles into SHORE ones.
+    """
+    size_z, size_x = heights.shape
+    blocks_z, blocks_x = -(-size_z // block), -(-size_x // block)
+    padded = np.pad(heights, ((0, blocks_z*block - size_z), (0, blocks_x*block - size_x)), mode='edge')
+    padded = padded.reshape(blocks_z, block, blocks_x, block)
+    lowest = sparse_table(padded.min(axis=(1, 3)), np.minimum)
+    highest = sparse_table(padded.max(axis=(1, 3)), np.maximum)
+
+    # windows of the tiles in samples, then in blocks
+    size = np.array((size_x, size_z))
+    first = np.floor((corners - margin - origin) / cell).astype(int)
+    last = np.ceil((corners + tile_size + margin - origin) / cell).astype(int) + 1
+    inside = np.all((first >= 0) & (last <= size), axis=1)
+    empty = np.any(np.minimum(last, size) <= np.maximum(first, 0), axis=1)
+    start = np.clip(first, 0, size - 1) // block
+    stop = np.maximum(-(-np.clip(last, 1, size) // block), start + 1)
+
+    # each window is covered by the 4 power of two windows of its corners
+    levels = np.log2(stop - start).astype(int)
+    (x0, z0), (x1, z1), (jx, jz) = start.T, (stop - (1 << levels)).T, levels.T
+    low = np.minimum.reduce([lowest[jz, jx, z, x] for z in (z0, z1) for x in (x0, x1)])
+    high = np.maximum.reduce([highest[jz, jx, z, x] for z in (z0, z1) for x in (x0, x1)])
+
+    classes = np.full(len(corners), SHORE)
+    classes[inside & (low > land_height)] = LAND
+    classes[empty | (high < water_height)] = WATER
+    return classes
+
 
 class Ocean:
     """
     Creates a mesh grid (Ocean Grid object) for the ocean and updates it by running a compute shaders pipeline (doing an FFT) each frame.
     The textures generated by the FFT are then put (after being resized) on each mesh grid.
+    fft_backend="cpu" replaces the compute shaders by the numpy reference (NumpyFFT), e.g. on GPUs without compute shaders.
+    fft_size is the FFT resolution N and cascades a list of (patch length L, amplitude A) pairs, at most MAX_CASCADES:
+    the first one is mapped on each mesh grid, the smaller ones are blended on top of it in world space to hide the tiling.
+    With baked_frames > 0, the ocean loops every repeat_period seconds: the maps of the whole loop are computed once at
+    startup (and cached on disk by the cpu backend) and then only played back, no FFT is run while rendering.
+    Each tile is drawn with one of lod_levels grids, halving the resolution each time its distance to the camera
+    doubles (from lod_distance, 2 tiles by default); ocean.vert morphs the vertices between levels to avoid cracks.
+    The instances actually drawn are sub-tiles (subdivisions x subdivisions per tile), so that the ones under the terrain
+    can be skipped (see hide_covered_tiles).
+    gpu_spectrum builds the spectra with a compute shader (see OceanGrid), for cheap set_wind calls.
     """
-    def __init__(self, size, model_matrices, size_factor, number_grids):
+    def __init__(self, size, model_matrices, size_factor, number_grids, fft_backend="gpu", fft_size=256, cascades=None,
+                 baked_frames=0, repeat_period=32.0, lod_levels=LOD_LEVELS, lod_distance=None, subdivisions=SUBDIVISIONS,
+                 gpu_spectrum=False):
         self.size = size
-        self.ocean_grid = OceanGrid(size, 256)
-        self.fft = FFT()
-        self.grid = Grid(Shader(vertex_source="world/ocean/shaders/ocean.vert", fragment_source="world/ocean/shaders/ocean.frag"), size=size, size_factor=size_factor)
+        self.baked_frames = baked_frames
+        self.repeat_period = repeat_period if baked_frames else 0.0
+        cascades = sorted(cascades or [(size, 50.0)], reverse=True)  # largest patch first
+        assert len(cascades) <= MAX_CASCADES, 'at most %d ocean cascades' % MAX_CASCADES
+
+        # each cascade keeps the wavevectors between the nyquist frequencies of the larger patch & its own one
+        cutoffs = [0.0] + [pi * fft_size / L for L, _ in cascades[:-1]] + [float('inf')]
+        self.ocean_grids = [OceanGrid(int(L), fft_size, gpu_spectrum=gpu_spectrum, A=A, k_min=cutoffs[i], k_max=cutoffs[i+1],
+                                      repeat_period=self.repeat_period)
+                            for i, (L, A) in enumerate(cascades)]
+        self.ocean_grid = self.ocean_grids[0]
+
+        # world size covered by one texture of each cascade, the first one covers exactly one mesh grid
+        grid_extent = (size-1)*size_factor
+        self.patch_sizes = [grid_extent * L / cascades[0][0] for L, _ in cascades]
+        if fft_backend == "cpu":
+            self.ffts = [NumpyFFT.from_grid(grid, patch_size=patch, uv_offset=i == 0)
+                         for i, (grid, patch) in enumerate(zip(self.ocean_grids, self.patch_sizes))]
+        else:
+            self.ffts = [FFT(fft_size)] * len(cascades)  # same temporary textures for every cascade
+        self.fft = self.ffts[0]
+        self.query_ffts = None  # numpy backends answering height_at, built on the first query
+        defines = dict(BAKED=1) if baked_frames else dict()
+        shader = Shader(vertex_source=shader_source("world/ocean/shaders/ocean.vert", FRAME_DATA, **defines),
+                        fragment_source=shader_source("world/ocean/shaders/ocean.frag", FRAME_DATA, **defines))
+        self.subdivisions = subdivisions
+        self.subtile_size = grid_extent / subdivisions
+        self.init_lods(shader, grid_extent, lod_levels, lod_distance)
         self.t = 0.0
 
+        if baked_frames:
+            for fft, ocean_grid in zip(self.ffts, self.ocean_grids):
+                ocean_grid.bake(fft, baked_frames)
+            self.frame_coord = 0.0
+
         ssbo_loc = GL.glGetProgramResourceIndex(self.grid.shader.glid, GL.GL_SHADER_STORAGE_BLOCK, "model_matrices")
         GL.glShaderStorageBlockBinding(self.grid.shader.glid, ssbo_loc, 8)
         
         
         self.ssbo = GL.glGenBuffers(1)
-        GL.glBindBuffer(GL.GL_SHADER_STORAGE_BUFFER, self.ssbo)
-        self.model_matrices = model_matrices
-        # print(self.model_matrices)
+        state.bind_buffer_base(GL.GL_SHADER_STORAGE_BUFFER, 8, self.ssbo)
+
+        # splitting each tile in sub-tiles, offset inside their tile
+        steps = np.arange(subdivisions) * self.subtile_size
+        offsets = np.stack(np.meshgrid(steps, steps, indexing='ij'), axis=-1).reshape(-1, 2)
+        self.tiles_matrices = np.repeat(model_matrices[:number_grids], len(offsets), axis=0)
+        self.tiles_matrices[:, [0, 2], 3] += np.tile(offsets, (number_grids, 1))
+        self.tile_classes = np.full(len(self.tiles_matrices), WATER)
+        self.set_tiles(self.tiles_matrices)
+
+    def set_tiles(self, model_matrices):
+        """ (re)builds the ssbo of the sub-tiles to draw """
+        self.model_matrices = np.ascontiguousarray(model_matrices, dtype=np.float32)
+        self.tiles_order = np.arange(len(self.model_matrices))  # order of the tiles in the ssbo, sorted by lod level
+        state.bind_buffer(GL.GL_SHADER_STORAGE_BUFFER, self.ssbo)
         GL.glBufferData(GL.GL_SHADER_STORAGE_BUFFER, self.model_matrices.nbytes, self.model_matrices, GL.GL_STATIC_DRAW)
-        GL.glBindBufferBase(GL.GL_SHADER_STORAGE_BUFFER, 8, self.ssbo)
 
-        self.grid.vertex_array.arguments = (self.grid.vertex_array.index_buffer.size, GL.GL_UNSIGNED_INT, None, number_grids)
+    def wave_height(self, frames=8):
+        """ largest displacement of the waves (summed over the cascades), estimated with the numpy backend over a few frames """
+        height = 0.0
+        for ocean_grid in self.ocean_grids:
+            fft = NumpyFFT.from_grid(ocean_grid)
+            height += max(np.abs(fft.compute(t)[0][..., :3]).max() for t in np.linspace(0.0, 30.0, frames))
+        return height
+
+    def hide_covered_tiles(self, terrain, safety=1.25):
+        """
+        Classifies once the sub-tiles with the terrain height maps & removes the LAND ones (terrain above the highest
+        waves everywhere, even displaced horizontally) from the ssbo. The ocean flattening under the island is ignored,
+        which only keeps more tiles than needed. The classes are cached on disk with the terrain & spectra they depend on.
+        """
+        def classes(**_):
+            heights, origin, cell = terrain.height_field()
+            waves = self.wave_height() * safety
+            sea_level = SEA_LEVEL + OCEAN_OFFSET
+            return dict(classes=classify_tiles(self.tiles_matrices[:, [0, 2], 3], self.subtile_size, heights, origin, cell,
+                                               land_height=sea_level + waves, water_height=sea_level - waves, margin=waves))
+
+        spectra = tuple((grid.N, grid.L, grid.A, float(grid.wind_speed), tuple(float(w) for w in grid.wind_direction),
+                         grid.seed, float(grid.k_min), float(grid.k_max)) for grid in self.ocean_grids)
+        self.tile_classes = cached_arrays("ocean_tiles", classes, spectra=spectra, period=float(self.repeat_period),
+                                          safety=float(safety), block=BLOCK,
+                                          terrain=(terrain.size, float(terrain.scale_factor), array_key(terrain.tiles_matrices)),
+                                          tiles=(float(self.subtile_size), array_key(self.tiles_matrices)))["classes"]
+        self.set_tiles(self.tiles_matrices[self.tile_classes != LAND])
+
+    def init_lods(self, shader, grid_extent, lod_levels, lod_distance):
+        """
+        One grid of a sub-tile per level, power of two resolutions (over the whole tile) so that coarse vertices are fine ones.
+        The morphed (odd) vertices must have the same parity in the tile & in the sub-tile => even quads per sub-tile.
+        """
+        self.grid_extent = grid_extent
+        quads = 1 << int(round(log2(self.size - 1)))
+        self.lod_quads = [quads >> level for level in range(lod_levels)]
+        assert all(q % (2*self.subdivisions) == 0 for q in self.lod_quads[:-1]) and self.lod_quads[-1] % self.subdivisions == 0, \
+            'too many ocean lod levels or subdivisions'
+        self.lod_grids = [Grid(shader, size=q//self.subdivisions + 1, size_factor=grid_extent/q) for q in self.lod_quads]
+        self.grid = self.lod_grids[0]
+
+        # a tile at distance d (closest point, from the camera) gets the level l such that lod_distances[l-1] <= d < lod_distances[l].
+        # Distances of neighbour tiles differ by less than a tile diagonal, so doubling distances (> one diagonal apart)
+        # keep neighbours at most one level apart.
+        diagonal = sqrt(2) * self.subtile_size
+        lod_distance = lod_distance or 2 * grid_extent
+        assert lod_distance > diagonal, 'lod_distance must be larger than the diagonal of a sub-tile'
+        self.lod_distances = lod_distance * 2.0 ** np.arange(lod_levels - 1)
+
+        # vertices of a level are fully morphed into the next one where the next level starts, & not morphed at all
+        # where they can be shared with a tile of the previous level
+        self.morph_ranges = []
+        for level, end in enumerate(self.lod_distances):
+            start = self.lod_distances[level-1] + diagonal if level else 0.5 * end
+            self.morph_ranges.append((start, end))
+        self.morph_ranges.append((1e30, 2e30))  # coarsest level, never morphed
+
+    def select_lods(self, camera_position):
+        """ lod level of each tile, from the distance between the camera & the closest point of the tile (at sea level) """
+        corners = self.model_matrices[:, [0, 2], 3]  # translations (x, z) of the tiles
+        camera = np.asarray(camera_position, dtype=np.float32)
+        delta = np.maximum(np.maximum(corners - camera[[0, 2]], camera[[0, 2]] - (corners + self.subtile_size)), 0.0)
+        distances = np.sqrt((delta*delta).sum(axis=1) + (camera[1] - SEA_LEVEL)**2)
+        return np.searchsorted(self.lod_distances, distances, side='right')
+
+    def update_lods(self, camera_position):
+        """ sorts the tiles of the ssbo by lod level (uploaded only when it changed), returns the (offset, count) of each level """
+        levels = self.select_lods(camera_position)
+        order = np.argsort(levels, kind='stable')
+        if not np.array_equal(order, self.tiles_order):
+            self.tiles_order = order
+            state.bind_buffer(GL.GL_SHADER_STORAGE_BUFFER, self.ssbo)
+            GL.glBufferSubData(GL.GL_SHADER_STORAGE_BUFFER, 0, self.model_matrices.nbytes,
+                               np.ascontiguousarray(self.model_matrices[order]))
+        counts = np.bincount(levels, minlength=len(self.lod_grids))
+        return list(zip(np.cumsum(counts) - counts, counts))
 
     def update(self, t):
         self.t = t
-        self.fft.update(t, self.ocean_grid)
+        if self.baked_frames:  # playback only, the 3D textures interpolate between the frames
+            self.frame_coord = (t % self.repeat_period) / self.repeat_period + 0.5 / self.baked_frames
+            return
+        for fft, ocean_grid in zip(self.ffts, self.ocean_grids):
+            fft.update(t, ocean_grid)
 
-    def draw(self, primitives=GL.GL_TRIANGLES, skybox=None, **uniforms):
+    def height_at(self, x, z, t):
+        """ height of the ocean at world positions (x, z), summed over the cascades, whatever the fft backend """
+        if self.query_ffts is None:  # the cpu backend can answer itself, the gpu one needs a numpy copy
+            self.query_ffts = [fft if isinstance(fft, NumpyFFT) else NumpyFFT.from_grid(grid, patch_size=patch, uv_offset=i == 0)
+                               for i, (fft, grid, patch) in enumerate(zip(self.ffts, self.ocean_grids, self.patch_sizes))]
+        for fft, grid in zip(self.query_ffts, self.ocean_grids):
+            fft.follow_wind(grid)
+        heights = [fft.height_at(x, z, t) for fft in self.query_ffts]
+        return sum(heights) - (len(heights)-1) * SEA_LEVEL
 
-        # binding updated textures 
-        self.grid.shader.bind()
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(self.ocean_grid.displacement_text.type, self.ocean_grid.displacement_text.glid)
+    def set_wind(self, wind_speed=None, wind_direction=None):
+        """ new wind for every cascade, the numpy backends take it at their next update / height_at """
+        for ocean_grid in self.ocean_grids:
+            ocean_grid.set_wind(wind_speed, wind_direction)
 
-        GL.glActiveTexture(GL.GL_TEXTURE1)
-        GL.glBindTexture(self.ocean_grid.gradients_text.type, self.ocean_grid.gradients_text.glid)
+    def maps(self, ocean_grid):
+        """ textures sampled by ocean.vert for a cascade """
+        if self.baked_frames:
+            return ocean_grid.displacement_frames, ocean_grid.gradients_frames
+        return ocean_grid.displacement_text, ocean_grid.gradients_text
 
-        GL.glActiveTexture(GL.GL_TEXTURE2)
-        GL.glBindTexture(skybox.type, skybox.glid)
+    def draw(self, camera_position, primitives=GL.GL_TRIANGLES, skybox=None, **uniforms):
+        """ camera_position (world space) picks the lod level of each tile """
+
+        # binding updated textures 
+        self.grid.shader.bind()
+        displacement, gradients = self.maps(self.ocean_grid)
+        state.bind_texture(0, displacement.type, displacement.glid)
+        state.bind_texture(1, gradients.type, gradients.glid)
+        state.bind_texture(2, skybox.type, skybox.glid)
         self.grid.shader.set_int("displacement", 0)
         self.grid.shader.set_int("gradients", 1)
         self.grid.shader.set_int("skybox", 2)
-        self.grid.draw(primitives=primitives, wind_speed=self.ocean_grid.wind_speed, t = self.t, wind_dir=self.ocean_grid.wind_direction, draw_command=GL.glDrawElementsInstanced,**uniforms)
\ No newline at end of file
+
+        # extra cascades on the next texture units
+        for i, ocean_grid in enumerate(self.ocean_grids[1:], start=1):
+            displacement, gradients = self.maps(ocean_grid)
+            state.bind_texture(1 + 2*i, displacement.type, displacement.glid)
+            state.bind_texture(2 + 2*i, gradients.type, gradients.glid)
+            self.grid.shader.set_int("displacement_%d" % i, 1 + 2*i)
+            self.grid.shader.set_int("gradients_%d" % i, 2 + 2*i)
+        uv_scales = [1.0 / patch for patch in self.patch_sizes] + [0.0] * (MAX_CASCADES - len(self.patch_sizes))
+        uniforms.update(cascade_count=len(self.ocean_grids), cascade_uv_scales=uv_scales)
+        if self.baked_frames:
+            uniforms.update(frame_coord=self.frame_coord)
+
+        lods = self.update_lods(camera_position)
+        for level, (grid, (offset, count)) in enumerate(zip(self.lod_grids, lods)):
+            if count == 0:
+                continue
+            grid.vertex_array.arguments = (grid.vertex_array.index_buffer.size, GL.GL_UNSIGNED_INT, None, int(count))
+            grid.draw(primitives=primitives, wind_speed=self.ocean_grid.wind_speed, t = self.t, wind_dir=self.ocean_grid.wind_direction,
+                      instance_offset=int(offset), lod_quads=float(self.lod_quads[level]), lod_cell=self.grid_extent/self.lod_quads[level],
+                      morph_range=self.morph_ranges[level], tile_subdivisions=float(self.subdivisions),
+                      subtile_size=self.subtile_size, draw_command=GL.glDrawElementsInstanced, **uniforms)
\ No newline at end of file
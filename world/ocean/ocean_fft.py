@@ -1,91 +1,97 @@
-from utils.shaders import Shader
+from utils.shaders import Shader, shader_source
 from utils.texture import Texture
 import OpenGL.GL as GL
-from enum import Enum
+from math import log2, pi
+import numpy as np
+
+
+def twiddle_factors(N):
+    """
+    (log2(N), N, 4) array read by the butterfly shader: for each stage & index x,
+    the twiddle factor W_N^k (real, imaginary) and the indices of the two inputs of the butterfly.
+    """
+    x = np.arange(N)
+    stages = []
+    for s in range(1, int(log2(N)) + 1):
+        m = 1 << s              # butterfly group height
+        mh = m >> 1             # butterfly group half height
+        k = x * (N // m)
+        i = x & ~(m - 1)        # butterfly group starting offset
+        j = x & (mh - 1)        # butterfly index in group
+        theta = 2 * pi * k / N
+        stages.append(np.stack((np.cos(theta), -np.sin(theta), i + j, i + j + mh), axis=1))
+    return np.array(stages, dtype=np.float32)
 
-class Step(Enum):
-    HEIGHT_FIELD = 1
-    CHOPPY_FIELD = 2
 
 # set of textures used to run the algorithm of FFT on gpu
 class TexturesFFT:
     def __init__(self, N):
-        self.tilde_hkt = Texture((N, N), GL.GL_REPEAT, GL.GL_REPEAT, GL.GL_LINEAR, GL.GL_LINEAR, GL.GL_RG32F, GL.GL_RG, is_vec=False)
-        self.dt_dxdz = Texture((N, N), GL.GL_REPEAT, GL.GL_REPEAT, GL.GL_LINEAR, GL.GL_LINEAR, GL.GL_RG32F, GL.GL_RG, is_vec=False)
-        self.temp_text = Texture((N, N), GL.GL_REPEAT, GL.GL_REPEAT, GL.GL_LINEAR, GL.GL_LINEAR, GL.GL_RG32F, GL.GL_RG, is_vec=False)
+        # height (rg) & choppiness (ba) fields are transformed together
+        self.tilde_hkt = Texture((N, N), GL.GL_REPEAT, GL.GL_REPEAT, GL.GL_LINEAR, GL.GL_LINEAR, GL.GL_RGBA32F, GL.GL_RGBA, is_vec=False)
+        self.temp_text = Texture((N, N), GL.GL_REPEAT, GL.GL_REPEAT, GL.GL_LINEAR, GL.GL_LINEAR, GL.GL_RGBA32F, GL.GL_RGBA, is_vec=False)
+        self.twiddles = Texture((N, int(log2(N))), GL.GL_REPEAT, GL.GL_REPEAT, GL.GL_NEAREST, GL.GL_NEAREST, GL.GL_RGBA32F, GL.GL_RGBA,
+                                data=twiddle_factors(N), is_vec=True)
 
 
 class FFT:
     """
     Compute shaders pipeline that runs the FFT on the GPU.
+    N is the resolution of the FFT: one butterfly work group of N invocations handles one row.
+    Each frame costs 4 dispatches: h(k,t), 2 butterfly passes (the second one also does the inversion
+    and writes the displacement map) & the gradients.
     """
-    def __init__(self):
+    def __init__(self, N=256):
         repo = "world/ocean/shaders/cs/"
         format = ".comp.glsl"
+        self.N = N
         self.hk_cs = Shader(compute_source='{repo}fft_hkt{format}'.format(repo=repo, format=format))
-        self.butterfly_cs = Shader(compute_source='{repo}fft_butterfly{format}'.format(repo=repo, format=format))
-        self.inversion_cs = Shader(compute_source='{repo}fft_inversion{format}'.format(repo=repo, format=format))
+        # the butterfly work group size & shared memory depend on N => set at compile time
+        self.butterfly_cs = Shader(compute_source=shader_source('{repo}fft_butterfly{format}'.format(repo=repo, format=format),
+                                                                RES=N, LOG2_RES=int(log2(N))))
         self.gradient_cs = Shader(compute_source='{repo}fft_gradients{format}'.format(repo=repo, format=format))
-        self.temp_textures = TexturesFFT(256)
-
-    def fft_d(self, step, ocean_grid):
-        if step == Step.HEIGHT_FIELD:
-            self.butterfly_cs.bind()
-            self.butterfly_cs.set_uniforms(dict(log2_N=ocean_grid.log2_N, N=ocean_grid.N))
-            self.butterfly_cs.set_image2d_read("readbuff", self.temp_textures.tilde_hkt)
-            self.butterfly_cs.set_image2d_write("writebuff", self.temp_textures.temp_text)
-
-            GL.glDispatchCompute(ocean_grid.N, 1, 1)
-            GL.glMemoryBarrier(GL.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT);
-
-            self.butterfly_cs.set_image2d_read("readbuff", self.temp_textures.temp_text)
-            self.butterfly_cs.set_image2d_write("writebuff", self.temp_textures.tilde_hkt)
-
-            GL.glDispatchCompute(ocean_grid.N, 1, 1)
-            GL.glMemoryBarrier(GL.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT);
+        self.temp_textures = TexturesFFT(N)
+        self.dispatch_count = 0  # dispatches issued by the last update
 
-        elif step == Step.CHOPPY_FIELD:
-            self.butterfly_cs.bind()
-            self.butterfly_cs.set_uniforms(dict(log2_N=ocean_grid.log2_N, N=ocean_grid.N))
-            self.butterfly_cs.set_image2d_read("readbuff", self.temp_textures.dt_dxdz)
-            self.butterfly_cs.set_image2d_write("writebuff", self.temp_textures.temp_text)
-
-            GL.glDispatchCompute(ocean_grid.N, 1, 1)
-            GL.glMemoryBarrier(GL.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
-
-            self.butterfly_cs.set_image2d_read("readbuff", self.temp_textures.temp_text)
-            self.butterfly_cs.set_image2d_write("writebuff", self.temp_textures.dt_dxdz)
-
-            GL.glDispatchCompute(ocean_grid.N, 1, 1)
+    def dispatch(self, x, y, barriers=GL.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT):
+        GL.glDispatchCompute(x, y, 1)
+        GL.glMemoryBarrier(barriers)
+        self.dispatch_count += 1
 
     def update(self, t, ocean_grid):
-        
+        self.dispatch_count = 0
+        textures = self.temp_textures
+
         self.hk_cs.bind()
-        self.hk_cs.set_uniforms(dict(N=ocean_grid.N, L=ocean_grid.L, t=t))
-        self.hk_cs.set_image2d_write ("tilde_hkt_dy", self.temp_textures.tilde_hkt)
-        self.hk_cs.set_image2d_write("Dt_dx_dz", self.temp_textures.dt_dxdz)
+        self.hk_cs.set_uniforms(dict(N=ocean_grid.N, L=ocean_grid.L, t=t, repeat_period=ocean_grid.repeat_period))
+        self.hk_cs.set_image2d_write("tilde_hkt", textures.tilde_hkt)
         self.hk_cs.set_image2d_read("tilde_h0k", ocean_grid.h0_text)
+        self.dispatch(ocean_grid.N//16, ocean_grid.N//16)
 
-        GL.glDispatchCompute(ocean_grid.N//16, ocean_grid.N//16, 1)
-        GL.glMemoryBarrier(GL.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
+        # first pass along the columns, second pass along the rows + inversion
+        self.butterfly_cs.bind()
+        self.butterfly_cs.set_image2d_read("twiddles", textures.twiddles)
+        self.butterfly_cs.set_uniforms(dict(last_pass=0))
+        self.butterfly_cs.set_image2d_read("readbuff", textures.tilde_hkt)
+        self.butterfly_cs.set_image2d_write("writebuff", textures.temp_text)
+        self.dispatch(ocean_grid.N, 1)
 
-        self.fft_d(Step.HEIGHT_FIELD, ocean_grid=ocean_grid)
-        self.fft_d(Step.CHOPPY_FIELD, ocean_grid=ocean_grid)
-
-        self.inversion_cs.bind()
-        self.inversion_cs.set_uniforms(dict(N=ocean_grid.N))
-        self.inversion_cs.set_image2d_write("displacement", ocean_grid.displacement_text)
-        self.inversion_cs.set_image2d_read("height_field", self.temp_textures.tilde_hkt)
-        self.inversion_cs.set_image2d_read("choppy_field", self.temp_textures.dt_dxdz)
-
-        GL.glDispatchCompute(ocean_grid.N//16, ocean_grid.N//16, 1)
-        GL.glMemoryBarrier(GL.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
+        self.butterfly_cs.set_uniforms(dict(last_pass=1))
+        self.butterfly_cs.set_image2d_read("readbuff", textures.temp_text)
+        self.butterfly_cs.set_image2d_write("writebuff", ocean_grid.displacement_text)
+        self.dispatch(ocean_grid.N, 1)
 
         self.gradient_cs.bind()
         self.gradient_cs.set_uniforms(dict(N=ocean_grid.N, L=ocean_grid.L))
         self.gradient_cs.set_image2d_read("displacement", ocean_grid.displacement_text)
         self.gradient_cs.set_image2d_write("gradients", ocean_grid.gradients_text)
-
-        GL.glDispatchCompute(ocean_grid.N//16, ocean_grid.N//16, 1)
-        GL.glMemoryBarrier(GL.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
-
+        # both maps are then sampled by ocean.vert
+        self.dispatch(ocean_grid.N//16, ocean_grid.N//16, GL.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT | GL.GL_TEXTURE_FETCH_BARRIER_BIT)
+
+    def bake(self, ocean_grid):
+        """ runs the pipeline for each frame of the loop & copies the maps into the grid's frames textures """
+        frames = ocean_grid.displacement_frames.depth
+        for frame in range(frames):
+            self.update(frame * ocean_grid.repeat_period / frames, ocean_grid)
+            for src, dst in ((ocean_grid.displacement_text, ocean_grid.displacement_frames),
+                             (ocean_grid.gradients_text, ocean_grid.gradients_frames)):
+                GL.glCopyImageSubData(src.glid, src.type, 0, 0, 0, 0, dst.glid, dst.type, 0, 0, 0, frame, ocean_grid.N, ocean_grid.N, 1)
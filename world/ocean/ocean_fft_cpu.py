@@ -0,0 +1,223 @@
+from time import perf_counter
+import numpy as np
+import OpenGL.GL as GL
+
+from utils.cache import cached_memmap
+from utils.gl_state import state
+from world.ocean.ocean_grid import h0k_spectrum, TWO_PI
+
+SEA_LEVEL = 70.0  # vertical offset added to the displacement in ocean.vert
+
+# same constants as the last pass of fft_butterfly.comp.glsl
+CHOPPINESS = -120.0
+HEIGHT_FACTOR = 120.0
+REFERENCE_N = 256
+
+
+class NumpyFFT:
+    """
+    CPU reference of the FFT compute shaders pipeline (h(k,t), butterflies, inversion & gradients) built on numpy.fft.
+    It produces the same displacement and gradient arrays as FFT.update, so it can replace it on machines without
+    a GPU able to run compute shaders, and it can answer height queries for floating objects.
+    """
+    def __init__(self, N, L, h0, patch_size=None, repeat_period=0.0, uv_offset=True):
+        self.N = N
+        self.L = L
+        self.repeat_period = repeat_period
+        self.patch_size = patch_size if patch_size else L  # world size covered by one ocean texture
+        self.uv_offset = 1.0/N if uv_offset else 0.0  # ocean.vert shifts the uv of the first cascade only by a texel
+        self.set_spectrum(h0)
+        self.spectrum_version = 0  # OceanGrid.spectrum_version of h0
+
+        # (-1)^(x+y) / REFERENCE_N^2, undoing the frequency shift of the spectrum (same as fft_butterfly)
+        parity = np.add.outer(np.arange(N), np.arange(N)) & 1
+        self.sign_correction = np.where(parity == 1, -1.0, 1.0).astype(np.float32) / float(REFERENCE_N*REFERENCE_N)
+
+        self.displacement = np.zeros((N, N, 4), dtype=np.float32)
+        self.gradients = np.zeros((N, N, 4), dtype=np.float32)
+        self.heights_t = None  # time of the cached height field used by height_at
+        self.heights = None
+
+    @staticmethod
+    def from_grid(ocean_grid, patch_size=None, uv_offset=True):
+        fft = NumpyFFT(ocean_grid.N, ocean_grid.L, NumpyFFT.grid_spectrum(ocean_grid), patch_size,
+                       ocean_grid.repeat_period, uv_offset)
+        fft.spectrum_version = ocean_grid.spectrum_version
+        return fft
+
+    @staticmethod
+    def grid_spectrum(ocean_grid):
+        h0 = ocean_grid.h0
+        if h0 is None:  # spectrum built on the gpu => rebuild the same one with numpy
+            h0 = h0k_spectrum(ocean_grid.N, ocean_grid.L, ocean_grid.A, ocean_grid.wind_speed,
+                              tuple(ocean_grid.wind_direction), ocean_grid.seed, ocean_grid.k_min, ocean_grid.k_max)["h0"]
+        return h0
+
+    def follow_wind(self, ocean_grid):
+        """ takes the grid's new spectrum after an OceanGrid.set_wind """
+        if self.spectrum_version != ocean_grid.spectrum_version:
+            self.set_spectrum(NumpyFFT.grid_spectrum(ocean_grid))
+            self.spectrum_version = ocean_grid.spectrum_version
+
+    def set_spectrum(self, h0):
+        """ precomputes everything in fft_hkt.comp.glsl that doesn't depend on time """
+        N = self.N
+        self.h0 = h0
+        h0 = np.asarray(h0, dtype=np.float32)
+        h0_k = h0[:N, :N]               # h0(k) at loc
+        h0_mk = h0[N:0:-1, N:0:-1]      # h0 at (N, N) - loc
+        self.h_sum = (h0_k + h0_mk).astype(np.float32)
+        self.h_diff = (h0_k - h0_mk).astype(np.float32)
+
+        k = TWO_PI * (N//2 - np.arange(N)) / self.L
+        k_x, k_z = np.meshgrid(k, k, indexing='xy')
+        k_length = np.sqrt(k_x*k_x + k_z*k_z)
+        w_k = np.sqrt(9.81 * k_length)
+        if self.repeat_period > 0.0:  # quantized frequencies => loops with this period
+            w_0 = TWO_PI / self.repeat_period
+            w_k = np.floor(w_k / w_0) * w_0
+        self.w_k = w_k.astype(np.float32)
+        safe_length = np.where(k_length*k_length > 1e-10, k_length, np.inf)
+        self.n_k = np.stack((k_x / safe_length, k_z / safe_length)).astype(np.float32)
+        self.heights_t = None  # the cached height field was the old spectrum's
+
+    def spectrum(self, t):
+        """ h(k,t) as a complex array, same recombination as fft_hkt.comp.glsl """
+        cos_wt = np.cos(self.w_k * t)
+        sin_wt = np.sin(self.w_k * t)
+        h_real = cos_wt * self.h_sum[..., 0] - sin_wt * self.h_sum[..., 1]
+        h_imag = cos_wt * self.h_diff[..., 1] + sin_wt * self.h_diff[..., 0]
+        return h_real, h_imag
+
+    def compute(self, t):
+        """ fills and returns the (N, N, 4) displacement & gradients arrays, texel (x, y) stored at [y, x] """
+        h_real, h_imag = self.spectrum(t)
+        n_x, n_z = self.n_k
+        fields = np.empty((2, self.N, self.N), dtype=np.complex64)
+        fields[0] = h_real + 1j*h_imag
+        fields[1] = (h_imag*n_x + h_real*n_z) + 1j*(h_imag*n_z - h_real*n_x)
+
+        # both fields transformed in one batched call (2 butterfly passes each on the gpu)
+        fields = np.fft.fft2(fields, axes=(-2, -1))
+
+        d = self.displacement
+        d[..., 0] = self.sign_correction * fields[1].real * CHOPPINESS
+        d[..., 1] = self.sign_correction * fields[0].real * HEIGHT_FACTOR
+        d[..., 2] = self.sign_correction * fields[1].imag * CHOPPINESS
+        d[..., 3] = 1.0
+        self.heights, self.heights_t = d[..., 1].copy(), t
+
+        # finite differences with wrapping, same as fft_gradients.comp.glsl
+        left, right = np.roll(d, 1, axis=1), np.roll(d, -1, axis=1)
+        bottom, top = np.roll(d, 1, axis=0), np.roll(d, -1, axis=0)
+        dx_D = (right[..., 0::2] - left[..., 0::2]) * (self.N / self.L)
+        dy_D = (top[..., 0::2] - bottom[..., 0::2]) * (self.N / self.L)
+        g = self.gradients
+        g[..., 0] = left[..., 1] - right[..., 1]
+        g[..., 1] = bottom[..., 1] - top[..., 1]
+        g[..., 2] = 2 * self.L / self.N
+        g[..., 3] = (1.0 + dx_D[..., 0]) * (1.0 + dy_D[..., 1]) - dx_D[..., 1] * dy_D[..., 0]
+        return self.displacement, self.gradients
+
+    def update(self, t, ocean_grid):
+        """ drop-in replacement of FFT.update: computes the maps and uploads them to the grid's textures """
+        self.follow_wind(ocean_grid)
+        self.compute(t)
+        for text, data in ((ocean_grid.displacement_text, self.displacement), (ocean_grid.gradients_text, self.gradients)):
+            state.edit_texture(GL.GL_TEXTURE_2D, text.glid)
+            GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, 0, self.N, self.N, GL.GL_RGBA, GL.GL_FLOAT, data)
+
+    def bake(self, ocean_grid):
+        """
+        Fills the grid's frames textures with a whole loop. The frames are computed once in a memory-mapped
+        file of the cache, the next launches only upload it.
+        """
+        frames = ocean_grid.displacement_frames.depth
+        period = ocean_grid.repeat_period
+
+        def fill(maps):
+            for frame in range(frames):
+                maps[0, frame], maps[1, frame] = self.compute(frame * period / frames)
+
+        maps = cached_memmap("ocean_frames", (2, frames, self.N, self.N, 4), fill, N=self.N, L=self.L, A=ocean_grid.A,
+                             wind_speed=float(ocean_grid.wind_speed), seed=ocean_grid.seed,
+                             wind_direction=tuple(float(w) for w in ocean_grid.wind_direction),
+                             k_min=float(ocean_grid.k_min), k_max=float(ocean_grid.k_max), period=float(period), frames=frames)
+        for text, data in ((ocean_grid.displacement_frames, maps[0]), (ocean_grid.gradients_frames, maps[1])):
+            state.edit_texture(text.type, text.glid)
+            GL.glTexSubImage3D(text.type, 0, 0, 0, 0, self.N, self.N, frames, GL.GL_RGBA, GL.GL_FLOAT, np.ascontiguousarray(data))
+        state.edit_texture(GL.GL_TEXTURE_3D, 0)
+
+    def height_field(self, t):
+        """ vertical displacement only (one fft instead of two), cached for the last requested time """
+        if self.heights_t != t:
+            h_real, h_imag = self.spectrum(t)
+            heights = np.fft.fft2(h_real + 1j*h_imag).real
+            self.heights, self.heights_t = (self.sign_correction * heights * HEIGHT_FACTOR).astype(np.float32), t
+        return self.heights
+
+    def height_at(self, x, z, t):
+        """
+        Ocean surface height at world positions (x, z), vectorized over arrays.
+        Bilinear lookup of the height field as done by the (repeating) texture fetch in ocean.vert.
+        Horizontal displacement & the flattening near the island are ignored.
+        """
+        heights = self.height_field(t)
+        # same uv as ocean.vert: fract(uv + 1/N) (first cascade) or uv, then texel centers at (i + 0.5)/N
+        u = np.mod(np.asarray(x, dtype=np.float64) / self.patch_size + self.uv_offset, 1.0) * self.N - 0.5
+        v = np.mod(np.asarray(z, dtype=np.float64) / self.patch_size + self.uv_offset, 1.0) * self.N - 0.5
+        u0, v0 = np.floor(u), np.floor(v)
+        fu, fv = u - u0, v - v0
+        u0, v0 = u0.astype(np.int64) % self.N, v0.astype(np.int64) % self.N
+        u1, v1 = (u0 + 1) % self.N, (v0 + 1) % self.N
+        # uv.x follows the grid's x axis and indexes texel columns, uv.y follows z and indexes rows
+        h = ((1-fu)*(1-fv)*heights[v0, u0] + fu*(1-fv)*heights[v0, u1]
+             + (1-fu)*fv*heights[v1, u0] + fu*fv*heights[v1, u1])
+        return h + SEA_LEVEL
+
+
+def benchmark(ocean_grid, frames=100, gpu_fft=None):
+    """
+    Average time (ms) per update of the numpy backend and, if a gpu FFT is given (needs a current GL context),
+    of the compute shaders pipeline: 'gpu' is its execution time on the gpu (one GL_TIME_ELAPSED query per update),
+    'gpu_wall' the cpu time until glFinish, which also counts the submission of the dispatches.
+    """
+    timings = {}
+    cpu_fft = NumpyFFT.from_grid(ocean_grid)
+    start = perf_counter()
+    for frame in range(frames):
+        cpu_fft.compute(frame / 60.0)
+    timings['cpu'] = (perf_counter() - start) * 1000.0 / frames
+
+    if gpu_fft is not None:
+        gpu_fft.update(0.0, ocean_grid)  # warm up
+        GL.glFinish()
+        queries = [int(query) for query in GL.glGenQueries(frames)]
+        start = perf_counter()
+        for frame, query in enumerate(queries):
+            GL.glBeginQuery(GL.GL_TIME_ELAPSED, query)
+            gpu_fft.update(frame / 60.0, ocean_grid)
+            GL.glEndQuery(GL.GL_TIME_ELAPSED)
+        GL.glFinish()
+        timings['gpu_wall'] = (perf_counter() - start) * 1000.0 / frames
+        elapsed = np.zeros(1, dtype=np.int64)  # ns
+        total = 0
+        for query in queries:
+            GL.glGetQueryObjecti64v(query, GL.GL_QUERY_RESULT, elapsed)
+            total += int(elapsed[0])
+        GL.glDeleteQueries(len(queries), queries)
+        timings['gpu'] = total * 1e-6 / frames
+        timings['gpu_dispatches'] = gpu_fft.dispatch_count
+    return timings
+
+
+def cpu_benchmark(sizes=(128, 256, 512), frames=50):
+    """ average time (ms) per update of the numpy backend for a few FFT sizes {N: ms}, doesn't need any GL context """
+    timings = {}
+    for N in sizes:
+        fft = NumpyFFT(N, 256, h0k_spectrum(N, 256, 50.0, 30.0, (1.0, 1.0), 0)["h0"])
+        start = perf_counter()
+        for frame in range(frames):
+            fft.compute(frame / 60.0)
+        timings[N] = (perf_counter() - start) * 1000.0 / frames
+    return timings
@@ -1,70 +1,134 @@
 
 from ctypes import c_float
-from struct import pack
+from utils.cache import cached_arrays
+from utils.shaders import Shader
 from utils.texture import Texture
-from utils.transform import normalized, vec, length_sq
-from math import log2, pi, sqrt, exp
+from utils.transform import normalized, vec
+from math import log2, pi
 import numpy as np
 import OpenGL.GL as GL
 
 
-SIZE = (256+1)*(256+1)
+FFT_SIZES = (128, 256, 512, 1024)  # max butterfly work group is 1024 invocations
 TWO_PI = 2*pi
 
 
 class OceanGrid:
     """
     Ocean grid initializes the Fourier spectrum for the FFT and then calls each frame the FFT class to update the height and normal textures.
+    The initial spectrum h0(k) is either built with numpy (and cached on disk) or, with gpu_spectrum=True, by a compute shader
+    so that changing the wind at runtime only costs one dispatch.
+    With several cascades, each grid only keeps the wavevectors k_min <= |k| < k_max of its band.
+    The displacement & gradients textures can also be baked for a whole loop (see bake), then played back without any FFT.
     """
 
-    def __init__(self, L, N):
+    def __init__(self, L, N, seed=0, gpu_spectrum=False, A=50.0, k_min=0.0, k_max=float('inf'), repeat_period=0.0):
+        assert N in FFT_SIZES, 'FFT size must be one of %s' % (FFT_SIZES,)
         self.L = L
         self.N = N
         self.log2_N = log2(N)
-        self.A = 50.0
+        self.A = A
+        self.k_min = k_min
+        self.k_max = k_max
+        self.repeat_period = repeat_period  # > 0 => the animation loops (see fft_hkt.comp.glsl)
         self.wind_direction = vec(1.0, 1.0)
         self.wind_speed = 30.0
-        self.h0_text = self.init_h0k_text()
-        self.displacement_text = Texture((N, N), GL.GL_CLAMP_TO_EDGE, GL.GL_CLAMP_TO_EDGE,
+        self.seed = seed
+        self.h0 = None  # cpu copy of h0(k), only kept when it is built with numpy
+        self.spectrum_version = 0  # counts the set_wind calls, so that the numpy backends rebuild their copy
+        self.h0_cs = None
+        if gpu_spectrum:
+            self.h0_cs = Shader(compute_source="world/ocean/shaders/cs/fft_h0k.comp.glsl")
+            # the gaussian noise never changes, only the spectrum weighting it does
+            self.noise_text = Texture((N+1, N+1), GL.GL_REPEAT, GL.GL_REPEAT, GL.GL_NEAREST, GL.GL_NEAREST, GL.GL_RG32F, GL.GL_RG,
+                                      data=gaussian_noise(N, seed), is_vec=True)
+            self.h0_text = Texture((N+1, N+1), GL.GL_REPEAT, GL.GL_REPEAT, GL.GL_NEAREST, GL.GL_NEAREST, GL.GL_RG32F, GL.GL_RG,
+                                   data=None, is_vec=True)
+            self.update_h0k_text()
+        else:
+            self.h0_text = self.init_h0k_text()
+        # the fft output is periodic => repeat, cascades are sampled in world space
+        self.displacement_text = Texture((N, N), GL.GL_REPEAT, GL.GL_REPEAT,
                                          GL.GL_LINEAR, GL.GL_LINEAR, GL.GL_RGBA32F, GL.GL_RGBA, is_vec=False)
-        self.gradients_text = Texture((N, N), GL.GL_CLAMP_TO_EDGE, GL.GL_CLAMP_TO_EDGE,
+        self.gradients_text = Texture((N, N), GL.GL_REPEAT, GL.GL_REPEAT,
                                       GL.GL_LINEAR, GL.GL_LINEAR, GL.GL_RGBA32F, GL.GL_RGBA, is_vec=False)
 
-    def phillips_spectrum(self, k, win_dir_n):
-
-        V = self.wind_speed
-        L = (V*V)/9.81
-
-        k_n = normalized(k)
-        k_dot_w = np.dot(k_n, win_dir_n)
-        mag_sq = length_sq(k)
-        l = L/2000.0
-        P_h = self.A * exp(-1.0/(mag_sq*L*L)) * exp(-mag_sq*l*l) * (k_dot_w *
-                                                                    k_dot_w*k_dot_w*k_dot_w*k_dot_w*k_dot_w) / (2.0*mag_sq*mag_sq)
-
-        return P_h
-
-    def init_h0k_text(self):
-        win_dir_n = normalized(self.wind_direction)
-        k = vec(0.0, 0.0)
-        half = self.N/2
-
-        N_plus_1 = self.N + 1
-        h0 = []
-        for m in range(0, N_plus_1):
-            k[1] = TWO_PI * (half - m) / self.L
-            for n in range(0, N_plus_1):
-                k[0] = TWO_PI * (half - n) / self.L
-                sqrt_P_h = 0.0
-                if k[0] != 0.0 or k[1] != 0.0:
-                    sqrt_P_h = sqrt(self.phillips_spectrum(
-                        k=k, win_dir_n=win_dir_n))
-                h0_real = np.random.normal()*sqrt_P_h
-                h0_im = np.random.normal()*sqrt_P_h
-                h0.append(h0_real)
-                h0.append(h0_im)
-        data = pack('f'*len(h0), *h0)
-        return Texture((N_plus_1, N_plus_1), GL.GL_REPEAT, GL.GL_REPEAT, GL.GL_NEAREST, GL.GL_NEAREST, GL.GL_RG32F, GL.GL_RG, data=data, is_vec=True)
+    def bake(self, fft, frames):
+        """ precomputes 'frames' maps of the displacement & gradients over one repeat period, in 3D textures """
+        assert self.repeat_period > 0, 'only a looping ocean can be baked'
+        self.displacement_frames = Texture((self.N, self.N), GL.GL_REPEAT, GL.GL_REPEAT, GL.GL_LINEAR, GL.GL_LINEAR,
+                                           GL.GL_RGBA32F, GL.GL_RGBA, depth=frames)
+        self.gradients_frames = Texture((self.N, self.N), GL.GL_REPEAT, GL.GL_REPEAT, GL.GL_LINEAR, GL.GL_LINEAR,
+                                        GL.GL_RGBA32F, GL.GL_RGBA, depth=frames)
+        fft.bake(self)
+
+    def init_h0k_text(self, cached=True):
+        """ h0(k) built with numpy, from the disk cache for the startup wind (runtime winds would only fill it) """
+        params = dict(N=self.N, L=self.L, A=self.A, wind_speed=float(self.wind_speed),
+                      wind_direction=tuple(float(w) for w in self.wind_direction), seed=self.seed,
+                      k_min=float(self.k_min), k_max=float(self.k_max))
+        self.h0 = (cached_arrays("h0k", h0k_spectrum, **params) if cached else h0k_spectrum(**params))["h0"]
+        return Texture((self.N+1, self.N+1), GL.GL_REPEAT, GL.GL_REPEAT, GL.GL_NEAREST, GL.GL_NEAREST, GL.GL_RG32F, GL.GL_RG, data=self.h0, is_vec=True)
+
+    def update_h0k_text(self):
+        """ regenerates h0(k) in place with the compute shader (gpu_spectrum only) """
+        self.h0_cs.bind()
+        self.h0_cs.set_uniforms(dict(N=self.N, L=self.L, A=self.A, wind_speed=self.wind_speed,
+                                     wind_dir=normalized(self.wind_direction), k_min=self.k_min,
+                                     k_max=min(self.k_max, 1e30)))
+        self.h0_cs.set_image2d_read("noise", self.noise_text)
+        self.h0_cs.set_image2d_write("tilde_h0k", self.h0_text)
+        groups = (self.N + 16) // 16  # N+1 texels per side
+        GL.glDispatchCompute(groups, groups, 1)
+        GL.glMemoryBarrier(GL.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
+
+    def set_wind(self, wind_speed=None, wind_direction=None):
+        """ changes the wind and rebuilds the spectrum (one dispatch with gpu_spectrum, else numpy, not cached) """
+        if wind_speed is not None:
+            self.wind_speed = wind_speed
+        if wind_direction is not None:
+            self.wind_direction = vec(wind_direction)
+        self.spectrum_version += 1
+        if self.h0_cs:
+            self.update_h0k_text()
+        else:
+            self.h0_text = self.init_h0k_text(cached=False)
+
+
+def wavevectors(N, L):
+    """ (N+1, N+1) grids of the wavevector components, row m <-> k_z, column n <-> k_x """
+    k = TWO_PI * (N/2 - np.arange(N+1, dtype=np.float64)) / L
+    return np.meshgrid(k, k, indexing='xy')
+
+
+def phillips_spectrum(k_x, k_z, A, wind_speed, win_dir_n):
+    """ Phillips spectrum evaluated on arrays of wavevectors, 0 for k = 0 """
+    V = wind_speed
+    L = (V*V)/9.81
+    l = L/2000.0
+
+    mag_sq = k_x*k_x + k_z*k_z
+    zero = mag_sq == 0.0
+    mag_sq = np.where(zero, 1.0, mag_sq)  # avoids dividing by 0, masked below
+    k_dot_w = (k_x*win_dir_n[0] + k_z*win_dir_n[1]) / np.sqrt(mag_sq)
+    P_h = A * np.exp(-1.0/(mag_sq*L*L)) * np.exp(-mag_sq*l*l) * k_dot_w**6 / (2.0*mag_sq*mag_sq)
+    return np.where(zero, 0.0, P_h)
+
+
+def gaussian_noise(N, seed):
+    """ (N+1, N+1, 2) standard normal draws, reproducible thanks to the seed """
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((N+1, N+1, 2), dtype=np.float32)
+
+
+def h0k_spectrum(N, L, A, wind_speed, wind_direction, seed, k_min=0.0, k_max=float('inf')):
+    """ h0(k) = gaussian noise * sqrt(P_h(k)), as a float32 (N+1, N+1, 2) array ready for upload """
+    k_x, k_z = wavevectors(N, L)
+    P_h = phillips_spectrum(k_x, k_z, A, wind_speed, normalized(vec(wind_direction)))
+    k_length = np.sqrt(k_x*k_x + k_z*k_z)
+    sqrt_P_h = np.sqrt(np.where((k_length >= k_min) & (k_length < k_max), P_h, 0.0))
+    h0 = gaussian_noise(N, seed) * sqrt_P_h[..., None].astype(np.float32)
+    return dict(h0=h0)
 
 
 def array_numpy(points):
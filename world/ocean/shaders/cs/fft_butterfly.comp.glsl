@@ -1,59 +1,64 @@
 #version 430
 
-#define TWO_PI	6.2831853071795864
+#ifndef RES // set by FFT for other resolutions
 #define RES 256
 #define LOG2_RES 8
+#endif
+#define REFERENCE_N 256
 
-layout (rg32f, binding = 0) uniform readonly image2D readbuff;
-layout (rg32f, binding = 1) uniform writeonly image2D writebuff;
+// rg = height field, ba = choppy field: both complex fields are transformed at once
+layout (rgba32f, binding = 0) uniform readonly image2D readbuff;
+layout (rgba32f, binding = 1) uniform writeonly image2D writebuff;
+// precomputed per (x, stage): rg = twiddle factor W_N^k, ba = indices of the two butterfly inputs
+layout (rgba32f, binding = 2) uniform readonly image2D twiddles;
+
+uniform int last_pass; // 1 => the inversion is applied & the displacement map is written
 
 vec2 mul(vec2 z, vec2 w) { // multiplication btwn 2 complex 2D vectors
 	return vec2(z.x * w.x - z.y * w.y, z.y * w.x + z.x * w.y);
 }
 
-shared vec2 pingpong[2][RES];
+shared vec4 pingpong[2][RES];
 
 layout (local_size_x = RES) in;
 void main()
 {
-	const float N = float(RES);
+	const float choppiness = -120.0;
+	const float height_factor = 120.0;
 
 	int z = int(gl_WorkGroupID.x);
 	int x = int(gl_LocalInvocationID.x);
 
 	int nj = (bitfieldReverse(x) >> (32 - LOG2_RES)) & (RES - 1);
-	pingpong[0][nj] = imageLoad(readbuff, ivec2(z, x)).rg;;
+	pingpong[0][nj] = imageLoad(readbuff, ivec2(z, x));
 
 	barrier();
 
 	// butterfly passes
 	int src = 0;
 
-	for (int s = 1; s <= LOG2_RES; ++s) {
-		int m = 1 << s;				// butterfly group height
-		int mh = m >> 1;			// butterfly group half height
-
-		// k = n * N / 2^stage)
-		int k = (x * (RES / m));
-		int i = (x & ~(m - 1));		// butterfly group starting offset
-		int j = (x & (mh - 1));		// butterfly index in group
-
-		// twiddle factor W_N^k
+	for (int s = 0; s < LOG2_RES; ++s) {
+		vec4 twiddle = imageLoad(twiddles, ivec2(x, s));
+		vec2 W_N_k = twiddle.rg;
 
-		// TODO : compute W_N_k in advance in cpu and store it in a txt
-		float theta = (TWO_PI * float(k)) / N;
-		vec2 W_N_k = vec2(cos(theta), sin(-theta));
-
-		vec2 input1 = pingpong[src][i + j + mh];
-		vec2 input2 = pingpong[src][i + j];
+		vec4 input1 = pingpong[src][int(twiddle.a)];
+		vec4 input2 = pingpong[src][int(twiddle.b)];
 
 		src = 1 - src;
-		pingpong[src][x] = input2 + mul(W_N_k, input1);
+		pingpong[src][x] = input2 + vec4(mul(W_N_k, input1.rg), mul(W_N_k, input1.ba));
 
 		barrier();
 	}
 
 	// STEP 3: write output
-	vec2 result = pingpong[src][x];
-	imageStore(writebuff, ivec2(x, z), vec4(result, 0.0, 1.0));
-}
\ No newline at end of file
+	vec4 result = pingpong[src][x];
+	if (last_pass == 1) {
+		// ifft, normalized by the resolution the height & choppiness factors were tuned for
+		// (the spectrum doesn't depend on N, so the waves keep the same height at any resolution)
+		float sign_correction = ((((x + z) & 1) == 1) ? -1.0 : 1.0) / float(REFERENCE_N*REFERENCE_N);
+		float h = sign_correction * result.r;
+		vec2 D = sign_correction * result.ba;
+		result = vec4(D.x * choppiness, h * height_factor, D.y * choppiness, 1.0);
+	}
+	imageStore(writebuff, ivec2(x, z), result);
+}
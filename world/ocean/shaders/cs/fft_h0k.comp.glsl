@@ -0,0 +1,45 @@
+#version 430 core
+#define M_PI 3.1415926535897932384626433832795
+
+layout(local_size_x=16,local_size_y=16) in;
+
+layout(binding=0,rg32f) readonly uniform image2D noise; // gaussian draws, fixed by the seed
+
+layout(binding=1,rg32f) writeonly uniform image2D tilde_h0k; // initial factors
+
+uniform int N;// resolution
+uniform int L;// ocean size mesh
+uniform float A;
+uniform float wind_speed;
+uniform vec2 wind_dir; // normalized
+uniform float k_min; // band of this cascade
+uniform float k_max;
+
+
+float phillips_spectrum(vec2 k) {
+	float mag_sq = dot(k, k);
+	if (mag_sq == 0.0)
+		return 0.0;
+
+	float L_w = wind_speed * wind_speed / 9.81;
+	float l = L_w / 2000.0;
+	float k_dot_w = dot(k / sqrt(mag_sq), wind_dir);
+	float k_dot_w_2 = k_dot_w * k_dot_w;
+
+	return A * exp(-1.0 / (mag_sq * L_w * L_w)) * exp(-mag_sq * l * l) * k_dot_w_2 * k_dot_w_2 * k_dot_w_2 / (2.0 * mag_sq * mag_sq);
+}
+
+void main(void)
+{
+	ivec2 loc = ivec2(gl_GlobalInvocationID.xy);
+	if (loc.x > N || loc.y > N) // (N+1)x(N+1) texture
+		return;
+
+	vec2 k = (float(N/2) - vec2(loc)) * 2 * M_PI / L;
+
+	float k_length = length(k);
+	float P_h = (k_length >= k_min && k_length < k_max) ? phillips_spectrum(k) : 0.0;
+
+	vec2 h0 = imageLoad(noise, loc).rg * sqrt(P_h);
+	imageStore(tilde_h0k, loc, vec4(h0, 0.0, 0.0));
+}
@@ -3,15 +3,14 @@
 
 layout(local_size_x=16,local_size_y=16) in;
 
-layout(binding=0,rg32f) writeonly uniform image2D tilde_hkt_dy; // height
+layout(binding=0,rgba32f) writeonly uniform image2D tilde_hkt; // rg = height, ba = choppiness
 
-layout(binding=1,rg32f) writeonly uniform image2D Dt_dx_dz; // choppiness
-
-layout(binding=2,rg32f) readonly uniform image2D tilde_h0k; // initial factors
+layout(binding=1,rg32f) readonly uniform image2D tilde_h0k; // initial factors
 
 uniform int N;// resolution
 uniform int L;// ocean size mesh
 uniform float t;
+uniform float repeat_period; // > 0 => frequencies quantized so that the ocean loops with this period
 
 
 vec2 mul_comp(vec2 z, vec2 w) {
@@ -31,6 +30,10 @@ void main(void)
 
 
 	float w_k = sqrt(9.81 * length(k));
+	if (repeat_period > 0.0) {
+		float w_0 = 2 * M_PI / repeat_period;
+		w_k = floor(w_k / w_0) * w_0;
+	}
 	float cos_wt = cos(w_k * t);
 	float sin_wt = sin(w_k * t);
 
@@ -48,7 +51,6 @@ void main(void)
 	vec2 iDt_z = vec2(h_tk.x * nk.y, h_tk.y * nk.y);
 
 	// write ouptut
-	imageStore(tilde_hkt_dy, loc1, vec4(h_tk, 0.0, 0.0));
-	imageStore(Dt_dx_dz, loc1, vec4(Dt_x+ iDt_z, 0.0, 0.0));
+	imageStore(tilde_hkt, loc1, vec4(h_tk, Dt_x + iDt_z));
 
 }
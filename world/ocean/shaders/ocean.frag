@@ -9,10 +9,15 @@ in VS_OUTPUT {
 #define PI 3.14159265359
 
 // simulation related uniforms
+#ifdef BAKED // see ocean.vert
+uniform sampler3D gradients;
+uniform float frame_coord;
+#define SAMPLE(map, uv) texture(map, vec3(uv, frame_coord))
+#else
 uniform sampler2D gradients;
+#define SAMPLE(map, uv) texture(map, uv)
+#endif
 uniform samplerCube skybox;
-uniform vec3 w_camera_position;
-uniform vec3 light_pos;
 
 
 const vec3 deep_blue=vec3(0.0039, 0.0353, 0.1725);
@@ -44,7 +49,7 @@ vec3 get_normal(vec3 slope){
 // ----------------------------------------------------------------------------
 void main()
 {
-    vec4 grad = texture(gradients, IN.uv);
+    vec4 grad = SAMPLE(gradients, IN.uv);
     vec3 water_color = mix(deep_blue, light_blue, smoothstep(40.0, 300.0, IN.position.y));
 
     vec3 n = get_normal(IN.normal);
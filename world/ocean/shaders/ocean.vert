@@ -8,12 +8,37 @@ layout(std430, binding=8) buffer model_matrices {
     mat4 model_matrix[];  
 };
 
-uniform mat4 view;
-uniform mat4 projection;
-uniform sampler2D displacement;
-uniform sampler2D gradients;
-uniform vec3 w_camera_position;
+// BAKED (defined by Ocean) => the maps are 3D textures holding a whole loop, played back at frame_coord
+#ifdef BAKED
+#define OCEAN_MAP sampler3D
+uniform float frame_coord;
+#define SAMPLE(map, uv) texture(map, vec3(uv, frame_coord))
+#else
+#define OCEAN_MAP sampler2D
+#define SAMPLE(map, uv) texture(map, uv)
+#endif
+
+uniform OCEAN_MAP displacement;
+uniform OCEAN_MAP gradients;
+
+// extra cascades (smaller patches) blended on top of the first one, mapped in world space
+#define MAX_CASCADES 3
+uniform OCEAN_MAP displacement_1;
+uniform OCEAN_MAP gradients_1;
+uniform OCEAN_MAP displacement_2;
+uniform OCEAN_MAP gradients_2;
+uniform int cascade_count;
+uniform vec3 cascade_uv_scales; // world xz -> uv, per cascade
 uniform vec2 wind_dir;
+
+// level of detail: each level is drawn with its own grid, its tiles being stored from instance_offset in model_matrix
+uniform int instance_offset;
+uniform float lod_quads; // quads per side of the grid of this level
+uniform float lod_cell;  // size of one quad
+uniform vec2 morph_range; // camera distances where the vertices start & finish morphing into the next (coarser) level
+// the grid covers one sub-tile, the maps repeat over whole tiles
+uniform float tile_subdivisions;
+uniform float subtile_size;
 uniform float t;
 
 // removing tilling effect # TODO LN
@@ -142,21 +167,51 @@ out VS_OUTPUT {
     vec3 normal;
 } OUTPUT;
 
-void main() {
-    vec2 Uv = fract(uv+ 1./256.);
+// slope of the surface (dh/dx, dh/dz) stored in a gradients texel
+vec2 slope(vec4 grad) {
+    return grad.xy / grad.z;
+}
 
-    mat4 model = transpose(model_matrix[gl_InstanceID]);
+// geomorphing (as in CDLOD): odd vertices slide onto their even neighbour as the camera goes away, so that
+// the edges shared with a tile of the next level exactly match its coarser grid (no cracks)
+void morph(inout vec3 p, inout vec2 grid_uv, vec3 world_p) {
+    float dist = length(w_camera_position - vec3(world_p.x, 70.0, world_p.z));
+    float k = clamp((dist - morph_range.x) / (morph_range.y - morph_range.x), 0., 1.);
+    vec2 odd = step(0.5, fract(grid_uv * lod_quads * 0.5 + 0.25));
+    grid_uv -= odd * k / lod_quads;
+    p.xz -= odd * k * lod_cell;
+}
 
-    vec3 d = texture(displacement, Uv).rgb + vec3(0., 70.0, 0.0);
-    vec3 grad = texture(gradients, Uv).xzy;
+void main() {
+    mat4 model = transpose(model_matrix[instance_offset + gl_InstanceID]);
+
+    vec3 p = position;
+    vec2 grid_uv = fract(round(model[3].xz / subtile_size) / tile_subdivisions) + uv / tile_subdivisions; // uv in the tile
+    morph(p, grid_uv, (model * vec4(position, 1.)).xyz);
+    vec2 Uv = fract(grid_uv + 1./float(textureSize(displacement, 0).x));
+
+    vec3 d = SAMPLE(displacement, Uv).rgb + vec3(0., 70.0, 0.0);
+    vec2 s = slope(SAMPLE(gradients, Uv));
+
+    if (cascade_count > 1) {
+        vec2 world_xz = (model * vec4(p, 1.)).xz;
+        vec2 uv_1 = world_xz * cascade_uv_scales.y;
+        d += SAMPLE(displacement_1, uv_1).rgb;
+        s += slope(SAMPLE(gradients_1, uv_1));
+        if (cascade_count > 2) {
+            vec2 uv_2 = world_xz * cascade_uv_scales.z;
+            d += SAMPLE(displacement_2, uv_2).rgb;
+            s += slope(SAMPLE(gradients_2, uv_2));
+        }
+    }
 
-    OUTPUT.uv = uv;
-    vec3 n = grad;
+    OUTPUT.uv = grid_uv;
+    vec3 n = vec3(s.x, 1.0, s.y);
 
     // removing tiling effect
     //tiling(d, n, (model*vec4(position, 1.)).xyz);
     
-    vec3 new_pos = position + d;
+    vec3 new_pos = p + d;
 
     vec3 world_pos = (model * vec4(new_pos, 1.)).xyz;
 
@@ -3,19 +3,20 @@ from random import random, uniform
 from struct import pack
 import OpenGL.GL as GL
 import numpy as np
-from utils.shaders import Shader
+from utils.shaders import Shader, FRAME_DATA, shader_source
 from utils.texture import Texture
+from utils.gl_state import state
 from math import pi, sin, cos
 
 class SmokeParticleSystem:
     """
     Class handling the smoke particles system.
     """
-    def __init__(self):
+    def __init__(self, nb_particles=32768):
 
         # initializing particles positions & speed
 
-        self.nb_particles = 32768
+        self.nb_particles = nb_particles  # multiple of 16, the compute shader's work group size
         
         sample_chisquared = np.random.noncentral_chisquare(df=1, nonc=0.00001, size=self.nb_particles)
         self.velocities = np.zeros((self.nb_particles, 4), dtype=np.float32)
@@ -39,7 +40,9 @@ class SmokeParticleSystem:
 
 
         # init buffers & shader program
-        self.shader = Shader(vertex_source="world/particles/smoke/smoke.vert", geom_source="world/particles/smoke/smoke.geom", fragment_source="world/particles/smoke/smoke.frag")
+        self.shader = Shader(vertex_source="world/particles/smoke/smoke.vert",
+                             geom_source=shader_source("world/particles/smoke/smoke.geom", FRAME_DATA),
+                             fragment_source="world/particles/smoke/smoke.frag")
         self.cs = Shader(compute_source="world/particles/smoke/update.comp.glsl")
 
         # binding the ssbos to the compute shader program && generating buffers
@@ -66,10 +69,10 @@ class SmokeParticleSystem:
             
             
             self.buffers[name] = GL.glGenBuffers(1)
-            GL.glBindBuffer(GL.GL_SHADER_STORAGE_BUFFER, self.buffers[name])
+            state.bind_buffer(GL.GL_SHADER_STORAGE_BUFFER, self.buffers[name])
 
             GL.glBufferData(GL.GL_SHADER_STORAGE_BUFFER, data.nbytes, data, GL.GL_DYNAMIC_DRAW)
-            GL.glBindBufferBase(GL.GL_SHADER_STORAGE_BUFFER, buffer_count, self.buffers[name])
+            state.bind_buffer_base(GL.GL_SHADER_STORAGE_BUFFER, buffer_count, self.buffers[name])
             
             buffer_count+=1
         
@@ -81,7 +84,7 @@ class SmokeParticleSystem:
         # optionally update the data attribute VBOs, useful for e.g. particles
         GL.glDrawArrays(GL.GL_POINTS, 0, self.nb_particles)
 
-    def draw(self, dt, camera):
+    def draw(self, dt):
 
         # updating particles
         self.cs.bind()
@@ -92,15 +95,13 @@ class SmokeParticleSystem:
         # rendering particles
 
         # binding atlas
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(self.sprites.type, self.sprites.glid)
+        state.bind_texture(0, self.sprites.type, self.sprites.glid)
 
 
         self.shader.bind()
         self.shader.set_int("sprites", 0)
-        self.shader.set_uniforms(dict(view=camera.view, proj=camera.proj, up=camera.up, rgt=camera.rgt))
 
         # draw
-        GL.glEnable(GL.GL_BLEND)
+        state.enable(GL.GL_BLEND)
         self.execute()
 
@@ -3,18 +3,19 @@ from random import random, uniform
 from struct import pack
 import OpenGL.GL as GL
 import numpy as np
-from utils.shaders import Shader
+from utils.shaders import Shader, FRAME_DATA, shader_source
 from utils.texture import Texture
+from utils.gl_state import state
 from math import pi, sin, cos
 
 class SplashParticleSystem:
     """
     Class handling the splash particles system.
     """
-    def __init__(self):
+    def __init__(self, nb_particles=1024):
 
         # initializing particles positions & speed
-        self.nb_particles = 1024
+        self.nb_particles = nb_particles  # multiple of 16, the compute shader's work group size
 
         self.velocities = np.zeros((self.nb_particles, 4), dtype=np.float32)
         self.positions = [(uniform(-10.0, 10.0), 1370.0, uniform(-10.0, 10.0), uniform(25.0, 50.0)) for _ in range(self.nb_particles)]
@@ -36,7 +37,9 @@ class SplashParticleSystem:
 
 
         # init buffers & shader program
-        self.shader = Shader(vertex_source="world/particles/splashes/splash.vert", geom_source="world/particles/splashes/splash.geom", fragment_source="world/particles/splashes/splash.frag")
+        self.shader = Shader(vertex_source="world/particles/splashes/splash.vert",
+                             geom_source=shader_source("world/particles/splashes/splash.geom", FRAME_DATA),
+                             fragment_source="world/particles/splashes/splash.frag")
         self.cs = Shader(compute_source="world/particles/splashes/update.comp.glsl")
 
         # binding the ssbos to the compute shader program && generating buffers
@@ -62,10 +65,10 @@ class SplashParticleSystem:
             
             
             self.buffers[name] = GL.glGenBuffers(1)
-            GL.glBindBuffer(GL.GL_SHADER_STORAGE_BUFFER, self.buffers[name])
+            state.bind_buffer(GL.GL_SHADER_STORAGE_BUFFER, self.buffers[name])
 
             GL.glBufferData(GL.GL_SHADER_STORAGE_BUFFER, data.nbytes, data, GL.GL_DYNAMIC_DRAW)
-            GL.glBindBufferBase(GL.GL_SHADER_STORAGE_BUFFER, buffer_count, self.buffers[name])
+            state.bind_buffer_base(GL.GL_SHADER_STORAGE_BUFFER, buffer_count, self.buffers[name])
             
             buffer_count+=1
         
@@ -77,7 +80,7 @@ class SplashParticleSystem:
         # optionally update the data attribute VBOs, useful for e.g. particles
         GL.glDrawArrays(GL.GL_POINTS, 0, self.nb_particles)
 
-    def draw(self, dt, camera):
+    def draw(self, dt):
 
         # updating particles
         self.cs.bind()
@@ -89,7 +92,6 @@ class SplashParticleSystem:
 
         # binding atlas
         self.shader.bind()
-        self.shader.set_uniforms(dict(view=camera.view, proj=camera.proj, up=camera.up, rgt=camera.rgt))
 
         # draw
         self.execute()
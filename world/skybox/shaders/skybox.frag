@@ -3,7 +3,6 @@
 in vec3 tex_coords;
 
 uniform samplerCube cubemap;
-uniform vec3 w_camera_position;
 
 const float lower_bound = 0.0;
 const float upper_bound = 10.0;
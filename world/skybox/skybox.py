@@ -1,8 +1,8 @@
 from utils.primitives import Cube
-from utils.shaders import Shader
-import OpenGL.GL as GL
+from utils.shaders import Shader, FRAME_DATA, shader_source
 
 from utils.texture import Texture
+from utils.gl_state import state
 
 class Skybox:
     """
@@ -11,19 +11,16 @@ class Skybox:
     """
     def __init__(self, size):
         self.size = size
-        self.shader = Shader(vertex_source="world/skybox/shaders/skybox.vert", fragment_source="world/skybox/shaders/skybox.frag")
+        self.shader = Shader(vertex_source=shader_source("world/skybox/shaders/skybox.vert", FRAME_DATA),
+                             fragment_source=shader_source("world/skybox/shaders/skybox.frag", FRAME_DATA))
         self.cube = Cube(shader=self.shader,r=size)
         self.cubemap_text = Texture(cubemap_faces=["right", "left", "top", "bottom", "back", "front"])
 
         
-    def draw(self, view, proj):
+    def draw(self):
         self.shader.bind()
 
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        GL.glBindTexture(self.cubemap_text.type, self.cubemap_text.glid)
+        state.bind_texture(0, self.cubemap_text.type, self.cubemap_text.glid)
         self.shader.set_int("cubemap", 0)
 
-        self.shader.set_mat4("view", view)
-        self.shader.set_mat4("proj", proj)
-
         self.cube.draw()
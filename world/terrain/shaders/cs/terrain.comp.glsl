@@ -1,12 +1,15 @@
 #version 430 core
 
-layout (binding=0, rgba32f) uniform writeonly image2D map;
+layout (binding=0, rgba32f) uniform writeonly image2DArray maps; // one layer per tile
 
 layout (local_size_x = 16, local_size_y=16) in;
 
+layout(std430, binding=9) buffer model_matrices { // to get world pos, one per tile (z of the work group)
+    mat4 model_matrix[];
+};
+
 uniform int size;
 uniform float scale_factor;
-uniform mat4 model; // to get world pos
 
 
 float total_size = 2*float(size);
@@ -128,9 +131,10 @@ vec3 get_normal(vec2 p) {
 }
 
 void main() {
-    ivec2 x	= ivec2(gl_GlobalInvocationID.xy);
+    ivec3 x	= ivec3(gl_GlobalInvocationID);
+    mat4 model = transpose(model_matrix[x.z]);
     
     vec3 world_pos = (model * vec4(x.x * scale_factor, 0., x.y*scale_factor, 1.)).xyz;
 
-    imageStore(map, x, vec4(height_terrain(world_pos.xz), get_normal(world_pos.xz)));
+    imageStore(maps, x, vec4(height_terrain(world_pos.xz), get_normal(world_pos.xz)));
 }
\ No newline at end of file
@@ -8,10 +8,8 @@ in VS_OUTPUT {
 
 const vec3 light_col = vec3(1.);
 const vec3 ambient_light = vec3(0.2196, 0.5922, 0.7059);
-uniform vec3 w_camera_position;
 
 out vec4 out_color;
-uniform vec3 light_pos;
 
 vec3 albedo_from_height(float height)
 {
@@ -1,15 +1,18 @@
-#version 330 core
+#version 430 core
 
 in vec3 position;
 in vec2 uv;
 in vec3 normal;
 
-uniform sampler2D map;
-uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
+uniform sampler2DArray map; // one layer per tile
+
+layout(std430, binding=9) buffer model_matrices { // one per tile, see Terrain
+    mat4 model_matrix[];
+};
+layout(std430, binding=11) readonly buffer visible_tiles { // tiles inside the frustum, one per instance
+    int tile_index[];
+};
 uniform int size;
-uniform vec3 w_camera_position;
 
 const vec3 fog_plane_point = vec3(0., 500., 0.);
 
@@ -50,7 +53,9 @@ out VS_OUTPUT {
 void main() {
     OUTPUT.uv = uv;
 
-    vec4 map_coefs = texture(map, uv);
+    int tile = tile_index[gl_InstanceID];
+    vec4 map_coefs = texture(map, vec3(uv, tile));
+    mat4 model = transpose(model_matrix[tile]);
     
     vec3 pos = vec3(position.x, map_coefs.x, position.z);
     OUTPUT.position = (model * vec4(pos, 1.)).xyz;
@@ -1,52 +1,104 @@
 from utils.primitives import Grid
 import OpenGL.GL as GL
 
-from utils.shaders import Shader
+from utils.shaders import Shader, FRAME_DATA, shader_source
 from utils.texture import Texture
+from utils.gl_state import state
 import numpy as np
 
+TILES_BINDING = 9  # binding of the ssbo of the tiles' model matrices, as in terrain.vert & terrain.comp.glsl
+VISIBLE_TILES_BINDING = 11  # indices of the tiles drawn (inside the camera's frustum), as in terrain.vert
+
 class Terrain:
     """
     Class that handles the terrain.
-    Compute the height & normal maps at the beginning by calling a compute shader.
-    These maps are then used inside the vertex & fragment shaders to color the terrain.
+    Compute the height & normal maps of every tile at the beginning, in one dispatch of a compute shader into the
+    layers of a texture array. These maps are then used inside the vertex & fragment shaders to color the terrain,
+    all the tiles being drawn at once (instanced, model matrices read from a ssbo as for the ocean).
+    Given a frustum, only the tiles whose bounding box is inside are drawn: their indices are given to
+    terrain.vert in a second ssbo.
     """
     def __init__(self, size, size_factor, model_matrices, N):
         self.size = size
-        self.grid = Grid(Shader(vertex_source="world/terrain/shaders/terrain.vert", fragment_source="world/terrain/shaders/terrain.frag"), size=size, size_factor=size_factor)
+        self.grid = Grid(Shader(vertex_source=shader_source("world/terrain/shaders/terrain.vert", FRAME_DATA),
+                                fragment_source=shader_source("world/terrain/shaders/terrain.frag", FRAME_DATA)),
+                         size=size, size_factor=size_factor)
         self.scale_factor = size_factor
         self.twoN = 2*N
         self.N = N//2
-        self.maps = np.zeros(self.twoN * self.twoN, dtype=Texture)
         self.model_matrices = model_matrices
-        cs = Shader(compute_source="world/terrain/shaders/cs/terrain.comp.glsl")
-        for i in range (-self.N, self.N):
-            for j in range(-self.N, self.N):
-                index = i* self.twoN + j
-                self.maps[index] = self.get_map(model_matrices[index], cs)
-
-    def draw(self, primitives=GL.GL_TRIANGLES, skybox=None,**uniforms):
-        for i in range (-self.N, self.N):
-            for j in range (-self.N, self.N):
-                index = i* self.twoN + j
-                GL.glActiveTexture(GL.GL_TEXTURE0)
-                GL.glBindTexture(self.maps[index].type, self.maps[index].glid)
-                GL.glActiveTexture(GL.GL_TEXTURE1)
-                GL.glBindTexture(skybox.type, skybox.glid)
-                self.grid.shader.bind()
-                self.grid.shader.set_int("map", 0)
-                self.grid.shader.set_int("skybox", 1)
-                self.grid.draw(primitives=primitives, model=self.model_matrices[index], **uniforms)
-                GL.glBindTexture(self.maps[index].type, 0)
-
-
-    def get_map(self, model, cs):
-        map_text = Texture((self.size,self.size), GL.GL_CLAMP_TO_EDGE, GL.GL_CLAMP_TO_EDGE, GL.GL_LINEAR, GL.GL_LINEAR, GL.GL_RGBA32F, GL.GL_RGBA, is_vec=False)
+        # tile t of the ssbo <=> layer t of the maps
+        self.indices = [i*self.twoN + j for i in range(-self.N, self.N) for j in range(-self.N, self.N)]
+        self.tiles_matrices = np.ascontiguousarray(model_matrices[self.indices], dtype=np.float32)
+
+        self.ssbo = GL.glGenBuffers(1)
+        state.bind_buffer(GL.GL_SHADER_STORAGE_BUFFER, self.ssbo)
+        GL.glBufferData(GL.GL_SHADER_STORAGE_BUFFER, self.tiles_matrices.nbytes, self.tiles_matrices, GL.GL_STATIC_DRAW)
+        state.bind_buffer_base(GL.GL_SHADER_STORAGE_BUFFER, TILES_BINDING, self.ssbo)
+
+        self.maps = self.get_maps(Shader(compute_source="world/terrain/shaders/cs/terrain.comp.glsl"))
+        self.tiles_boxes = self.get_boxes()
+
+        self.visible_tiles = np.arange(len(self.indices), dtype=np.int32)
+        self.visible_ssbo = GL.glGenBuffers(1)
+        state.bind_buffer(GL.GL_SHADER_STORAGE_BUFFER, self.visible_ssbo)
+        GL.glBufferData(GL.GL_SHADER_STORAGE_BUFFER, self.visible_tiles.nbytes, self.visible_tiles, GL.GL_DYNAMIC_DRAW)
+        state.bind_buffer_base(GL.GL_SHADER_STORAGE_BUFFER, VISIBLE_TILES_BINDING, self.visible_ssbo)
+
+    def draw(self, primitives=GL.GL_TRIANGLES, skybox=None, frustum=None, **uniforms):
+        if frustum is not None:
+            tiles = np.flatnonzero(frustum.visible(self.tiles_boxes)).astype(np.int32)
+            frustum.account(len(tiles), len(self.indices))
+            if len(tiles) and not np.array_equal(tiles, self.visible_tiles):
+                state.bind_buffer(GL.GL_SHADER_STORAGE_BUFFER, self.visible_ssbo)
+                GL.glBufferSubData(GL.GL_SHADER_STORAGE_BUFFER, 0, tiles.nbytes, tiles)
+                self.visible_tiles = tiles
+            if len(tiles) == 0:
+                return
+        self.grid.vertex_array.arguments = (self.grid.vertex_array.index_buffer.size, GL.GL_UNSIGNED_INT, None,
+                                            len(self.visible_tiles))
+        state.bind_texture(0, self.maps.type, self.maps.glid)
+        state.bind_texture(1, skybox.type, skybox.glid)
+        self.grid.draw(primitives=primitives, map=0, skybox=1, draw_command=GL.glDrawElementsInstanced, **uniforms)
+
+    def height_field(self):
+        """
+        Heights of all the tiles read back from the maps, in one array: heights[z, x] is at origin + cell * (x, z).
+        Neighbour tiles share their border samples.
+        """
+        cell = self.scale_factor
+        step = self.size - 1
+        corners = self.tiles_matrices[:, [0, 2], 3]
+        origin = corners.min(axis=0)
+        tiles = np.rint((corners - origin) / (cell * step)).astype(int)
+        count_x, count_z = tiles.max(axis=0) + 1
+        layers = self.read_heights()
+        heights = np.zeros((count_z*step + 1, count_x*step + 1), dtype=np.float32)
+        for layer, (x, z) in zip(layers, tiles):
+            heights[z*step:z*step + self.size, x*step:x*step + self.size] = layer
+        return heights, origin, cell
+
+    def read_heights(self):
+        """ heights of every tile read back from the maps, (tiles, size, size) """
+        state.edit_texture(self.maps.type, self.maps.glid)
+        data = GL.glGetTexImage(self.maps.type, 0, GL.GL_RGBA, GL.GL_FLOAT)
+        return np.frombuffer(data, np.float32).reshape(len(self.indices), self.size, self.size, 4)[..., 0]
+
+    def get_boxes(self):
+        """ world bounding box of each tile, (tiles, 2, 3): the grid's extent around the tile's heights """
+        layers = self.read_heights().reshape(len(self.indices), -1)
+        boxes = np.repeat(self.grid.bounds[None], len(self.indices), axis=0)
+        boxes[:, 0, 1], boxes[:, 1, 1] = layers.min(axis=1), layers.max(axis=1)
+        return boxes + self.tiles_matrices[:, None, :3, 3]
+
+    def get_maps(self, cs):
+        """ height (r) & normal (gba) maps of all the tiles, one layer per tile, in a single dispatch """
+        maps = Texture((self.size, self.size), GL.GL_CLAMP_TO_EDGE, GL.GL_CLAMP_TO_EDGE, GL.GL_LINEAR, GL.GL_LINEAR,
+                       GL.GL_RGBA32F, GL.GL_RGBA, depth=len(self.indices), layered=True)
         cs.bind()
-        cs.set_image2d_write("map", map_text)
+        cs.set_image2d_array_write("maps", maps)
         cs.set_int("size", self.size)
         cs.set_float("scale_factor", self.scale_factor)
-        cs.set_mat4("model", model)
-        GL.glDispatchCompute(self.size//16, self.size//16, 1)
-        GL.glMemoryBarrier(GL.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT)
-        return map_text
+        GL.glDispatchCompute(self.size//16, self.size//16, len(self.indices))
+        GL.glMemoryBarrier(GL.GL_SHADER_IMAGE_ACCESS_BARRIER_BIT | GL.GL_TEXTURE_FETCH_BARRIER_BIT | GL.GL_TEXTURE_UPDATE_BARRIER_BIT)
+        return maps
@@ -7,11 +7,9 @@ in VS_OUTPUT {
     vec3 normal;
 } IN;
 
-const vec3 light_pos = vec3(5000.0, 5000.0, -5000.0);
 const vec3 light_col = vec3(1.);
 const vec3 ambient_light = vec3(0.2196, 0.5922, 0.7059);
 
-uniform vec3 w_camera_position;
 
 // output fragment color for OpenGL
 out vec4 out_color;
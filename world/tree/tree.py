@@ -7,7 +7,7 @@ import random as rd
 
 from utils.transform import translate, rotate, scale, sincos, quaternion_from_axis_angle
 from utils.primitives import Cylinder
-from utils.shaders import Shader
+from utils.shaders import Shader, FRAME_DATA, INSTANCES, INSTANCES_BINDING, shader_source
 
 SEUIL = 12
 FACTOR = 0.9
@@ -27,7 +27,9 @@ def make_tree(cos, sin):
     angle_branch = 50
 
     # initialization of the cylinder used for all the tree
-    shader = Shader(vertex_source="world/tree/shaders/tree.vert", fragment_source="world/tree/shaders/tree.frag")
+    shader = Shader(vertex_source=shader_source("world/tree/shaders/tree.vert", FRAME_DATA, INSTANCES,
+                                                INSTANCES_BINDING=INSTANCES_BINDING),
+                    fragment_source=shader_source("world/tree/shaders/tree.frag", FRAME_DATA))
     cylinder = Cylinder(shader, 10, 2, 3/4, 1, cos, sin)
 
     basic_shapes = []
@@ -9,9 +9,6 @@ in VS_OUTPUT {
 const vec3 light_col = vec3(1.);
 const vec3 ambient_light = vec3(0.2196, 0.5922, 0.7059);
 
-uniform vec3 w_camera_position;
-uniform vec3 light_pos;
-
 // output fragment color for OpenGL
 out vec4 out_color;
 
@@ -6,7 +6,7 @@ Python OpenGL wind turbine maker.
 # External, non built-in modules
 from utils.transform import translate, rotate, scale, quaternion_from_axis_angle
 from utils.primitives import Cylinder
-from utils.shaders import Shader
+from utils.shaders import Shader, FRAME_DATA, INSTANCES, INSTANCES_BINDING, shader_source
 
 
 def make_turbine(cos, sin, slices):
@@ -19,8 +19,9 @@ def make_turbine(cos, sin, slices):
     no_axis = (0, 0, 0)
 
     # initialize the cylinder used
-    shader = Shader(vertex_source="world/wind_turbine/shaders/wind_turbine.vert",
-                    fragment_source="world/wind_turbine/shaders/wind_turbine.frag")
+    shader = Shader(vertex_source=shader_source("world/wind_turbine/shaders/wind_turbine.vert", FRAME_DATA, INSTANCES,
+                                                INSTANCES_BINDING=INSTANCES_BINDING),
+                    fragment_source=shader_source("world/wind_turbine/shaders/wind_turbine.frag", FRAME_DATA))
     cylinder = Cylinder(shader, slices, 2, 2/3, 1, cos, sin)
 
     #creation of the four parts